@@ -0,0 +1,270 @@
+# Measures the Lambda cold start in fresh interpreters, one phase at a time: importing handler, the first Handler.get_instance(), the first handle() of
+# each route, and warm invocations after that. MySQL and Google's certificate endpoint are stubbed out (so no database or network is needed), which
+# means the numbers are all our own code and imports. Also reports what each top level package costs to import (from -X importtime), and exits with
+# a failure if any phase or package goes over its budget, so that import weight regressions are caught before deploying.
+#   cd bench && python cold_start.py [--runs 10] [--warm 50] [--budget import=100] [--module-budget pymysql=0] [--route get_ladders]
+import sys
+import os
+
+sys.path.append(os.path.abspath(__file__ + "/../../"))
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+
+import argparse
+import json
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+PHASES = ["import", "get_instance", "first_handle", "warm"]
+# Milliseconds (the median across runs). Generous enough for a laptop or CI runner, tight enough to catch a heavy import sneaking back in
+PHASE_BUDGETS_MS = {
+    "import": 100,
+    "get_instance": 5,
+    "first_handle": 250,
+    "warm": 10,
+}
+# Milliseconds that a top level package may add to the import of handler. These are only needed once a request uses them, so they shouldn't be imported
+# up front at all
+MODULE_BUDGETS_MS = {
+    "firebase_admin": 0,
+    "google": 0,
+    "dateutil": 0,
+    "pymysql": 0,
+    "cryptography": 0,
+}
+ROUTES = {
+    "decrement_borrowed_points": {"decrement-borrowed-points": True},
+    "get_ladders": {"resource": "/ladders", "httpMethod": "GET", "headers": {}},
+    "get_ladders_authenticated": {"resource": "/ladders", "httpMethod": "GET", "headers": {"X-Firebase-Token": "{token}"}},
+    "get_players": {"resource": "/ladders/{ladder_id}/players", "httpMethod": "GET", "pathParameters": {"ladder_id": "1"}, "headers": {}},
+    "get_matches": {"resource": "/ladders/{ladder_id}/players/{user_id}/matches", "httpMethod": "GET", "pathParameters": {"ladder_id": "1", "user_id": "BENCH"}, "headers": {}},
+    "report_match_unauthenticated": {"resource": "/ladders/{ladder_id}/matches", "httpMethod": "POST", "pathParameters": {"ladder_id": "1"}, "headers": {}, "body": "{}"},
+}
+PHASE_MARKER = "cold_start phase: "
+PROJECT_ID = "tennis-ladder-bench"
+
+
+# region Child (runs in the fresh interpreter being measured)
+
+def run_child(route, warm_runs):
+    install_database_stub()
+    event = json.loads(json.dumps(ROUTES[route]).replace("{token}", os.environ.get("BENCH_TOKEN", "")))
+    timings = {}
+    real_stdout = sys.stdout
+    # The handler logs every request, and the SQL metrics for it
+    sys.stdout = open(os.devnull, "w")
+
+    mark("import")
+    start = time.perf_counter()
+    import handler
+    timings["import"] = elapsed_ms(start)
+
+    mark("get_instance")
+    start = time.perf_counter()
+    handler.Handler.get_instance()
+    timings["get_instance"] = elapsed_ms(start)
+
+    mark("first_handle")
+    start = time.perf_counter()
+    response = handler.handle(event, None)
+    timings["first_handle"] = elapsed_ms(start)
+
+    mark("warm")
+    warm_timings = []
+    for _ in range(warm_runs):
+        start = time.perf_counter()
+        handler.handle(event, None)
+        warm_timings.append(elapsed_ms(start))
+    timings["warm"] = statistics.median(warm_timings) if warm_timings else 0
+
+    sys.stdout = real_stdout
+    print(json.dumps({"timings": timings, "status_code": response.get("statusCode")}))
+
+
+def install_database_stub():
+    """Swaps pymysql.connect for a connection that returns no rows, as soon as (and only if) pymysql gets imported, so that the import is still measured"""
+    import importlib.abc
+    import importlib.machinery
+
+    class Cursor:
+        lastrowid = 1
+
+        def __enter__(self): return self
+
+        def __exit__(self, *_): pass
+
+        def execute(self, sql, args=None): return 0
+
+        def fetchall(self): return []
+
+        def fetchone(self): return None
+
+    class Connection:
+        def cursor(self): return Cursor()
+
+        def ping(self, reconnect=False): pass
+
+        def close(self): pass
+
+    class PymysqlStubber(importlib.abc.MetaPathFinder):
+        def find_spec(self, name, path, target=None):
+            if name != "pymysql":
+                return None
+            spec = importlib.machinery.PathFinder.find_spec(name, path)
+            exec_module = spec.loader.exec_module
+
+            def exec_and_stub(module):
+                exec_module(module)
+                module.connect = lambda *args, **kwargs: Connection()
+
+            spec.loader.exec_module = exec_and_stub
+            return spec
+
+    sys.meta_path.insert(0, PymysqlStubber())
+
+
+def mark(phase):
+    # -X importtime writes to stderr as each import finishes, so this splits its output up by phase
+    sys.stderr.write(PHASE_MARKER + phase + "\n")
+    sys.stderr.flush()
+
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+# endregion
+# region Parent
+
+
+def create_certificates(temp_dir):
+    """Signs a token with a throwaway key and saves its certificate where the CertificateStore will find it, like a warm /tmp on Lambda"""
+    from firebase_client_unit_test import generate_key_and_certificate
+    from google.auth import crypt, jwt
+
+    private_key, certificate = generate_key_and_certificate()
+    path = os.path.join(temp_dir, "firebase_certificates.json")
+    with open(path, "w") as f:
+        json.dump({"certificates": {"bench": certificate}, "expires_at": time.time() + 24 * 60 * 60}, f)
+
+    now = int(time.time())
+    token = jwt.encode(crypt.RSASigner.from_string(private_key, key_id="bench"), {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}", "aud": PROJECT_ID, "sub": "BENCH", "user_id": "BENCH", "email": "bench@bench.com", "iat": now,
+        "exp": now + 24 * 60 * 60
+    }).decode()
+    return path, token
+
+
+def run_route(route, runs, warm_runs, env):
+    command = [sys.executable, os.path.abspath(__file__), "--child", route, "--warm", str(warm_runs)]
+    timings = defaultdict(list)
+    for _ in range(runs):
+        result = subprocess.run(command, capture_output=True, text=True, env=env)
+        if result.returncode != 0:
+            raise RuntimeError(f"{route} failed:\n{result.stderr}")
+        for phase, ms in json.loads(result.stdout.splitlines()[-1])["timings"].items():
+            timings[phase].append(ms)
+
+    # -X importtime slows imports down, so the package breakdown comes from separate runs
+    module_costs = defaultdict(lambda: defaultdict(list))
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime"] + command[1:], capture_output=True, text=True, env=env)
+        for phase, costs in parse_import_times(result.stderr).items():
+            for package, ms in costs.items():
+                module_costs[phase][package].append(ms)
+
+    return (
+        {phase: statistics.median(values) for phase, values in timings.items()},
+        {phase: {package: sum(values) / runs for package, values in costs.items()} for phase, costs in module_costs.items()}
+    )
+
+
+def parse_import_times(stderr):
+    """Adds up the self time of every module imported in each phase by top level package (so google.auth.jwt and google.auth.crypt both count as google)"""
+    costs = defaultdict(lambda: defaultdict(float))
+    phase = None
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER):]
+        elif line.startswith("import time:") and phase is not None:
+            self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+            if self_us.isdigit():
+                costs[phase][name.split(".")[0]] += int(self_us) / 1000
+    return costs
+
+
+def check_budgets(route, timings, module_costs, phase_budgets, module_budgets):
+    failures = []
+    for phase, budget in phase_budgets.items():
+        if timings.get(phase, 0) > budget:
+            failures.append(f"{route}: {phase} took {timings[phase]:.1f}ms (budget {budget}ms)")
+    for package, budget in module_budgets.items():
+        cost = module_costs.get("import", {}).get(package)
+        if cost is not None and cost > budget:
+            failures.append(f"{route}: importing handler spent {cost:.1f}ms importing {package} (budget {budget}ms)")
+    return failures
+
+
+def print_module_costs(module_costs, top):
+    for phase in PHASES:
+        costs = sorted(module_costs.get(phase, {}).items(), key=lambda item: -item[1])[:top]
+        if costs:
+            print(f"    {phase}: " + ", ".join(f"{package} {ms:.1f}" for package, ms in costs))
+
+
+def parse_budgets(values, defaults):
+    budgets = dict(defaults)
+    for value in values or []:
+        name, ms = value.split("=")
+        budgets[name] = float(ms)
+    return budgets
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Cold start benchmark for the Lambda entry point")
+    arg_parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per route")
+    arg_parser.add_argument("--warm", type=int, default=50, help="warm invocations per interpreter")
+    arg_parser.add_argument("--route", action="append", choices=list(ROUTES), help="only run these routes")
+    arg_parser.add_argument("--budget", action="append", metavar="PHASE=MS", help=f"override a phase budget {PHASE_BUDGETS_MS}")
+    arg_parser.add_argument("--module-budget", action="append", metavar="PACKAGE=MS", help=f"override or add an import budget {MODULE_BUDGETS_MS}")
+    arg_parser.add_argument("--top", type=int, default=8, help="how many of the most expensive packages to list per phase")
+    arg_parser.add_argument("--child", choices=list(ROUTES), help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child, args.warm)
+        return
+
+    phase_budgets = parse_budgets(args.budget, PHASE_BUDGETS_MS)
+    module_budgets = parse_budgets(args.module_budget, MODULE_BUDGETS_MS)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        certificates_path, token = create_certificates(temp_dir)
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(sys.path),
+            "DB_HOST": "stub", "DB_USERNAME": "stub", "DB_PASSWORD": "stub", "DB_DATABASE_NAME": "stub",
+            "FIREBASE_PROJECT_ID": PROJECT_ID,
+            "FIREBASE_CERTIFICATES_PATH": certificates_path,
+            "BENCH_TOKEN": token,
+        }
+
+        failures = []
+        print(f"{'route':<30} " + " ".join(f"{phase + ' ms':>16}" for phase in PHASES))
+        for route in args.route or ROUTES:
+            timings, module_costs = run_route(route, args.runs, args.warm, env)
+            print(f"{route:<30} " + " ".join(f"{timings.get(phase, 0):>16.2f}" for phase in PHASES))
+            print_module_costs(module_costs, args.top)
+            failures += check_budgets(route, timings, module_costs, phase_budgets, module_budgets)
+
+    if failures:
+        print("\nOver budget:\n  " + "\n  ".join(failures))
+        exit(1)
+    print("\nAll phases within budget")
+
+
+# endregion
+
+if __name__ == "__main__":
+    main()
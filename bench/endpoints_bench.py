@@ -0,0 +1,362 @@
+# Runs every route in api.json (and both scheduled events) through the real Handler, ManagerImpl and DaoImpl queries, against generated ladders of several
+# sizes (test/dataset.py) in an in-memory SqliteDao, so no database or network is needed. For each request it reports the median wall time and the SQL
+# statements (including BEGIN and COMMIT), rows fetched and response bytes. Every case has a checked in budget for its statements and its latency, and the
+# run fails if one goes over. The statement budgets hold at every size, which is what catches a query per player or a query that's run more than once.
+#   cd bench && python endpoints_bench.py [--sizes 50,500,2000] [--runs 5] [--case report_match] [--budget report_match=12] [--verbose]
+import sys
+import os
+
+sys.path.append(os.path.abspath(__file__ + "/../../"))
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import sqlite_da
+from bl import ManagerImpl
+from dataset import generate, load
+from domain import Ladder, Match, User
+from firebase_client import FirebaseClient
+from handler import Handler
+from router import ROUTER
+
+SIZES = [50, 500, 2000]
+ADMIN_ID = "BENCH_ADMIN"
+IMPORTED_MATCHES = 20
+# The most statements (including BEGIN and COMMIT) that one request may send, at any ladder size
+STATEMENT_BUDGETS = {
+    "get_ladders": 1,
+    "get_ladders_authenticated": 2,
+    "get_players": 2,
+    "get_players_not_modified": 1,
+    "get_user": 3,
+    "update_user": 5,
+    "get_matches": 3,
+    "get_matches_page": 3,
+    "get_ladder_matches": 3,
+    "get_ladder_dashboard": 5,
+    "add_player_to_ladder": 9,
+    "update_player_order": 9,
+    "update_player": 9,
+    "report_match": 11,
+    "update_match_scores": 10,
+    "delete_match": 9,
+    "import_matches": 10,
+    "reconcile_ladder": 5,
+    "handle_batch": 6,
+    "decrement_borrowed_points": 5,
+    "reconcile_ladders": 9,
+}
+# Milliseconds (the median across runs) at any ladder size. Generous enough for a laptop or CI runner, tight enough to catch a request that starts doing
+# far more work
+LATENCY_BUDGETS_MS = {
+    "get_ladders": 5,
+    "get_ladders_authenticated": 5,
+    "get_players": 100,
+    "get_players_not_modified": 5,
+    "get_user": 5,
+    "update_user": 5,
+    "get_matches": 60,
+    "get_matches_page": 50,
+    "get_ladder_matches": 50,
+    "get_ladder_dashboard": 100,
+    "add_player_to_ladder": 200,
+    "update_player_order": 400,
+    "update_player": 400,
+    "report_match": 150,
+    "update_match_scores": 150,
+    "delete_match": 150,
+    "import_matches": 300,
+    "reconcile_ladder": 100,
+    "handle_batch": 250,
+    "decrement_borrowed_points": 150,
+    "reconcile_ladders": 100,
+}
+
+
+class Meter:
+    """Counts what goes to and comes back from the database"""
+    statements = 0
+    rows = 0
+    log = []
+
+
+class MeteredCursor(sqlite_da.SqliteCursor):
+    def execute(self, sql, args=None):
+        Meter.statements += 1
+        Meter.log.append(" ".join(sql.split()))
+        return super().execute(sql, args)
+
+    def fetchall(self):
+        rows = super().fetchall()
+        Meter.rows += len(rows)
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        Meter.rows += row is not None
+        return row
+
+
+class MeteredConnection(sqlite_da.SqliteConnection):
+    def cursor(self):
+        return MeteredCursor(self.connection.cursor())
+
+    def begin(self):
+        Meter.statements += 1
+        Meter.log.append("BEGIN")
+        super().begin()
+
+    def commit(self):
+        Meter.statements += 1
+        Meter.log.append("COMMIT")
+        super().commit()
+
+    def rollback(self):
+        Meter.statements += 1
+        Meter.log.append("ROLLBACK")
+        super().rollback()
+
+
+class BenchFirebaseClient(FirebaseClient):
+    """Every token is just the ID of the user that it's for"""
+
+    def get_firebase_user(self, token):
+        return {"user_id": token, "email": f"{token}@bench.com"}
+
+
+class Bench:
+    """A generated ladder of size players, and one that hasn't started yet with the same players, loaded into an in-memory database behind a Handler"""
+
+    def __init__(self, size):
+        sqlite_da.SqliteConnection = MeteredConnection
+        self.dao = sqlite_da.SqliteDao()
+        dataset = generate(size, user_id_prefix="BENCH")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.ladder = load(dataset, self.dao)[0]
+            self.upcoming_ladder = self.dao.create_ladder(Ladder(None, "Upcoming", date.today() + timedelta(days=1), date.today() + timedelta(weeks=12),
+                                                                 False, 10, 10), "")
+            for user in dataset.users:
+                self.dao.create_player(self.upcoming_ladder.ladder_id, user.user_id)
+            self.dao.refresh_standings(self.upcoming_ladder.ladder_id)
+
+            self.dao.create_user(User(ADMIN_ID, "Bench Admin", "admin@bench.com", None, None, None, False))
+            self.dao.execute("update users set ADMIN = 1 where ID = %s", ADMIN_ID)
+        self.ladder_id, self.user_ids = self.ladder.ladder_id, [user.user_id for user in dataset.users]
+        self.handler = Handler(ManagerImpl(BenchFirebaseClient(), self.dao))
+        self.new_user_ids = (f"NEW{i:05d}" for i in itertools.count(1))
+
+    def new_players(self, count, ladder_id=None) -> [str]:
+        """Players that have just joined the ladder (so they haven't played anyone yet)"""
+        user_ids = [next(self.new_user_ids) for _ in range(count)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for user_id in user_ids:
+                self.dao.create_user(User(user_id, user_id, f"{user_id}@bench.com", None, None, None, False))
+                if ladder_id is not None:
+                    self.dao.create_player(ladder_id, user_id)
+            if ladder_id is not None:
+                self.dao.refresh_standings(ladder_id)
+        return user_ids
+
+    def new_match(self) -> Match:
+        winner_id, loser_id = self.new_players(2, self.ladder_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            match = self.dao.create_match(Match(None, self.ladder_id, datetime.now().replace(microsecond=0), winner_id, loser_id, 6, 3, 6, 4, None, None, 45, 10))
+            self.dao.update_all_earned_points(self.ladder_id, [[winner_id, 45], [loser_id, 10]])
+            self.dao.refresh_standings(self.ladder_id)
+        return match
+
+    def ladder_etag(self):
+        return f'W/"{self.ladder_id}-{self.dao.get_ladder_version(self.ladder_id)}"'
+
+    def postpone_decrement(self):
+        # Makes the borrowed points a week behind, so that the scheduled event has something to decrement
+        self.ladder.weeks_for_borrowed_points_left = self.dao.get_ladder(self.ladder_id).weeks_for_borrowed_points_left + 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dao.update_ladder(self.ladder)
+
+
+def request(method, resource, user_id=None, path=None, query=None, body=None, headers=None):
+    return {
+        "resource": resource, "httpMethod": method, "pathParameters": path, "queryStringParameters": query,
+        "headers": {**({"X-Firebase-Token": user_id} if user_id is not None else {}), **(headers or {})},
+        "body": json.dumps(body) if body is not None else None,
+    }
+
+
+def match_body(ladder_id, winner_id, loser_id, **fields):
+    return {"ladder_id": ladder_id, "winner": {"user": {"user_id": winner_id}}, "loser": {"user": {"user_id": loser_id}}, "winner_set1_score": 6, "loser_set1_score": 2,
+            "winner_set2_score": 6, "loser_set2_score": 3, **fields}
+
+
+def report_match(bench):
+    winner_id, loser_id = bench.new_players(2, bench.ladder_id)
+    return request("POST", "/ladders/{ladder_id}/matches", winner_id, {"ladder_id": str(bench.ladder_id)}, body=match_body(bench.ladder_id, winner_id, loser_id))
+
+
+def update_match_scores(bench):
+    match = bench.new_match()
+    return request("PUT", "/ladders/{ladder_id}/matches/{match_id}", ADMIN_ID, {"ladder_id": str(bench.ladder_id), "match_id": str(match.match_id)},
+                   body=match_body(bench.ladder_id, match.winner_id, match.loser_id, winner_set2_score=7, loser_set2_score=5))
+
+
+def delete_match(bench):
+    match = bench.new_match()
+    return request("DELETE", "/ladders/{ladder_id}/matches/{match_id}", ADMIN_ID, {"ladder_id": str(bench.ladder_id), "match_id": str(match.match_id)})
+
+
+def import_matches(bench):
+    user_ids = bench.new_players(IMPORTED_MATCHES * 2, bench.ladder_id)
+    yesterday = (datetime.now() - timedelta(days=1)).replace(microsecond=0).isoformat()
+    return request("POST", "/ladders/{ladder_id}/matches/import", ADMIN_ID, {"ladder_id": str(bench.ladder_id)},
+                   body=[match_body(bench.ladder_id, winner_id, loser_id, match_date=yesterday) for winner_id, loser_id in zip(user_ids[::2], user_ids[1::2])])
+
+
+def add_player_to_ladder(bench):
+    user_id = bench.new_players(1)[0]
+    return request("POST", "/ladders/{ladder_id}/players", user_id, {"ladder_id": str(bench.ladder_id)}, {"code": ""})
+
+
+def update_player_order(bench):
+    body = [{"user": {"user_id": player.user.user_id}} for player in bench.dao.get_players(bench.upcoming_ladder.ladder_id)]
+    return request("PUT", "/ladders/{ladder_id}/players", ADMIN_ID, {"ladder_id": str(bench.upcoming_ladder.ladder_id)}, {"generate_borrowed_points": "true"},
+                   body)
+
+
+def update_player(bench):
+    # Gives the first player the same borrowed points as the second (it has to be a value that someone else already has)
+    first, second = bench.dao.get_players(bench.ladder_id)[:2]
+    return request("PUT", "/ladders/{ladder_id}/players/{user_id}", ADMIN_ID, {"ladder_id": str(bench.ladder_id), "user_id": first.user.user_id},
+                   body={"borrowed_points": second.borrowed_points})
+
+
+def handle_batch(bench):
+    ladder_path = {"ladder_id": str(bench.ladder_id)}
+    return request("POST", "/batch", bench.user_ids[0], body=[
+        {"resource": "/ladders", "method": "GET"},
+        {"resource": "/ladders/{ladder_id}/players", "method": "GET", "pathParameters": ladder_path},
+        {"resource": "/ladders/{ladder_id}/matches", "method": "GET", "pathParameters": ladder_path},
+        {"resource": "/ladders/{ladder_id}/players/{user_id}/matches", "method": "GET", "pathParameters": {**ladder_path, "user_id": bench.user_ids[0]}},
+    ])
+
+
+def decrement_borrowed_points(bench):
+    bench.postpone_decrement()
+    return {"decrement-borrowed-points": True}
+
+
+class Case:
+    def __init__(self, operation_id, prepare, status_code=200):
+        """prepare(bench) sets up anything the request needs (without being measured), and returns its event"""
+        self.operation_id, self.prepare, self.status_code = operation_id, prepare, status_code
+
+
+CASES = {
+    "get_ladders": Case("get_ladders", lambda bench: request("GET", "/ladders")),
+    "get_ladders_authenticated": Case("get_ladders", lambda bench: request("GET", "/ladders", bench.user_ids[0])),
+    "get_players": Case("get_players", lambda bench: request("GET", "/ladders/{ladder_id}/players", path={"ladder_id": str(bench.ladder_id)})),
+    "get_players_not_modified": Case("get_players", lambda bench: request("GET", "/ladders/{ladder_id}/players", path={"ladder_id": str(bench.ladder_id)},
+                                                                          headers={"If-None-Match": bench.ladder_etag()}), 304),
+    "get_user": Case("get_user", lambda bench: request("GET", "/users/{user_id}", bench.user_ids[0], {"user_id": bench.user_ids[1]})),
+    "update_user": Case("update_user", lambda bench: request("PUT", "/users/{user_id}", bench.user_ids[0], {"user_id": bench.user_ids[0]},
+                                                             body={"name": "Updated", "email": "updated@bench.com"})),
+    "get_matches": Case("get_matches", lambda bench: request("GET", "/ladders/{ladder_id}/players/{user_id}/matches", bench.user_ids[0],
+                                                             {"ladder_id": str(bench.ladder_id), "user_id": bench.user_ids[0]})),
+    "get_matches_page": Case("get_matches", lambda bench: request("GET", "/ladders/{ladder_id}/players/{user_id}/matches", bench.user_ids[0],
+                                                                  {"ladder_id": str(bench.ladder_id), "user_id": bench.user_ids[0]}, {"limit": "5"})),
+    "get_ladder_matches": Case("get_ladder_matches", lambda bench: request("GET", "/ladders/{ladder_id}/matches", path={"ladder_id": str(bench.ladder_id)})),
+    "get_ladder_dashboard": Case("get_ladder_dashboard", lambda bench: request("GET", "/ladders/{ladder_id}/dashboard", bench.user_ids[0],
+                                                                               {"ladder_id": str(bench.ladder_id)})),
+    "add_player_to_ladder": Case("add_player_to_ladder", add_player_to_ladder),
+    "update_player_order": Case("update_player_order", update_player_order),
+    "update_player": Case("update_player", update_player),
+    "report_match": Case("report_match", report_match),
+    "update_match_scores": Case("update_match_scores", update_match_scores),
+    "delete_match": Case("delete_match", delete_match),
+    "import_matches": Case("import_matches", import_matches),
+    "reconcile_ladder": Case("reconcile_ladder", lambda bench: request("POST", "/ladders/{ladder_id}/reconcile", ADMIN_ID, {"ladder_id": str(bench.ladder_id)},
+                                                                       {"dry_run": "false"})),
+    "handle_batch": Case("handle_batch", handle_batch),
+    "decrement_borrowed_points": Case(None, decrement_borrowed_points),
+    "reconcile_ladders": Case(None, lambda bench: {"reconcile-ladders": True}),
+}
+
+
+def run_case(bench, name, runs, verbose):
+    """The median milliseconds, and the statements, rows and response bytes of the last run"""
+    case = CASES[name]
+    timings = []
+    for _ in range(runs):
+        event = case.prepare(bench)
+        Meter.statements, Meter.rows, Meter.log = 0, 0, []
+        # The handler logs every request, and the SQL metrics for it
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            response = bench.handler.handle(event)
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.get("statusCode", 200) != case.status_code:
+            raise RuntimeError(f"{name} responded with {response.get('statusCode')} (expected {case.status_code}): {response.get('body')}")
+    if verbose:
+        print("    " + "\n    ".join(statement[:140] for statement in Meter.log))
+    return statistics.median(timings), Meter.statements, Meter.rows, len(response.get("body") or "")
+
+
+def check_coverage():
+    """Every route has to have a case, so that a new one can't go unmeasured"""
+    missing = {route.operation_id for route in ROUTER.routes.values()} - {case.operation_id for case in CASES.values()}
+    if missing:
+        raise RuntimeError(f"No benchmark case for: {', '.join(sorted(missing))}")
+
+
+def parse_budgets(values, defaults):
+    budgets = dict(defaults)
+    for value in values or []:
+        name, budget = value.split("=")
+        budgets[name] = float(budget)
+    return budgets
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks every endpoint against generated ladders, and checks them against their budgets")
+    arg_parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES), help="players in the generated ladder, comma separated")
+    arg_parser.add_argument("--runs", type=int, default=5, help="requests per case and size")
+    arg_parser.add_argument("--case", action="append", choices=list(CASES), help="only run these cases")
+    arg_parser.add_argument("--budget", action="append", metavar="CASE=STATEMENTS", help="override a statement budget")
+    arg_parser.add_argument("--latency-budget", action="append", metavar="CASE=MS", help="override a latency budget")
+    arg_parser.add_argument("--verbose", action="store_true", help="print the statements that each case sent")
+    args = arg_parser.parse_args()
+
+    check_coverage()
+    statement_budgets = parse_budgets(args.budget, STATEMENT_BUDGETS)
+    latency_budgets = parse_budgets(args.latency_budget, LATENCY_BUDGETS_MS)
+    failures = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        start = time.perf_counter()
+        bench = Bench(size)
+        print(f"\n{size} players ({len(bench.dao.get_matches(bench.ladder_id))} matches, generated and loaded in {time.perf_counter() - start:.1f}s)")
+        print(f"{'case':<28} {'ms':>8} {'statements':>11} {'rows':>7} {'bytes':>9}")
+        for name in args.case or CASES:
+            if args.verbose:
+                print(name)
+            ms, statements, rows, size_in_bytes = run_case(bench, name, args.runs, args.verbose)
+            print(f"{name:<28} {ms:>8.2f} {statements:>11} {rows:>7} {size_in_bytes:>9}")
+            if statements > statement_budgets[name]:
+                failures.append(f"{name} ({size} players): {statements} statements (budget {statement_budgets[name]:g})")
+            if ms > latency_budgets[name]:
+                failures.append(f"{name} ({size} players): {ms:.1f}ms (budget {latency_budgets[name]:g}ms)")
+
+    if failures:
+        print("\nOver budget:\n  " + "\n  ".join(failures))
+        exit(1)
+    print("\nAll cases within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Counts the statements (database round trips, including BEGIN and COMMIT) that reporting, updating and deleting a match each send to MySQL. Runs the real
+# ManagerImpl and DaoImpl against a fake connection that records every statement and answers with rows shaped like the real ones, so no database is needed.
+#   cd bench && python round_trips_bench.py [--verbose]
+import sys
+import os
+
+sys.path.append(os.path.abspath(__file__ + "/../../"))
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+
+import contextlib
+import io
+from datetime import date, timedelta
+
+import da
+from bl import ManagerImpl
+from domain import Session, User
+
+LADDER_ID = 1
+WINNER_ID, LOSER_ID = "BENCH1", "BENCH2"
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.lastrowid = None
+
+    def __enter__(self): return self
+
+    def __exit__(self, *_): pass
+
+    def execute(self, sql, args=None):
+        self.connection.statements.append(" ".join(sql.split()))
+        self.rows = self.connection.answer(sql, args or ())
+        self.lastrowid = self.connection.last_insert_id
+        return len(self.rows) or 1
+
+    def fetchall(self): return self.rows
+
+    def fetchone(self): return self.rows[0] if self.rows else None
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.matches = {}
+        self.last_insert_id = None
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def answer(self, sql, args):
+        sql = " ".join(sql.split())
+        if "from ladders where ID" in sql:
+            return [(LADDER_ID, "Bench", date.today() - timedelta(days=1), date.today() + timedelta(days=1), False, 0, 0)]
+        elif "from standings s" in sql:
+            user_ids = [arg for arg in args if arg in (WINNER_ID, LOSER_ID)] or [WINNER_ID, LOSER_ID]
+            return [(user_id, user_id, f"{user_id}@bench.com", None, None, None, False, LADDER_ID, 0, 0, 0, i + 1, 0, 0) for i, user_id in enumerate(user_ids)]
+        elif "from match_day_counts" in sql:
+            return [(0, 0, 0)]
+        elif sql.startswith("insert into matches"):
+            self.last_insert_id = len(self.matches) + 1
+            self.matches[self.last_insert_id] = (self.last_insert_id, *args)
+            return []
+        elif "from matches where ID" in sql:
+            return [self.matches[args[0]]] if args[0] in self.matches else []
+        return []
+
+    def begin(self): self.statements.append("BEGIN")
+
+    def commit(self): self.statements.append("COMMIT")
+
+    def rollback(self): self.statements.append("ROLLBACK")
+
+    def ping(self, reconnect=False): pass
+
+    def close(self): pass
+
+
+def count_statements(connection, operation, verbose):
+    connection.statements.clear()
+    # The manager logs what it does (and slow statements are logged too)
+    with contextlib.redirect_stdout(io.StringIO()):
+        operation()
+    if verbose:
+        print("    " + "\n    ".join(statement[:140] for statement in connection.statements))
+    return len(connection.statements)
+
+
+def main(verbose):
+    connection = RecordingConnection()
+    os.environ.update({"DB_HOST": "stub", "DB_USERNAME": "stub", "DB_PASSWORD": "stub", "DB_DATABASE_NAME": "stub"})
+    da.pymysql.connect = lambda *args, **kwargs: connection
+    manager = ManagerImpl(None, da.DaoImpl())
+    manager.session = Session(User(WINNER_ID, WINNER_ID, f"{WINNER_ID}@bench.com", None, None, None, True), [LADDER_ID], [LADDER_ID])
+    match_dict = {"ladder_id": LADDER_ID, "winner": {"user": {"user_id": WINNER_ID}}, "loser": {"user": {"user_id": LOSER_ID}}, "winner_set1_score": 6,
+                  "loser_set1_score": 0, "winner_set2_score": 6, "loser_set2_score": 0}
+
+    operations = [
+        ("report_match", lambda: manager.report_match(LADDER_ID, match_dict)),
+        ("update_match_scores", lambda: manager.update_match_scores(LADDER_ID, 1, {**match_dict, "loser_set2_score": 3})),
+        ("delete_match", lambda: manager.delete_match(LADDER_ID, 1)),
+    ]
+    print(f"{'operation':<22} {'round trips':>12}")
+    for name, operation in operations:
+        if verbose:
+            print(name)
+        print(f"{name:<22} {count_statements(connection, operation, verbose):>12}")
+
+
+if __name__ == "__main__":
+    main("--verbose" in sys.argv)
@@ -0,0 +1,61 @@
+# Compares serializing get_players and get_matches response bodies the old way (json.dumps with a default hook that walks every object's __dict__)
+# against serializers.json_dumps (what's used without orjson) and serializers.orjson_dumps (the per-class encoders). Doesn't need a database.
+#   cd bench && python serialization_bench.py [runs]
+import sys
+import os
+
+sys.path.append(os.path.abspath(__file__ + "/../../"))
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+
+import datetime
+import json
+import random
+
+import serializers
+from domain import Match, Player
+from serializers_unit_test import legacy_serialize
+from standings_bench import time_it
+
+LADDER_SIZES = [50, 500, 5000]
+MATCHES_PER_PLAYER = 4
+
+
+def create_bodies(num_players):
+    rand = random.Random(num_players)
+    players = [
+        Player(f"BENCH{i}", f"Bench Player {i}", f"bench{i}@bench.com", "555-555-5555", "https://bench.com/photo.jpg", "Weeknights", False, 1, rand.randint(0, 400),
+               rand.randint(0, 400), rand.choice([0, 20, 40]), i + 1, rand.randint(0, 8), rand.randint(0, 8))
+        for i in range(num_players)
+    ]
+    matches = []
+    for i in range(num_players * MATCHES_PER_PLAYER // 2):
+        winner, loser = rand.sample(players, 2)
+        # The same Player instances get attached to every one of their matches, the same as ManagerImpl.transform_matches does
+        matches.append(Match(i, 1, datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=i), winner.user.user_id, loser.user.user_id, 6, rand.randint(0, 4), 6,
+                             rand.randint(0, 4), None, None, rand.randint(25, 39), rand.randint(0, 8), winner, loser))
+    return {"get_players": players, "get_matches": matches}
+
+
+def main(runs):
+    serializers_to_time = {"json": serializers.json_dumps}
+    if serializers.orjson is not None:
+        serializers_to_time["encoders + orjson"] = serializers.orjson_dumps
+    else:
+        print("orjson isn't installed, so only json will be timed")
+
+    print(f"{'players':>8} {'body':<12} {'serializer':<22} {'median ms':>10} {'p95 ms':>10} {'speedup':>8}")
+    for num_players in LADDER_SIZES:
+        for name, body in create_bodies(num_players).items():
+            legacy = json.dumps(body, default=legacy_serialize)
+            legacy_median, legacy_p95 = time_it(runs, lambda: json.dumps(body, default=legacy_serialize))
+            print(f"{num_players:>8} {name:<12} {'__dict__ walk':<22} {legacy_median:>10.2f} {legacy_p95:>10.2f} {'':>8}")
+            for serializer, dumps in serializers_to_time.items():
+                # Make sure the output hasn't changed before timing anything
+                assert json.loads(dumps(body)) == json.loads(legacy), f"The {serializer} output doesn't match"
+                median, p95 = time_it(runs, lambda: dumps(body))
+                print(f"{num_players:>8} {name:<12} {serializer:<22} {median:>10.2f} {p95:>10.2f} {legacy_median / median:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
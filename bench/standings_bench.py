@@ -0,0 +1,121 @@
+# Compares the latency of the old correlated-subquery standings SQL against the single-pass window function recompute and the materialized standings
+# reads, on ladders of 50, 500 and 5,000 players (generated by test/dataset.py). Needs a MySQL database (the same one used by da_integration_test), or
+# runs the same queries against an in-memory SqliteDao with --sqlite.
+#   cd bench && python standings_bench.py [runs] [--sqlite]
+import sys
+import os
+
+sys.path.append(os.path.abspath(__file__ + "/../../"))
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from da import DaoImpl
+from dataset import generate, load
+from domain import Player
+from sqlite_da import SqliteDao
+
+LADDER_SIZES = [50, 500, 5000]
+
+# The PLAYER_SQL that DaoImpl used before the standings table existed (three correlated subqueries per player row)
+LEGACY_PLAYER_SQL_PREFIX = """
+    select u.ID, u.NAME, u.EMAIL, u.PHONE_NUMBER, u.PHOTO_URL, u.AVAILABILITY_TEXT, u.ADMIN, l.ID as LADDER_ID, p.SCORE, p.EARNED_POINTS, p.BORROWED_POINTS,
+      (select count(distinct SCORE) + 1 from players_vw where LADDER_ID = %s and SCORE > p.SCORE) as RANKING,
+      (select count(*) as WINS from matches where LADDER_ID = %s and WINNER_ID = u.ID) as WINS,
+      (select count(*) as WINS from matches where LADDER_ID = %s and LOSER_ID = u.ID) as LOSSES
+    from players_vw p
+    join users u
+        on p.USER_ID = u.ID
+    join ladders l
+        on p.LADDER_ID = l.ID
+    where l.ID = %s
+"""
+# (with ORDER quoted, which SQLite needs)
+LEGACY_PLAYERS_SQL = LEGACY_PLAYER_SQL_PREFIX + " order by p.SCORE desc, p.`ORDER` desc "
+LEGACY_PLAYER_SQL = LEGACY_PLAYER_SQL_PREFIX + " and p.USER_ID = %s"
+
+
+def connect(sqlite):
+    if sqlite:
+        return SqliteDao()
+    if "DB_HOST" not in os.environ:
+        import properties
+        os.environ["DB_HOST"] = properties.db_host
+        os.environ["DB_USERNAME"] = properties.db_username
+        os.environ["DB_PASSWORD"] = properties.db_password
+        os.environ["DB_DATABASE_NAME"] = properties.db_database_name
+    return DaoImpl()
+
+
+def seed_ladder(dao, num_players):
+    """Loads a generated ladder (with matches that follow all of the rules, which the database enforces) and returns its ID and players' IDs"""
+    dataset = generate(num_players, user_id_prefix=user_id_prefix(num_players))
+    with contextlib.redirect_stdout(io.StringIO()):
+        ladder = load(dataset, dao)[0]
+    return ladder.ladder_id, [user.user_id for user in dataset.users]
+
+
+def user_id_prefix(num_players):
+    # Not an _, which would match any character in a like
+    return f"BENCH{num_players}-"
+
+
+def clean_up(dao, num_players, ladder_id=None):
+    # These will cascade in order to delete the players, matches and standings
+    if ladder_id is not None:
+        dao.execute("delete from ladders where ID = %s", ladder_id)
+    dao.execute("delete from users where ID like %s", user_id_prefix(num_players) + "%")
+
+
+def time_it(runs, block):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        block()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * .95))]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Times the old standings query against the recompute and the standings reads")
+    arg_parser.add_argument("runs", type=int, nargs="?", default=20, help="runs per query and ladder size")
+    arg_parser.add_argument("--sqlite", action="store_true", help="run against an in-memory SqliteDao instead of MySQL")
+    args = arg_parser.parse_args()
+    runs = args.runs
+
+    dao = connect(args.sqlite)
+    print(f"{'players':>8} {'query':<40} {'median ms':>10} {'p95 ms':>10}")
+    for num_players in LADDER_SIZES:
+        # In case a run before this one didn't get to clean up
+        clean_up(dao, num_players)
+        ladder_id, user_ids = seed_ladder(dao, num_players)
+        try:
+            # Make sure the rewrite is exactly equivalent before timing anything
+            legacy = [(p.user.user_id, p.score, p.ranking, p.wins, p.losses) for p in dao.get_list(Player, LEGACY_PLAYERS_SQL, ladder_id, ladder_id, ladder_id, ladder_id)]
+            current = [(p.user.user_id, p.score, p.ranking, p.wins, p.losses) for p in dao.get_players(ladder_id)]
+            assert sorted(legacy) == sorted(current), "The standings don't match the legacy query"
+
+            user_id = user_ids[len(user_ids) // 2]
+            cases = [
+                ("legacy get_players (correlated)", lambda: dao.get_list(Player, LEGACY_PLAYERS_SQL, ladder_id, ladder_id, ladder_id, ladder_id)),
+                ("standings recompute (window function)", lambda: dao.get_list(lambda *row: row, DaoImpl.STANDINGS_RECOMPUTE_SQL, ladder_id, ladder_id, ladder_id)),
+                ("get_players (standings range scan)", lambda: dao.get_players(ladder_id)),
+                ("legacy get_player (correlated)", lambda: dao.get_one(Player, LEGACY_PLAYER_SQL, ladder_id, ladder_id, ladder_id, ladder_id, user_id)),
+                ("get_player (standings seek)", lambda: dao.get_player(ladder_id, user_id)),
+                ("refresh_standings", lambda: dao.refresh_standings(ladder_id)),
+            ]
+            for name, block in cases:
+                median, p95 = time_it(runs, block)
+                print(f"{num_players:>8} {name:<40} {median:>10.2f} {p95:>10.2f}")
+        finally:
+            clean_up(dao, num_players, ladder_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,15 @@
-# drop table users;
-create table users (
+# The tables as they were before migrations were tracked. Everything uses "if not exists", so this is safe to run against a database that already has them
+create table if not exists users (
   ID varchar(64) key not null,
   NAME varchar(64) not null,
   EMAIL varchar(64) not null,
   PHONE_NUMBER varchar(32),
   PHOTO_URL varchar(256),
-  AVAILABILITY_TEXT varchar(512)
+  AVAILABILITY_TEXT varchar(512),
+  ADMIN tinyint(1) not null default '0'
 );
 
-# drop table ladders;
-CREATE TABLE `ladders` (
+CREATE TABLE IF NOT EXISTS `ladders` (
   `ID` int(11) NOT NULL AUTO_INCREMENT,
   `NAME` varchar(32) NOT NULL,
   `START_DATE` date NOT NULL,
@@ -21,8 +21,7 @@ CREATE TABLE `ladders` (
   PRIMARY KEY (`ID`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
-# drop table players;
-CREATE TABLE `players` (
+CREATE TABLE IF NOT EXISTS `players` (
   `USER_ID` varchar(64) NOT NULL,
   `LADDER_ID` int(11) NOT NULL,
   `EARNED_POINTS` smallint(6) NOT NULL DEFAULT '0',
@@ -34,8 +33,7 @@ CREATE TABLE `players` (
   CONSTRAINT `players_ibfk_2` FOREIGN KEY (`LADDER_ID`) REFERENCES `ladders` (`ID`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
-# drop table matches;
-create table matches(
+create table if not exists matches (
   ID integer key auto_increment not null,
   LADDER_ID integer not null,
   MATCH_DATE datetime not null,
@@ -47,12 +45,14 @@ create table matches(
   LOSER_SET2_SCORE integer not null,
   WINNER_SET3_SCORE integer,
   LOSER_SET3_SCORE integer,
+  WINNER_POINTS integer not null default '0',
+  LOSER_POINTS integer not null default '0',
   foreign key (LADDER_ID) references ladders(ID) on delete cascade,
   foreign key (WINNER_ID) references users(ID) on delete cascade,
   foreign key (LOSER_ID) references users(ID) on delete cascade
 );
 
-CREATE TABLE `ladder_admins` (
+CREATE TABLE IF NOT EXISTS `ladder_admins` (
   `LADDER_ID` int(11) NOT NULL,
   `USER_ID` varchar(64) NOT NULL,
   PRIMARY KEY (`LADDER_ID`,`USER_ID`),
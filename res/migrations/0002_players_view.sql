@@ -0,0 +1,5 @@
+# A player's score is their earned points plus whatever borrowed points they have left. The standings are computed from this (see
+# DaoImpl.STANDINGS_RECOMPUTE_SQL), so it has to be defined before the standings table is backfilled
+create or replace view players_vw as
+select p.USER_ID, p.LADDER_ID, p.EARNED_POINTS, p.BORROWED_POINTS, p.EARNED_POINTS + p.BORROWED_POINTS as SCORE, p.`ORDER`
+from players p;
@@ -0,0 +1,24 @@
+# Materialized player standings, refreshed by the service whenever a player's points, order or matches change
+CREATE TABLE `standings` (
+  `LADDER_ID` int(11) NOT NULL,
+  `USER_ID` varchar(64) NOT NULL,
+  `EARNED_POINTS` smallint(6) NOT NULL DEFAULT '0',
+  `BORROWED_POINTS` smallint(6) NOT NULL DEFAULT '0',
+  `SCORE` int(11) NOT NULL DEFAULT '0',
+  `ORDER` smallint(6) NOT NULL DEFAULT '0',
+  `RANKING` int(11) NOT NULL DEFAULT '1',
+  `WINS` int(11) NOT NULL DEFAULT '0',
+  `LOSSES` int(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`LADDER_ID`,`USER_ID`),
+  KEY `LADDER_ID_SCORE_ORDER` (`LADDER_ID`,`SCORE`,`ORDER`),
+  CONSTRAINT `standings_ibfk_1` FOREIGN KEY (`USER_ID`, `LADDER_ID`) REFERENCES `players` (`USER_ID`, `LADDER_ID`) ON DELETE CASCADE,
+  CONSTRAINT `standings_ibfk_2` FOREIGN KEY (`USER_ID`) REFERENCES `users` (`ID`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+# Backfill the standings for all existing ladders
+insert into standings (LADDER_ID, USER_ID, EARNED_POINTS, BORROWED_POINTS, SCORE, `ORDER`, RANKING, WINS, LOSSES)
+select p.LADDER_ID, p.USER_ID, p.EARNED_POINTS, p.BORROWED_POINTS, p.SCORE, p.`ORDER`,
+  (select count(distinct SCORE) + 1 from players_vw where LADDER_ID = p.LADDER_ID and SCORE > p.SCORE) as RANKING,
+  (select count(*) from matches where LADDER_ID = p.LADDER_ID and WINNER_ID = p.USER_ID) as WINS,
+  (select count(*) from matches where LADDER_ID = p.LADDER_ID and LOSER_ID = p.USER_ID) as LOSSES
+from players_vw p;
@@ -0,0 +1,2 @@
+# Bumped by the service whenever anything shown in a ladder changes, and used for its ETags
+alter table ladders add column `VERSION` int(11) NOT NULL DEFAULT '0';
@@ -0,0 +1,5 @@
+# For paging through a ladder's or a player's matches, newest first (InnoDB appends the ID to each of these, which is the tiebreaker)
+alter table matches
+  add key LADDER_ID_MATCH_DATE (LADDER_ID, MATCH_DATE),
+  add key WINNER_ID_LADDER_ID_MATCH_DATE (WINNER_ID, LADDER_ID, MATCH_DATE),
+  add key LOSER_ID_LADDER_ID_MATCH_DATE (LOSER_ID, LADDER_ID, MATCH_DATE);
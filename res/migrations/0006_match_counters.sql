@@ -0,0 +1,73 @@
+# Each player's matches per day, and the matches between each pair of players (USER1_ID is whichever ID sorts first), kept up to date by the triggers on
+# matches below. Their CHECK constraints enforce ManagerImpl.MAX_MATCHES_PER_DAY and MAX_MATCHES_BETWEEN_PLAYERS (needs MySQL 8.0.16+), so two reports
+# that race each other can't both get in. The foreign keys clean them up when a ladder or user is deleted, since cascaded deletes don't fire triggers
+CREATE TABLE `match_day_counts` (
+  `LADDER_ID` int(11) NOT NULL,
+  `USER_ID` varchar(64) NOT NULL,
+  `DAY` date NOT NULL,
+  `MATCHES` smallint(6) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`LADDER_ID`,`USER_ID`,`DAY`),
+  KEY `USER_ID` (`USER_ID`),
+  CONSTRAINT `match_day_counts_ibfk_1` FOREIGN KEY (`LADDER_ID`) REFERENCES `ladders` (`ID`) ON DELETE CASCADE,
+  CONSTRAINT `match_day_counts_ibfk_2` FOREIGN KEY (`USER_ID`) REFERENCES `users` (`ID`) ON DELETE CASCADE,
+  CONSTRAINT `MAX_MATCHES_PER_DAY` CHECK (`MATCHES` <= 1)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `match_pair_counts` (
+  `LADDER_ID` int(11) NOT NULL,
+  `USER1_ID` varchar(64) NOT NULL,
+  `USER2_ID` varchar(64) NOT NULL,
+  `MATCHES` smallint(6) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`LADDER_ID`,`USER1_ID`,`USER2_ID`),
+  KEY `USER1_ID` (`USER1_ID`),
+  KEY `USER2_ID` (`USER2_ID`),
+  CONSTRAINT `match_pair_counts_ibfk_1` FOREIGN KEY (`LADDER_ID`) REFERENCES `ladders` (`ID`) ON DELETE CASCADE,
+  CONSTRAINT `match_pair_counts_ibfk_2` FOREIGN KEY (`USER1_ID`) REFERENCES `users` (`ID`) ON DELETE CASCADE,
+  CONSTRAINT `match_pair_counts_ibfk_3` FOREIGN KEY (`USER2_ID`) REFERENCES `users` (`ID`) ON DELETE CASCADE,
+  CONSTRAINT `MAX_MATCHES_BETWEEN_PLAYERS` CHECK (`MATCHES` <= 5)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+delimiter //
+create trigger matches_count_insert after insert on matches for each row
+begin
+  insert into match_day_counts (LADDER_ID, USER_ID, DAY, MATCHES)
+  values (new.LADDER_ID, new.WINNER_ID, date(new.MATCH_DATE), 1), (new.LADDER_ID, new.LOSER_ID, date(new.MATCH_DATE), 1)
+  on duplicate key update MATCHES = MATCHES + 1;
+  insert into match_pair_counts (LADDER_ID, USER1_ID, USER2_ID, MATCHES)
+  values (new.LADDER_ID, least(new.WINNER_ID, new.LOSER_ID), greatest(new.WINNER_ID, new.LOSER_ID), 1)
+  on duplicate key update MATCHES = MATCHES + 1;
+end//
+
+create trigger matches_count_delete after delete on matches for each row
+begin
+  update match_day_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER_ID in (old.WINNER_ID, old.LOSER_ID) and DAY = date(old.MATCH_DATE);
+  update match_pair_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER1_ID = least(old.WINNER_ID, old.LOSER_ID) and USER2_ID = greatest(old.WINNER_ID, old.LOSER_ID);
+end//
+
+# An update is counted as deleting the old row and inserting the new one
+create trigger matches_count_update after update on matches for each row
+begin
+  update match_day_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER_ID in (old.WINNER_ID, old.LOSER_ID) and DAY = date(old.MATCH_DATE);
+  update match_pair_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER1_ID = least(old.WINNER_ID, old.LOSER_ID) and USER2_ID = greatest(old.WINNER_ID, old.LOSER_ID);
+  insert into match_day_counts (LADDER_ID, USER_ID, DAY, MATCHES)
+  values (new.LADDER_ID, new.WINNER_ID, date(new.MATCH_DATE), 1), (new.LADDER_ID, new.LOSER_ID, date(new.MATCH_DATE), 1)
+  on duplicate key update MATCHES = MATCHES + 1;
+  insert into match_pair_counts (LADDER_ID, USER1_ID, USER2_ID, MATCHES)
+  values (new.LADDER_ID, least(new.WINNER_ID, new.LOSER_ID), greatest(new.WINNER_ID, new.LOSER_ID), 1)
+  on duplicate key update MATCHES = MATCHES + 1;
+end//
+delimiter ;
+
+# Backfill the counters from the existing matches (a day or pair that's already over its limit has to be fixed by hand first)
+insert into match_day_counts (LADDER_ID, USER_ID, DAY, MATCHES)
+select LADDER_ID, USER_ID, DAY, count(*)
+from (
+  select LADDER_ID, WINNER_ID as USER_ID, date(MATCH_DATE) as DAY from matches
+  union all
+  select LADDER_ID, LOSER_ID as USER_ID, date(MATCH_DATE) as DAY from matches
+) m
+group by LADDER_ID, USER_ID, DAY;
+insert into match_pair_counts (LADDER_ID, USER1_ID, USER2_ID, MATCHES)
+select LADDER_ID, least(WINNER_ID, LOSER_ID), greatest(WINNER_ID, LOSER_ID), count(*)
+from matches
+group by LADDER_ID, least(WINNER_ID, LOSER_ID), greatest(WINNER_ID, LOSER_ID);
@@ -0,0 +1,6 @@
+# DaoImpl.MATCH_TOTALS_SQL (behind the standings refresh, the points drift check and the earned points recompute) reads each match's WINNER_ID and
+# WINNER_POINTS, then its LOSER_ID and LOSER_POINTS, for one ladder. These cover each half of it, so it's two index range reads with nothing looked up
+# in the table
+alter table matches
+  add key LADDER_ID_WINNER_ID_WINNER_POINTS (LADDER_ID, WINNER_ID, WINNER_POINTS),
+  add key LADDER_ID_LOSER_ID_LOSER_POINTS (LADDER_ID, LOSER_ID, LOSER_POINTS);
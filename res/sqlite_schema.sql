@@ -0,0 +1,129 @@
+# The schema that res/migrations builds, for SQLite (see SqliteDao). It has to be kept in step with the migrations: a migration that changes a table
+# changes it here too
+create table users (
+  ID varchar(64) primary key not null,
+  NAME varchar(64) not null,
+  EMAIL varchar(64) not null,
+  PHONE_NUMBER varchar(32),
+  PHOTO_URL varchar(256),
+  AVAILABILITY_TEXT varchar(512),
+  ADMIN tinyint(1) not null default 0
+);
+
+create table ladders (
+  ID integer primary key autoincrement,
+  NAME varchar(32) not null,
+  START_DATE date not null,
+  END_DATE date not null,
+  DISTANCE_PENALTY_ON tinyint(1) not null default 0,
+  WEEKS_FOR_BORROWED_POINTS smallint not null default 0,
+  WEEKS_FOR_BORROWED_POINTS_LEFT smallint not null default 0,
+  PASSCODE varchar(64) not null,
+  VERSION int not null default 0
+);
+
+create table players (
+  USER_ID varchar(64) not null references users (ID) on delete cascade,
+  LADDER_ID int not null references ladders (ID) on delete cascade,
+  EARNED_POINTS smallint not null default 0,
+  BORROWED_POINTS smallint not null default 0,
+  `ORDER` smallint not null default 0,
+  primary key (USER_ID, LADDER_ID)
+);
+create index players_LADDER_ID on players (LADDER_ID);
+
+create table matches (
+  ID integer primary key autoincrement,
+  LADDER_ID integer not null references ladders (ID) on delete cascade,
+  MATCH_DATE datetime not null,
+  WINNER_ID varchar(64) not null references users (ID) on delete cascade,
+  LOSER_ID varchar(64) not null references users (ID) on delete cascade,
+  WINNER_SET1_SCORE integer not null,
+  LOSER_SET1_SCORE integer not null,
+  WINNER_SET2_SCORE integer not null,
+  LOSER_SET2_SCORE integer not null,
+  WINNER_SET3_SCORE integer,
+  LOSER_SET3_SCORE integer,
+  WINNER_POINTS integer not null default 0,
+  LOSER_POINTS integer not null default 0
+);
+create index matches_LADDER_ID_MATCH_DATE on matches (LADDER_ID, MATCH_DATE, ID);
+create index matches_WINNER_ID_LADDER_ID_MATCH_DATE on matches (WINNER_ID, LADDER_ID, MATCH_DATE, ID);
+create index matches_LOSER_ID_LADDER_ID_MATCH_DATE on matches (LOSER_ID, LADDER_ID, MATCH_DATE, ID);
+create index matches_LADDER_ID_WINNER_ID_WINNER_POINTS on matches (LADDER_ID, WINNER_ID, WINNER_POINTS);
+create index matches_LADDER_ID_LOSER_ID_LOSER_POINTS on matches (LADDER_ID, LOSER_ID, LOSER_POINTS);
+
+create table ladder_admins (
+  LADDER_ID int not null references ladders (ID) on delete cascade,
+  USER_ID varchar(64) not null references users (ID) on delete cascade,
+  primary key (LADDER_ID, USER_ID)
+);
+create index ladder_admins_USER_ID on ladder_admins (USER_ID);
+
+create view players_vw as
+select p.USER_ID, p.LADDER_ID, p.EARNED_POINTS, p.BORROWED_POINTS, p.EARNED_POINTS + p.BORROWED_POINTS as SCORE, p.`ORDER`
+from players p;
+
+create table standings (
+  LADDER_ID int not null,
+  USER_ID varchar(64) not null references users (ID) on delete cascade,
+  EARNED_POINTS smallint not null default 0,
+  BORROWED_POINTS smallint not null default 0,
+  SCORE int not null default 0,
+  `ORDER` smallint not null default 0,
+  RANKING int not null default 1,
+  WINS int not null default 0,
+  LOSSES int not null default 0,
+  primary key (LADDER_ID, USER_ID),
+  foreign key (USER_ID, LADDER_ID) references players (USER_ID, LADDER_ID) on delete cascade
+);
+create index standings_LADDER_ID_SCORE_ORDER on standings (LADDER_ID, SCORE, `ORDER`);
+
+create table match_day_counts (
+  LADDER_ID int not null references ladders (ID) on delete cascade,
+  USER_ID varchar(64) not null references users (ID) on delete cascade,
+  DAY date not null,
+  MATCHES smallint not null default 0,
+  primary key (LADDER_ID, USER_ID, DAY),
+  constraint MAX_MATCHES_PER_DAY check (MATCHES <= 1)
+);
+
+create table match_pair_counts (
+  LADDER_ID int not null references ladders (ID) on delete cascade,
+  USER1_ID varchar(64) not null references users (ID) on delete cascade,
+  USER2_ID varchar(64) not null references users (ID) on delete cascade,
+  MATCHES smallint not null default 0,
+  primary key (LADDER_ID, USER1_ID, USER2_ID),
+  constraint MAX_MATCHES_BETWEEN_PLAYERS check (MATCHES <= 5)
+);
+
+delimiter //
+create trigger matches_count_insert after insert on matches for each row
+begin
+  insert into match_day_counts (LADDER_ID, USER_ID, DAY, MATCHES)
+  values (new.LADDER_ID, new.WINNER_ID, date(new.MATCH_DATE), 1), (new.LADDER_ID, new.LOSER_ID, date(new.MATCH_DATE), 1)
+  on conflict (LADDER_ID, USER_ID, DAY) do update set MATCHES = MATCHES + 1;
+  insert into match_pair_counts (LADDER_ID, USER1_ID, USER2_ID, MATCHES)
+  values (new.LADDER_ID, min(new.WINNER_ID, new.LOSER_ID), max(new.WINNER_ID, new.LOSER_ID), 1)
+  on conflict (LADDER_ID, USER1_ID, USER2_ID) do update set MATCHES = MATCHES + 1;
+end//
+
+create trigger matches_count_delete after delete on matches for each row
+begin
+  update match_day_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER_ID in (old.WINNER_ID, old.LOSER_ID) and DAY = date(old.MATCH_DATE);
+  update match_pair_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER1_ID = min(old.WINNER_ID, old.LOSER_ID) and USER2_ID = max(old.WINNER_ID, old.LOSER_ID);
+end//
+
+# An update is counted as deleting the old row and inserting the new one
+create trigger matches_count_update after update on matches for each row
+begin
+  update match_day_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER_ID in (old.WINNER_ID, old.LOSER_ID) and DAY = date(old.MATCH_DATE);
+  update match_pair_counts set MATCHES = MATCHES - 1 where LADDER_ID = old.LADDER_ID and USER1_ID = min(old.WINNER_ID, old.LOSER_ID) and USER2_ID = max(old.WINNER_ID, old.LOSER_ID);
+  insert into match_day_counts (LADDER_ID, USER_ID, DAY, MATCHES)
+  values (new.LADDER_ID, new.WINNER_ID, date(new.MATCH_DATE), 1), (new.LADDER_ID, new.LOSER_ID, date(new.MATCH_DATE), 1)
+  on conflict (LADDER_ID, USER_ID, DAY) do update set MATCHES = MATCHES + 1;
+  insert into match_pair_counts (LADDER_ID, USER1_ID, USER2_ID, MATCHES)
+  values (new.LADDER_ID, min(new.WINNER_ID, new.LOSER_ID), max(new.WINNER_ID, new.LOSER_ID), 1)
+  on conflict (LADDER_ID, USER1_ID, USER2_ID) do update set MATCHES = MATCHES + 1;
+end//
+delimiter ;
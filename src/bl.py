@@ -1,21 +1,32 @@
+import base64
+import json
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Tuple, Optional
 
-from dateutil import parser
 from pytz import timezone
 
-from domain import User, ServiceException, Match
+from domain import User, ServiceException, Match, Session, Page, Dashboard
+from log import LOG
 
 
 class Manager:
+    # The logged in user, once validate_token has been called
+    user = None
+
     def validate_token(self, token): pass
 
+    @contextmanager
+    def memoize_reads(self): yield
+
     def get_user(self, user_id): raise NotImplementedError()
 
     def update_user(self, user_id, user): raise NotImplementedError()
 
     def get_ladders(self): raise NotImplementedError()
 
+    def get_ladder_version(self, ladder_id): raise NotImplementedError()
+
     def get_players(self, ladder_id): raise NotImplementedError()
 
     def add_player_to_ladder(self, ladder_id, code): raise NotImplementedError()
@@ -24,7 +35,11 @@ class Manager:
 
     def update_player(self, ladder_id, user_id, player_dict): raise NotImplementedError()
 
-    def get_matches(self, ladder_id, user_id): raise NotImplementedError()
+    def get_matches(self, ladder_id, user_id, limit=None, cursor=None): raise NotImplementedError()
+
+    def get_ladder_matches(self, ladder_id, limit, cursor): raise NotImplementedError()
+
+    def get_ladder_dashboard(self, ladder_id, limit): raise NotImplementedError()
 
     def report_match(self, ladder_id, match_dict): raise NotImplementedError()
 
@@ -32,28 +47,45 @@ class Manager:
 
     def delete_match(self, ladder_id: Optional[int], match_id): raise NotImplementedError()
 
+    def import_matches(self, ladder_id, match_dicts): raise NotImplementedError()
+
+    def reconcile_ladder(self, ladder_id, dry_run: bool): raise NotImplementedError()
+
     def decrement_borrowed_points(self): raise NotImplementedError()
 
+    def reconcile_all_ladders(self, dry_run: bool): raise NotImplementedError()
+
 
 class ManagerImpl:
+    # The database enforces these too (with the CHECK constraints in res/migrations/0006_match_counters.sql), so change them together
     MAX_MATCHES_BETWEEN_PLAYERS = 5
     MAX_MATCHES_PER_DAY = 1
+    MATCH_PAGE_SIZE = 50
+    DASHBOARD_MATCHES = 10
+    MAX_IMPORTED_MATCHES = 1000
 
     def __init__(self, firebase_client, dao):
         self.firebase_client = firebase_client
         self.dao = dao
-        self.user = None
+        # The logged in user, along with the ladders they have joined and administer (or None if nobody is logged in)
+        self.session = None
+
+    @property
+    def user(self):
+        return self.session.user if self.session is not None else None
 
     def validate_token(self, token):
         if token is None:
+            # Forget whoever made the last request that this container handled
+            self.session = None
             return
 
         try:
             firebase_user = self.firebase_client.get_firebase_user(token)
-            self.user = self.dao.get_user(firebase_user["user_id"])
-            if self.user is None:
-                print("Creating new user: ", firebase_user)
-                self.user = User(
+            self.session = self.dao.get_session(firebase_user["user_id"])
+            if self.session is None:
+                LOG.info("Creating a new user", user_id=firebase_user["user_id"])
+                user = User(
                     user_id=firebase_user["user_id"],
                     name=firebase_user.get("name", "Unknown"),
                     email=firebase_user["email"],
@@ -62,10 +94,21 @@ class ManagerImpl:
                     availability_text=None,
                     admin=False
                 )
-                self.dao.create_user(self.user)
+                self.dao.create_user(user)
+                self.session = Session(user, [], [])
         except Exception as error:
-            print("Token auth error: ", error)
-            self.user = None
+            LOG.warning("Token auth error", error=str(error))
+            self.session = None
+
+    @contextmanager
+    def memoize_reads(self):
+        # Used for batch requests. Each of their sub-requests calls the manager on its own, so they share the reads that they have in common through this
+        from caching_dao import MemoDao
+        dao, self.dao = self.dao, MemoDao(self.dao)
+        try:
+            yield
+        finally:
+            self.dao = dao
 
     def get_user(self, user_id):
         if self.user is None:
@@ -97,6 +140,9 @@ class ManagerImpl:
         self.user.availability_text = user.get("availability_text")
 
         self.dao.update_user(self.user)
+        # Players include their user, so every ladder this user plays in has changed
+        for ladder_id in self.session.ladder_ids:
+            self.dao.bump_ladder_version(ladder_id)
         return self.dao.get_user(user_id)
 
     def get_ladders(self):
@@ -104,28 +150,20 @@ class ManagerImpl:
 
         # If the user is logged in, tack on the information about which ladders they have joined and sort them at the top
         if self.user is not None:
-            # Add an "admin" attribute to each ladder
-            if self.user.admin:
-                for ladder in ladders:
-                    ladder.logged_in_user_is_admin = True
-            else:
-                user_admin_ladder_ids = self.dao.get_users_admin_ladder_ids(self.user.user_id)
-                for ladder in ladders:
-                    ladder.logged_in_user_is_admin = self.user.admin or ladder.ladder_id in user_admin_ladder_ids
-
-            # Add a "joined" attribute to users' ladders and sort those at the top
-            user_ladder_ids = self.dao.get_users_ladder_ids(self.user.user_id)
             my_ladders = []
             other_ladders = []
             for ladder in ladders:
-                if ladder.ladder_id in user_ladder_ids:
-                    ladder.logged_in_user_has_joined = True
+                self.add_logged_in_user_flags(ladder)
+                if ladder.ladder_id in self.session.ladder_ids:
                     my_ladders.append(ladder)
                 else:
                     other_ladders.append(ladder)
             ladders = my_ladders + other_ladders
         return ladders
 
+    def get_ladder_version(self, ladder_id):
+        return self.dao.get_ladder_version(ladder_id)
+
     def get_players(self, ladder_id):
         # The database handles all the sorting and derived fields
         return self.dao.get_players(ladder_id)
@@ -147,8 +185,11 @@ class ManagerImpl:
         if real_code is not None and real_code != code:
             raise ServiceException("The code provided does not match the code of the ladder. If you believe this in error, please contact the ladder's sponsor.", 400)
 
-        # Create the new player, tying the user to the ladder
-        self.dao.create_player(ladder_id, self.user.user_id)
+        # Create the new player, tying the user to the ladder. The standings are refreshed in the same transaction, so they never miss the new player
+        with self.dao.transaction():
+            self.dao.create_player(ladder_id, self.user.user_id)
+            self.ladder_changed(ladder_id)
+        self.session.ladder_ids.append(ladder_id)
 
         # Return the new list of players in that ladder (which should include the new player)
         return self.dao.get_players(ladder_id)
@@ -170,12 +211,14 @@ class ManagerImpl:
             raise ServiceException("You can only update player order before the ladder has started", 403)
 
         user_ids_with_order = [[player_dict["user"]["user_id"], i + 1] for i, player_dict in enumerate(reversed(player_dicts))]
-        self.dao.update_player_order(ladder_id, user_ids_with_order)
+        with self.dao.transaction():
+            self.dao.update_player_order(ladder_id, user_ids_with_order)
 
-        if generate_borrowed_points:
-            user_ids_with_borrowed_points = [[user_id, order * ladder.weeks_for_borrowed_points] for user_id, order in user_ids_with_order]
-            self.dao.update_all_borrowed_points(ladder_id, user_ids_with_borrowed_points)
+            if generate_borrowed_points:
+                user_ids_with_borrowed_points = [[user_id, order * ladder.weeks_for_borrowed_points] for user_id, order in user_ids_with_order]
+                self.dao.update_all_borrowed_points(ladder_id, user_ids_with_borrowed_points)
 
+            self.ladder_changed(ladder_id)
         return self.dao.get_players(ladder_id)
 
     def update_player(self, ladder_id: Optional[int], user_id, player_dict):
@@ -204,16 +247,47 @@ class ManagerImpl:
         if new_borrowed_points not in other_players_borrowed_points:
             raise ServiceException("You must assign a value that is already assigned to another player in the ladder", 400)
 
-        self.dao.update_borrowed_points(ladder_id, user_id, new_borrowed_points)
+        with self.dao.transaction():
+            self.dao.update_borrowed_points(ladder_id, user_id, new_borrowed_points)
+            self.ladder_changed(ladder_id)
         return self.get_players(ladder_id)
 
-    def get_matches(self, ladder_id, user_id):
-        # Get all the matches (which will only have user ids, not the full player)
+    def get_matches(self, ladder_id, user_id, limit=None, cursor=None):
+        if limit is not None or cursor is not None:
+            return self.get_match_page(ladder_id, user_id, limit, cursor)
+
+        # Versions of the apps from before paging expect all the matches (which will only have user ids, not the full player)
         matches = self.dao.get_matches(ladder_id, user_id)
 
         # Attach winners and losers to the matches
         return self.transform_matches(matches, ladder_id)
 
+    def get_ladder_matches(self, ladder_id, limit, cursor):
+        return self.get_match_page(ladder_id, None, limit, cursor)
+
+    def get_ladder_dashboard(self, ladder_id, limit):
+        """
+        The ladder, its standings, its most recent matches (limit of them, along with the cursor for the rest) and, if the logged in user plays in it, all
+        of their matches. The standings are only looked up once, and every section shares them.
+        """
+        if ladder_id is None:
+            raise ServiceException("No ladder_id passed in", 400)
+
+        ladder = self.dao.get_ladder(ladder_id)
+        if ladder is None:
+            raise ServiceException(f"No ladder with ID: {ladder_id}", 404)
+
+        if self.user is not None:
+            self.add_logged_in_user_flags(ladder)
+
+        players = self.dao.get_players(ladder_id)
+        recent_matches = self.get_match_page(ladder_id, None, limit or ManagerImpl.DASHBOARD_MATCHES, None, players)
+        # Only players have matches of their own
+        my_matches = None
+        if self.user is not None and ladder_id in self.session.ladder_ids:
+            my_matches = self.transform_matches(self.dao.get_matches(ladder_id, self.user.user_id), ladder_id, players)
+        return Dashboard(ladder, players, recent_matches, my_matches)
+
     def report_match(self, ladder_id, match_dict):
         if self.user is None:
             raise ServiceException("Unable to authenticate", 401)
@@ -222,59 +296,60 @@ class ManagerImpl:
         elif match_dict is None:
             raise ServiceException("Null match param", 400)
 
-        # Look up ladder
-        ladder = self.dao.get_ladder(ladder_id)
-        if ladder is None:
-            raise ServiceException("No ladder with id: '{}'".format(ladder_id), 404)
-
-        # Check that the ladder is currently active
-        if not ladder.is_open():
-            raise ServiceException("This ladder is not currently open. You can only report matches between the ladder's start and end dates", 400)
-
-        # Deserialize and validate that the rest of the match is set up properly (valid set scores and players)
-        match = match_from_dict(match_dict)
-
-        # Set match date to right now (to avoid issues with device times being changed)
-        match.match_date = datetime.now(timezone("US/Mountain"))
-
-        # Look up players in ladder
-        winner = self.dao.get_player(ladder_id, match.winner_id)
-        if winner is None:
-            raise ServiceException("No user with id: '{}'".format(match.winner_id), 400)
-
-        loser = self.dao.get_player(ladder_id, match.loser_id)
-        if loser is None:
-            raise ServiceException("No user with id: '{}'".format(match.loser_id), 400)
-
-        # Get all matches for this ladder (to enforce some of the rules below)
-        ladder_matches = self.dao.get_matches(ladder_id)
-
-        # Find out if either player has already played a match today
-        if len([m for m in ladder_matches if m.has_players(match.winner_id) and m.played_today()]) > 0:
-            raise ServiceException("Reported winner has already played a match today. Only one match can be played each day.", 400)
-        if len([m for m in ladder_matches if m.has_players(match.loser_id) and m.played_today()]) > 0:
-            raise ServiceException("Reported loser has already played a match today. Only one match can be played each day.", 400)
-
-        # Find out if the players have already played the maximum amount of times
-        matches_between_players = [m for m in ladder_matches if m.has_players(match.winner_id, match.loser_id)]
-        if len(matches_between_players) >= ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS:
-            raise ServiceException("Players have already played {} times.".format(ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS), 400)
-
-        # Update the scores of the players
-        match.winner_points, match.loser_points = match.calculate_scores(winner.ranking, loser.ranking, ladder.distance_penalty_on)
-        print("---MATCH_REPORTING--- {} ({}) vs {} ({}): {}-{}, {}-{}, {}-{}. Winner Score: {}. Loser Score: {}".format(
-            winner.user.name, winner.ranking, loser.user.name, loser.ranking,
-            match.winner_set1_score, match.loser_set1_score, match.winner_set2_score, match.loser_set2_score, match.winner_set3_score, match.loser_set3_score,
-            match.winner_points, match.loser_points
-        ))
-        self.dao.update_earned_points(match.ladder_id, match.winner_id, match.winner_points)
-        self.dao.update_earned_points(match.ladder_id, match.loser_id, match.loser_points)
-
-        # Save the match to the database (which will assign it a new match_id)
-        match = self.dao.create_match(match)
-
-        # Attach winners and losers to the match
-        return self.transform_matches([match], ladder_id)[0]
+        with self.dao.transaction():
+            # Locking the ladder makes concurrent reports in the same ladder take turns, so they can't both pass the checks below
+            ladder = self.dao.lock_ladder(ladder_id)
+            if ladder is None:
+                raise ServiceException("No ladder with id: '{}'".format(ladder_id), 404)
+
+            # Check that the ladder is currently active
+            if not ladder.is_open():
+                raise ServiceException("This ladder is not currently open. You can only report matches between the ladder's start and end dates", 400)
+
+            # Deserialize and validate that the rest of the match is set up properly (valid set scores and players)
+            match = match_from_dict(match_dict)
+
+            # Set match date to right now (to avoid issues with device times being changed). The database doesn't keep fractions of a second
+            match.match_date = datetime.now(timezone("US/Mountain")).replace(microsecond=0)
+
+            # Look up players in ladder
+            players = {player.user.user_id: player for player in self.dao.get_players_by_ids(ladder_id, [match.winner_id, match.loser_id])}
+            winner = players.get(match.winner_id)
+            if winner is None:
+                raise ServiceException("No user with id: '{}'".format(match.winner_id), 400)
+
+            loser = players.get(match.loser_id)
+            if loser is None:
+                raise ServiceException("No user with id: '{}'".format(match.loser_id), 400)
+
+            # Count the matches that the rules below limit. The database enforces the same limits when the match is saved, but checking first means the
+            # error can say which rule was broken
+            counts = self.dao.get_match_counts(ladder_id, match.winner_id, match.loser_id, match.match_date.date())
+
+            # Find out if either player has already played a match today
+            if counts.winner_matches_that_day >= ManagerImpl.MAX_MATCHES_PER_DAY:
+                raise ServiceException("Reported winner has already played a match today. Only one match can be played each day.", 400)
+            if counts.loser_matches_that_day >= ManagerImpl.MAX_MATCHES_PER_DAY:
+                raise ServiceException("Reported loser has already played a match today. Only one match can be played each day.", 400)
+
+            # Find out if the players have already played the maximum amount of times
+            if counts.matches_between >= ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS:
+                raise ServiceException("Players have already played {} times.".format(ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS), 400)
+
+            # Update the scores of the players
+            match.winner_points, match.loser_points = match.calculate_scores(winner.ranking, loser.ranking, ladder.distance_penalty_on)
+            LOG.info("MATCH_REPORTING", ladder_id=ladder_id, winner_id=match.winner_id, winner_ranking=winner.ranking, loser_id=match.loser_id,
+                     loser_ranking=loser.ranking, winner_points=match.winner_points, loser_points=match.loser_points,
+                     scores=lambda: [match.winner_set1_score, match.loser_set1_score, match.winner_set2_score, match.loser_set2_score, match.winner_set3_score,
+                                     match.loser_set3_score])
+            self.dao.update_all_earned_points(match.ladder_id, [[match.winner_id, match.winner_points], [match.loser_id, match.loser_points]], bump_version=True)
+
+            # Save the match to the database (which will assign it a new match_id)
+            match = self.dao.create_match(match)
+            self.ladder_changed(match.ladder_id, version_bumped=True)
+
+            # Attach the winner and loser, with their new standings
+            return self.attach_players(match, self.dao.get_players_by_ids(ladder_id, [match.winner_id, match.loser_id]))
 
     def update_match_scores(self, ladder_id: Optional[int], match_id, match_dict):
         if self.user is None:
@@ -288,32 +363,34 @@ class ManagerImpl:
         elif match_dict is None:
             raise ServiceException("Null match param", 400)
 
-        original_match = self.dao.get_match(match_id)
-        if original_match is None:
-            raise ServiceException(f"No match with ID: {match_id}", 404)
-        updated_match = match_from_dict(match_dict)
+        with self.dao.transaction():
+            original_match = self.lock_match(ladder_id, match_id)
+            if original_match is None:
+                raise ServiceException(f"No match with ID: {match_id}", 404)
+            updated_match = match_from_dict(match_dict)
 
-        winner_score_diff, loser_score_diff = self.get_score_diff(original_match, updated_match)
+            winner_score_diff, loser_score_diff = self.get_score_diff(original_match, updated_match)
 
-        original_match.winner_set1_score = updated_match.winner_set1_score
-        original_match.loser_set1_score = updated_match.loser_set1_score
-        original_match.winner_set2_score = updated_match.winner_set2_score
-        original_match.loser_set2_score = updated_match.loser_set2_score
-        original_match.winner_set3_score = updated_match.winner_set3_score
-        original_match.loser_set3_score = updated_match.loser_set3_score
+            original_match.winner_set1_score = updated_match.winner_set1_score
+            original_match.loser_set1_score = updated_match.loser_set1_score
+            original_match.winner_set2_score = updated_match.winner_set2_score
+            original_match.loser_set2_score = updated_match.loser_set2_score
+            original_match.winner_set3_score = updated_match.winner_set3_score
+            original_match.loser_set3_score = updated_match.loser_set3_score
 
-        # Make sure the winner doesn't drop below the min amount. If so, correct the diff
-        new_winner_points = max(original_match.winner_points + winner_score_diff, Match.MIN_WINNER_POINTS)
-        winner_score_diff = new_winner_points - original_match.winner_points
-        original_match.winner_points += winner_score_diff
-        original_match.loser_points += loser_score_diff
+            # Make sure the winner doesn't drop below the min amount. If so, correct the diff
+            new_winner_points = max(original_match.winner_points + winner_score_diff, Match.MIN_WINNER_POINTS)
+            winner_score_diff = new_winner_points - original_match.winner_points
+            original_match.winner_points += winner_score_diff
+            original_match.loser_points += loser_score_diff
 
-        self.dao.update_match(original_match)
+            self.dao.update_match(original_match)
 
-        self.dao.update_earned_points(original_match.ladder_id, original_match.winner_id, winner_score_diff)
-        self.dao.update_earned_points(original_match.ladder_id, original_match.loser_id, loser_score_diff)
+            self.dao.update_all_earned_points(original_match.ladder_id, [[original_match.winner_id, winner_score_diff], [original_match.loser_id, loser_score_diff]],
+                                              bump_version=True)
+            self.ladder_changed(original_match.ladder_id, version_bumped=True)
 
-        return self.transform_matches([original_match], original_match.ladder_id)[0]
+            return self.attach_players(original_match, self.dao.get_players_by_ids(original_match.ladder_id, [original_match.winner_id, original_match.loser_id]))
 
     def delete_match(self, ladder_id: Optional[int], match_id):
         if self.user is None:
@@ -325,48 +402,169 @@ class ManagerImpl:
         elif match_id is None:
             raise ServiceException("Null match_id param", 400)
 
-        match = self.dao.get_match(match_id)
+        with self.dao.transaction():
+            match = self.lock_match(ladder_id, match_id)
+
+            if match is not None:
+                self.dao.update_all_earned_points(match.ladder_id, [[match.winner_id, -match.winner_points], [match.loser_id, -match.loser_points]], bump_version=True)
 
-        if match is not None:
-            self.dao.update_earned_points(match.ladder_id, match.winner_id, -match.winner_points)
-            self.dao.update_earned_points(match.ladder_id, match.loser_id, -match.loser_points)
+                self.dao.delete_match(match_id)
+                self.ladder_changed(match.ladder_id, version_bumped=True)
 
-            self.dao.delete_match(match_id)
+    def import_matches(self, ladder_id, match_dicts):
+        """
+        Adds matches that were played in the past (e.g. from a paper ladder), each with its own match_date. Their points are worked out in the order they were
+        played, starting from the current standings, with each match's rankings including the points from the imported matches before it. All of them are
+        saved (or none are) in one transaction, and the standings are refreshed once at the end. Returns the ladder's players, with their new standings.
+        """
+        if self.user is None:
+            raise ServiceException("Unable to authenticate", 401)
+        elif ladder_id is None:
+            raise ServiceException("No ladder_id passed in", 400)
+        elif not self.user_is_ladder_admin(ladder_id):
+            raise ServiceException("Only admins can import matches", 403)
+        elif not isinstance(match_dicts, list) or len(match_dicts) == 0:
+            raise ServiceException("No matches passed in", 400)
+        elif len(match_dicts) > ManagerImpl.MAX_IMPORTED_MATCHES:
+            raise ServiceException(f"Only {ManagerImpl.MAX_IMPORTED_MATCHES} matches can be imported at a time", 400)
+
+        # Validate everything before touching the database. Errors say which match (counting from 1, in the order they were passed in) was the problem
+        matches = []
+        now = datetime.now(timezone("US/Mountain"))
+        for i, match_dict in enumerate(match_dicts):
+            try:
+                if not match_dict.get("match_date"):
+                    raise ServiceException("Missing match_date", 400)
+                try:
+                    parse_date(match_dict["match_date"])
+                except (TypeError, ValueError):
+                    raise ServiceException(f"Invalid match_date: '{match_dict['match_date']}'", 400)
+                match = match_from_dict({**match_dict, "ladder_id": ladder_id})
+            except (ServiceException, AttributeError, TypeError, ValueError) as e:
+                raise ServiceException(f"Invalid match #{i + 1}: {e.error_message if isinstance(e, ServiceException) else e}", 400)
+            # The database doesn't keep fractions of a second
+            match.match_date = match.match_date.replace(microsecond=0)
+            if match.match_date > now:
+                raise ServiceException(f"Invalid match #{i + 1}: It hasn't been played yet", 400)
+            matches.append(match)
+        # Stable, so matches with the same date keep the order they were passed in
+        matches.sort(key=lambda m: m.match_date)
+
+        with self.dao.transaction():
+            ladder = self.dao.lock_ladder(ladder_id)
+            if ladder is None:
+                raise ServiceException(f"No ladder with ID: {ladder_id}", 404)
+
+            scores = {player.user.user_id: player.score for player in self.dao.get_players(ladder_id)}
+            earned_points = {}
+            for match in matches:
+                for user_id in [match.winner_id, match.loser_id]:
+                    if user_id not in scores:
+                        raise ServiceException(f"No user with id: '{user_id}'", 400)
+                if not ladder.start_date <= match.match_date.date() <= ladder.end_date:
+                    raise ServiceException(f"Match on {match.match_date.date()} was played outside of the ladder's dates", 400)
+
+                rankings = rank_by_score(scores)
+                match.winner_points, match.loser_points = match.calculate_scores(rankings[match.winner_id], rankings[match.loser_id], ladder.distance_penalty_on)
+                for user_id, points in [(match.winner_id, match.winner_points), (match.loser_id, match.loser_points)]:
+                    scores[user_id] += points
+                    earned_points[user_id] = earned_points.get(user_id, 0) + points
+
+            LOG.info("MATCH_IMPORT", ladder_id=ladder_id, matches=len(matches), user_id=self.user.user_id)
+            self.dao.create_matches(matches)
+            self.dao.update_all_earned_points(ladder_id, [[user_id, points] for user_id, points in earned_points.items()], bump_version=True)
+            self.ladder_changed(ladder_id, version_bumped=True)
+            return self.dao.get_players(ladder_id)
+
+    def reconcile_ladder(self, ladder_id, dry_run: bool):
+        if self.user is None:
+            raise ServiceException("Unable to authenticate", 401)
+        elif ladder_id is None:
+            raise ServiceException("No ladder_id passed in", 400)
+        elif not self.user_is_ladder_admin(ladder_id):
+            raise ServiceException("Only admins can reconcile ladders", 403)
+
+        drift = self.reconcile(ladder_id, dry_run)
+        if drift is None:
+            raise ServiceException(f"No ladder with ID: {ladder_id}", 404)
+        return drift
 
     def decrement_borrowed_points(self):
-        print("Looking for ladders that need borrowed points decremented")
+        LOG.debug("Looking for ladders that need borrowed points decremented")
         for ladder in self.dao.get_ladders():
             # Make sure the ladder is open, and it's using borrowed points
             if ladder.is_open() and ladder.weeks_for_borrowed_points > 0:
-                print(f"{ladder.name} is open and is using borrowed points...")
                 # // will divide and round down
                 num_weeks_since_start = (datetime.now(timezone("US/Mountain")).date() - ladder.start_date).days // 7
-                print(f"Number of weeks since the ladder started: {(datetime.now(timezone('US/Mountain')).date() - ladder.start_date).days // 7}")
+                LOG.debug("Ladder is open and is using borrowed points", ladder_id=ladder.ladder_id, weeks_since_start=num_weeks_since_start)
                 weeks_left_now = ladder.weeks_for_borrowed_points - num_weeks_since_start
 
                 # Make sure it hasn't already been decremented this week
                 if weeks_left_now != ladder.weeks_for_borrowed_points_left:
-                    print(f"Decrementing borrowed points for ladder: {ladder.name} from {ladder.weeks_for_borrowed_points_left} to {weeks_left_now}")
+                    LOG.info("Decrementing borrowed points", ladder_id=ladder.ladder_id, weeks_left=ladder.weeks_for_borrowed_points_left, weeks_left_now=weeks_left_now)
                     # Update all the points
                     self.dao.decrement_borrowed_points(ladder.ladder_id, ladder.weeks_for_borrowed_points_left, weeks_left_now)
+                    self.dao.refresh_standings(ladder.ladder_id)
 
                     # Update the value on the ladder
                     ladder.weeks_for_borrowed_points_left = weeks_left_now
                     self.dao.update_ladder(ladder)
+                    self.dao.bump_ladder_version(ladder.ladder_id)
                 else:
-                    print(f"Already decremented through {ladder.weeks_for_borrowed_points_left} weeks left")
+                    LOG.debug("Borrowed points were already decremented", ladder_id=ladder.ladder_id, weeks_left=ladder.weeks_for_borrowed_points_left)
+
+    def reconcile_all_ladders(self, dry_run: bool):
+        LOG.info("Reconciling every ladder", dry_run=dry_run)
+        for ladder in self.dao.get_ladders():
+            drift = self.reconcile(ladder.ladder_id, dry_run)
+            LOG.info("Reconciled a ladder", ladder_id=ladder.ladder_id, drifted_players=len(drift or []))
 
     # Utils
 
+    def reconcile(self, ladder_id, dry_run: bool) -> Optional[list]:
+        """
+        Finds the players in a ladder whose earned points, wins or losses don't match the totals of their matches, and (unless it's a dry run) rebuilds
+        everyone's from the matches. Returns the drift that was found, or None if there's no such ladder.
+        """
+        with self.dao.transaction():
+            # Nothing can report, change or delete a match in the ladder while it's being rebuilt
+            if self.dao.lock_ladder(ladder_id) is None:
+                return None
+
+            drift = self.dao.get_points_drift(ladder_id)
+            for player_drift in drift:
+                LOG.warning("POINTS_DRIFT", ladder_id=ladder_id, drift=player_drift)
+            if len(drift) > 0 and not dry_run:
+                self.dao.recompute_earned_points(ladder_id)
+                self.ladder_changed(ladder_id)
+            return drift
+
     @staticmethod
     def get_score_diff(original: Match, new: Match) -> Tuple[int, int]:
         (new_winner_score, new_loser_score) = new.calculate_scores(None, None, False)
         (old_winner_score, old_loser_score) = original.calculate_scores(None, None, False)
         return new_winner_score - old_winner_score, new_loser_score - old_loser_score
 
-    def transform_matches(self, matches, ladder_id):
-        # Get all players in that ladder
-        players = self.dao.get_players(ladder_id)
+    def get_match_page(self, ladder_id, user_id, limit, cursor, players=None) -> Page:
+        limit = limit or ManagerImpl.MATCH_PAGE_SIZE
+        # Asking for one extra match is how we know whether there's another page
+        matches = self.dao.get_match_page(ladder_id, user_id, limit + 1, decode_cursor(cursor) if cursor is not None else None)
+        next_cursor = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            next_cursor = encode_cursor(matches[-1])
+        return Page(self.transform_matches(matches, ladder_id, players), next_cursor)
+
+    @staticmethod
+    def attach_players(match, players):
+        players_by_id = {player.user.user_id: player for player in players}
+        match.winner, match.loser = players_by_id[match.winner_id], players_by_id[match.loser_id]
+        return match
+
+    def transform_matches(self, matches, ladder_id, players=None):
+        # Get all players in that ladder (unless the caller already has them)
+        if players is None:
+            players = self.dao.get_players(ladder_id)
 
         # Create a map for quick and easy look up
         player_map = {}
@@ -380,15 +578,38 @@ class ManagerImpl:
 
         return matches
 
+    def lock_match(self, ladder_id, match_id) -> Optional[Match]:
+        # Locks the ladder before reading the match (like report_match does), so a concurrent report or reconcile can't recompute the ladder's points from
+        # match rows that are about to change
+        self.dao.lock_ladder(ladder_id)
+        match = self.dao.get_match(match_id)
+        if match is not None and match.ladder_id != ladder_id:
+            # The lock has to cover the ladder whose points are changing
+            self.dao.lock_ladder(match.ladder_id)
+        return match
+
+    def ladder_changed(self, ladder_id, version_bumped=False):
+        # Recomputes the ladder's standings, and bumps its version so that clients' cached copies (tagged with the version in their ETag) go stale. Changes
+        # to match points bump it along with the points (see Dao.update_all_earned_points), which saves a round trip
+        self.dao.refresh_standings(ladder_id)
+        if not version_bumped:
+            self.dao.bump_ladder_version(ladder_id)
+
+    def add_logged_in_user_flags(self, ladder):
+        # Whether the logged in user administers the ladder, and (only on the ones they've joined) that they've joined it
+        ladder.logged_in_user_is_admin = self.user_is_ladder_admin(ladder.ladder_id)
+        if ladder.ladder_id in self.session.ladder_ids:
+            ladder.logged_in_user_has_joined = True
+
     def user_is_ladder_admin(self, ladder_id: int) -> bool:
-        return self.user.admin or self.user.user_id in self.dao.get_ladder_admins(ladder_id)
+        return self.user.admin or ladder_id in self.session.admin_ladder_ids
 
 
 def match_from_dict(match_dict):
     return Match(
         match_dict.get("match_id"),
         match_dict.get("ladder_id"),
-        parser.isoparse(match_dict.get("match_date")) if match_dict.get("match_date") else None,
+        parse_date(match_dict.get("match_date")) if match_dict.get("match_date") else None,
         match_dict.get("winner", {}).get("user", {}).get("user_id"),
         match_dict.get("loser", {}).get("user", {}).get("user_id"),
         match_dict.get("winner_set1_score"),
@@ -398,3 +619,33 @@ def match_from_dict(match_dict):
         match_dict.get("winner_set3_score"),
         match_dict.get("loser_set3_score")
     ).validate()
+
+
+def rank_by_score(scores: dict) -> dict:
+    """Maps each user_id in scores to their ranking, the same way the standings rank them (tied scores share a ranking, and none are skipped)"""
+    rankings = {score: i + 1 for i, score in enumerate(sorted(set(scores.values()), reverse=True))}
+    return {user_id: rankings[score] for user_id, score in scores.items()}
+
+
+def encode_cursor(last_match: Match) -> str:
+    # Opaque to the apps, which just pass it back in. MATCH_DATE is stored without a timezone (Match adds Mountain time), so it's left off here too
+    return base64.urlsafe_b64encode(json.dumps([last_match.match_date.replace(tzinfo=None).isoformat(), last_match.match_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        match_date, match_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(match_date), int(match_id)
+    # Bad base64 (binascii.Error) and bad JSON are both ValueErrors
+    except (ValueError, TypeError):
+        raise ServiceException(f"Invalid cursor: '{cursor}'", 400)
+
+
+def parse_date(date_string):
+    try:
+        # Handles everything that the apps send (and that the serializers output)
+        return datetime.fromisoformat(date_string)
+    except ValueError:
+        # dateutil is slow to import, so only bring it in for the odd ISO 8601 format that fromisoformat doesn't understand
+        from dateutil import parser
+        return parser.isoparse(date_string)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LruCache:
+    """
+    An in-process cache bounded to max_size entries. Every entry has its own time to live, and when the cache is full the least recently used entry is
+    evicted. Use MISSING to tell a miss apart from a cached None.
+    """
+
+    def __init__(self, max_size, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        """Removes every entry where predicate(key, value) is true"""
+        with self.lock:
+            keys = [key for key, (_, value) in self.entries.items() if predicate(key, value)]
+            for key in keys:
+                del self.entries[key]
+            self.invalidations += len(keys)
+
+    def items(self):
+        """A snapshot of the (key, value) pairs currently in the cache, including any that have expired but not been removed yet"""
+        with self.lock:
+            return [(key, value) for key, (_, value) in self.entries.items()]
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self.entries)
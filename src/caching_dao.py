@@ -0,0 +1,296 @@
+import copy
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+from cache import LruCache, MISSING
+from da import Dao
+from domain import Ladder, Match, MatchCounts, Player, PointsDrift, Session
+
+
+class CachingDao(Dao):
+    """
+    Wraps another Dao (normally DaoImpl) and caches the hot, ladder-scoped reads in memory, so warm invocations don't have to go back to MySQL.
+    Every mutating call is passed through and then drops the cached reads for the ladder it touched. Writes made by other containers are picked up the
+    next time that the ladder's version is looked up (which the handler does for every request that's served with an ETag), or else once an entry's TTL
+    expires, so the TTLs of the reads that change often are kept short.
+    """
+    DEFAULT_TTLS = {
+        "get_ladders": 60,
+        "get_ladder": 60,
+        "get_ladder_admins": 60,
+        "get_players": 10,
+        "get_matches": 10,
+        "get_match_page": 10,
+        # Ladder admins are granted directly in the database, so this is also how long it takes for a new admin's rights to kick in
+        "get_session": 30,
+    }
+    LADDER_SCOPED_METHODS = {"get_ladder", "get_ladder_admins", "get_players", "get_matches", "get_match_page"}
+
+    def __init__(self, dao: Dao, max_entries=256, ttls=None, clock=time.monotonic):
+        self.dao = dao
+        self.cache = LruCache(max_entries, clock)
+        self.ttls = {**CachingDao.DEFAULT_TTLS, **(ttls or {})}
+        self.method_stats = {method: {"hits": 0, "misses": 0} for method in self.ttls}
+        # The version of each ladder that its cached reads are known to be up to date with
+        self.ladder_versions = {}
+        self.transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.dao.transaction():
+            self.transaction_depth += 1
+            try:
+                yield
+            finally:
+                self.transaction_depth -= 1
+
+    # region Cached reads
+
+    def get_ladders(self):
+        return self.cached(("get_ladders",), self.dao.get_ladders)
+
+    def get_ladder(self, ladder_id) -> Ladder:
+        return self.cached(("get_ladder", ladder_id), lambda: self.dao.get_ladder(ladder_id))
+
+    def get_ladder_admins(self, ladder_id: int) -> [str]:
+        return self.cached(("get_ladder_admins", ladder_id), lambda: self.dao.get_ladder_admins(ladder_id))
+
+    def get_players(self, ladder_id):
+        return self.cached(("get_players", ladder_id), lambda: self.dao.get_players(ladder_id))
+
+    def get_matches(self, ladder_id, user_id=None):
+        return self.cached(("get_matches", ladder_id, user_id), lambda: self.dao.get_matches(ladder_id, user_id))
+
+    def get_match_page(self, ladder_id: int, user_id: Optional[str], limit: int, after: Optional[Tuple[datetime, int]] = None) -> [Match]:
+        return self.cached(("get_match_page", ladder_id, user_id, limit, after), lambda: self.dao.get_match_page(ladder_id, user_id, limit, after))
+
+    def get_session(self, user_id) -> Session:
+        return self.cached(("get_session", user_id), lambda: self.dao.get_session(user_id))
+
+    # endregion
+    # region Uncached reads
+
+    def get_user(self, user_id):
+        return self.dao.get_user(user_id)
+
+    def get_ladder_version(self, ladder_id: int) -> Optional[int]:
+        # Always read through, since this is how changes made by other containers are noticed
+        version = self.dao.get_ladder_version(ladder_id)
+        if version is None or self.ladder_versions.get(ladder_id) != version:
+            self.invalidate_ladder(ladder_id)
+            self.ladder_versions[ladder_id] = version
+        return version
+
+    def in_same_ladder(self, user1_id, user2_id):
+        return self.dao.in_same_ladder(user1_id, user2_id)
+
+    def get_users_ladder_ids(self, user_id):
+        return self.dao.get_users_ladder_ids(user_id)
+
+    def get_users_admin_ladder_ids(self, user_id: str) -> [int]:
+        return self.dao.get_users_admin_ladder_ids(user_id)
+
+    def get_player(self, ladder_id, user_id):
+        return self.dao.get_player(ladder_id, user_id)
+
+    def get_players_by_ids(self, ladder_id: int, user_ids: [str]) -> [Player]:
+        return self.dao.get_players_by_ids(ladder_id, user_ids)
+
+    def lock_ladder(self, ladder_id: int) -> Optional[Ladder]:
+        return self.dao.lock_ladder(ladder_id)
+
+    def get_standings_discrepancies(self, ladder_id) -> [str]:
+        return self.dao.get_standings_discrepancies(ladder_id)
+
+    def get_points_drift(self, ladder_id: int) -> [PointsDrift]:
+        return self.dao.get_points_drift(ladder_id)
+
+    def get_match(self, match_id) -> Match:
+        return self.dao.get_match(match_id)
+
+    def get_match_counts(self, ladder_id: int, winner_id: str, loser_id: str, day: date) -> MatchCounts:
+        return self.dao.get_match_counts(ladder_id, winner_id, loser_id, day)
+
+    def get_ladder_code(self, ladder_id):
+        return self.dao.get_ladder_code(ladder_id)
+
+    # endregion
+    # region Writes
+
+    def create_user(self, user):
+        self.dao.create_user(user)
+        # A lookup from before the user existed will have cached None
+        self.cache.invalidate(("get_session", user.user_id))
+
+    def update_user(self, user):
+        self.dao.update_user(user)
+        self.cache.invalidate(("get_session", user.user_id))
+        # Players embed their user, so drop any cached ladder that this user is playing in
+        self.cache.invalidate_where(lambda key, value: key[0] == "get_players" and any(player.user.user_id == user.user_id for player in value))
+
+    def create_ladder(self, ladder: Ladder, code: str) -> Ladder:
+        created_ladder = self.dao.create_ladder(ladder, code)
+        self.cache.invalidate(("get_ladders",))
+        return created_ladder
+
+    def update_ladder(self, ladder: Ladder):
+        self.dao.update_ladder(ladder)
+        self.cache.invalidate(("get_ladders",))
+        self.invalidate_ladder(ladder.ladder_id)
+
+    def bump_ladder_version(self, ladder_id: int):
+        self.dao.bump_ladder_version(ladder_id)
+        self.invalidate_ladder(ladder_id)
+
+    def create_player(self, ladder_id, user_id):
+        self.dao.create_player(ladder_id, user_id)
+        self.invalidate_ladder(ladder_id)
+        self.cache.invalidate(("get_session", user_id))
+
+    def update_player_order(self, ladder_id, user_ids_with_order):
+        self.dao.update_player_order(ladder_id, user_ids_with_order)
+        self.invalidate_ladder(ladder_id)
+
+    def update_all_borrowed_points(self, ladder_id, user_ids_with_borrowed_points):
+        self.dao.update_all_borrowed_points(ladder_id, user_ids_with_borrowed_points)
+        self.invalidate_ladder(ladder_id)
+
+    def decrement_borrowed_points(self, ladder_id: int, previous_weeks_left: int, weeks_left: int):
+        self.dao.decrement_borrowed_points(ladder_id, previous_weeks_left, weeks_left)
+        self.invalidate_ladder(ladder_id)
+
+    def update_borrowed_points(self, ladder_id, user_id, new_borrowed_points):
+        self.dao.update_borrowed_points(ladder_id, user_id, new_borrowed_points)
+        self.invalidate_ladder(ladder_id)
+
+    def update_earned_points(self, ladder_id, user_id, new_points_to_add):
+        self.dao.update_earned_points(ladder_id, user_id, new_points_to_add)
+        self.invalidate_ladder(ladder_id)
+
+    def update_all_earned_points(self, ladder_id: int, user_ids_with_points_to_add: [[str, int]], bump_version: bool = False):
+        self.dao.update_all_earned_points(ladder_id, user_ids_with_points_to_add, bump_version)
+        self.invalidate_ladder(ladder_id)
+
+    def refresh_standings(self, ladder_id):
+        self.dao.refresh_standings(ladder_id)
+        self.invalidate_ladder(ladder_id)
+
+    def recompute_earned_points(self, ladder_id: int):
+        self.dao.recompute_earned_points(ladder_id)
+        self.invalidate_ladder(ladder_id)
+
+    def create_match(self, match):
+        created_match = self.dao.create_match(match)
+        self.invalidate_ladder(match.ladder_id)
+        return created_match
+
+    def create_matches(self, matches: [Match]):
+        self.dao.create_matches(matches)
+        for ladder_id in {match.ladder_id for match in matches}:
+            self.invalidate_ladder(ladder_id)
+
+    def update_match(self, match: Match):
+        self.dao.update_match(match)
+        # The update can move a match between ladders, so also drop whichever ladder it was cached under
+        for ladder_id in self.cached_ladder_ids_of_match(match.match_id) | {match.ladder_id}:
+            self.invalidate_ladder(ladder_id)
+
+    def delete_match(self, match_id):
+        self.dao.delete_match(match_id)
+        # Any cached list that this match could have been a part of will contain it
+        for ladder_id in self.cached_ladder_ids_of_match(match_id):
+            self.invalidate_ladder(ladder_id)
+
+    # endregion
+    # region Utils
+
+    def cached(self, key, load):
+        method = key[0]
+        if self.transaction_depth > 0:
+            # Reads inside a transaction are what its checks are based on, so they have to come from the database (and anything it sees could still be rolled back)
+            return load()
+
+        value = self.cache.get(key)
+        if value is MISSING:
+            self.method_stats[method]["misses"] += 1
+            value = load()
+            self.cache.put(key, value, self.ttls[method])
+        else:
+            self.method_stats[method]["hits"] += 1
+
+        # ManagerImpl decorates what it gets back (ladder flags, match winners/losers), so never hand out the cached instances themselves
+        return CachingDao.copy(value)
+
+    def invalidate_ladder(self, ladder_id):
+        self.cache.invalidate_where(lambda key, _: key[0] in CachingDao.LADDER_SCOPED_METHODS and key[1] == ladder_id)
+        # Whatever gets cached next was read at an unknown version
+        self.ladder_versions.pop(ladder_id, None)
+
+    def cached_ladder_ids_of_match(self, match_id):
+        ladder_ids = set()
+        for key, value in self.cache.items():
+            if key[0] in ("get_matches", "get_match_page") and any(match.match_id == match_id for match in value):
+                ladder_ids.add(key[1])
+        return ladder_ids
+
+    def stats(self):
+        return {**self.cache.stats(), "methods": self.method_stats}
+
+    @staticmethod
+    def copy(value):
+        if isinstance(value, Session):
+            # ManagerImpl edits the session's user and ladder IDs in place
+            return copy.deepcopy(value)
+        elif isinstance(value, list):
+            return [copy.copy(item) for item in value]
+        return copy.copy(value)
+
+    # endregion
+
+
+class MemoDao:
+    """
+    Wraps a Dao for the length of one batch request (see ManagerImpl.memoize_reads), so that its sub-requests share their reads: each distinct read
+    only goes to the wrapped Dao once, and then the same result is handed out again. Any other call is treated as a write, and clears everything read so
+    far. Reads inside a transaction always go to the wrapped Dao, like CachingDao's.
+    """
+    READ_METHODS = {name for name in dir(Dao) if name.startswith("get_")} | {"in_same_ladder"}
+
+    def __init__(self, dao: Dao):
+        self.dao = dao
+        self.memo = {}
+        self.transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.dao.transaction():
+            self.transaction_depth += 1
+            try:
+                yield
+            finally:
+                self.transaction_depth -= 1
+
+    def __getattr__(self, name):
+        # Only called for the Dao's methods (everything else is set in __init__)
+        method = getattr(self.dao, name)
+        if name in MemoDao.READ_METHODS:
+            # Lists (like get_players_by_ids' user IDs) can't be part of a key, but their contents can
+            return lambda *args, **kwargs: self.memoized(
+                (name, *[tuple(arg) if isinstance(arg, list) else arg for arg in args], *sorted(kwargs.items())), lambda: method(*args, **kwargs)
+            )
+
+        def write(*args, **kwargs):
+            self.memo.clear()
+            return method(*args, **kwargs)
+
+        return write
+
+    def memoized(self, key, load):
+        if self.transaction_depth > 0:
+            return load()
+        if key not in self.memo:
+            self.memo[key] = load()
+        # ManagerImpl decorates what it gets back, so each sub-request gets its own copy
+        return CachingDao.copy(self.memo[key])
@@ -1,11 +1,22 @@
 from domain import *
 import pymysql
 import os
+from contextlib import contextmanager
+from datetime import date
+from typing import ContextManager, Optional, Tuple
+
+from db import ConnectionManager, ConnectionUnavailableError
+from log import LOG
+from sql_metrics import SQL_METRICS
 
 
 class Dao:
+    def transaction(self) -> ContextManager: raise NotImplementedError()
+
     def get_user(self, user_id): raise NotImplementedError()
 
+    def get_session(self, user_id) -> Session: raise NotImplementedError()
+
     def in_same_ladder(self, user1_id, user2_id): raise NotImplementedError()
 
     def create_user(self, user): raise NotImplementedError()
@@ -16,10 +27,18 @@ class Dao:
 
     def get_ladder(self, ladder_id): raise NotImplementedError()
 
+    def lock_ladder(self, ladder_id: int) -> Optional[Ladder]: raise NotImplementedError()
+
     def get_ladder_admins(self, ladder_id: int) -> [str]: raise NotImplementedError()
 
+    def create_ladder(self, ladder: Ladder, code: str) -> Ladder: raise NotImplementedError()
+
     def update_ladder(self, ladder: Ladder): raise NotImplementedError
 
+    def get_ladder_version(self, ladder_id: int) -> Optional[int]: raise NotImplementedError()
+
+    def bump_ladder_version(self, ladder_id: int): raise NotImplementedError()
+
     def get_users_ladder_ids(self, user_id): raise NotImplementedError()
 
     def get_users_admin_ladder_ids(self, user_id: str) -> [int]: raise NotImplementedError()
@@ -28,6 +47,16 @@ class Dao:
 
     def get_player(self, ladder_id, user_id): raise NotImplementedError()
 
+    def get_players_by_ids(self, ladder_id: int, user_ids: [str]) -> [Player]: raise NotImplementedError()
+
+    def refresh_standings(self, ladder_id): raise NotImplementedError()
+
+    def get_standings_discrepancies(self, ladder_id) -> [str]: raise NotImplementedError()
+
+    def get_points_drift(self, ladder_id: int) -> [PointsDrift]: raise NotImplementedError()
+
+    def recompute_earned_points(self, ladder_id: int): raise NotImplementedError()
+
     def create_player(self, ladder_id, user_id): raise NotImplementedError()
 
     def update_player_order(self, ladder_id, user_ids_with_order): raise NotImplementedError()
@@ -40,12 +69,21 @@ class Dao:
 
     def update_earned_points(self, ladder_id, user_id, new_points_to_add): raise NotImplementedError()
 
+    # With bump_version, the ladder's version is bumped in the same round trip (every change to a match's points changes the ladder)
+    def update_all_earned_points(self, ladder_id: int, user_ids_with_points_to_add: [[str, int]], bump_version: bool = False): raise NotImplementedError()
+
     def get_matches(self, ladder_id, user_id=None): raise NotImplementedError()
 
+    def get_match_page(self, ladder_id: int, user_id: Optional[str], limit: int, after: Optional[Tuple[datetime, int]] = None) -> [Match]: raise NotImplementedError()
+
+    def get_match_counts(self, ladder_id: int, winner_id: str, loser_id: str, day: date) -> MatchCounts: raise NotImplementedError()
+
     def get_match(self, match_id) -> Match: raise NotImplementedError()
 
     def create_match(self, match): raise NotImplementedError()
 
+    def create_matches(self, matches: [Match]): raise NotImplementedError()
+
     def update_match(self, match: Match): raise NotImplementedError()
 
     def delete_match(self, match_id): raise NotImplementedError()
@@ -54,33 +92,182 @@ class Dao:
 
 
 class DaoImpl(Dao):
-    PLAYER_SQL_PREFIX = """
-        select u.ID, u.NAME, u.EMAIL, u.PHONE_NUMBER, u.PHOTO_URL, u.AVAILABILITY_TEXT, u.ADMIN, l.ID as LADDER_ID, p.SCORE, p.EARNED_POINTS, p.BORROWED_POINTS,
-          (select count(distinct SCORE) + 1 from players_vw where LADDER_ID = %s and SCORE > p.SCORE) as RANKING,
-          (select count(*) as WINS from matches where LADDER_ID = %s and WINNER_ID = u.ID) as WINS,
-          (select count(*) as WINS from matches where LADDER_ID = %s and LOSER_ID = u.ID) as LOSSES
-        from players_vw p
+    PLAYER_COLUMNS = "u.ID, u.NAME, u.EMAIL, u.PHONE_NUMBER, u.PHOTO_URL, u.AVAILABILITY_TEXT, u.ADMIN, s.LADDER_ID, s.SCORE, s.EARNED_POINTS, s.BORROWED_POINTS, s.RANKING, s.WINS, s.LOSSES"
+
+    # The standings table is a materialized copy of the derived player fields (score, ranking, wins and losses), so reading a ladder is a single range scan.
+    # It has to be refreshed (see refresh_standings) whenever anything that feeds into those fields changes.
+    PLAYERS_SQL = f"""
+        select {PLAYER_COLUMNS}
+        from standings s
         join users u
-            on p.USER_ID = u.ID
-        join ladders l
-            on p.LADDER_ID = l.ID
-        where l.ID = %s
+            on s.USER_ID = u.ID
+        where s.LADDER_ID = %s
+        order by s.SCORE desc, s.`ORDER` desc
+    """
+    PLAYERS_BY_IDS_SQL = f"""
+        select {PLAYER_COLUMNS}
+        from standings s
+        join users u
+            on s.USER_ID = u.ID
+        where s.LADDER_ID = %s and s.USER_ID in
+    """
+    PLAYER_SQL = f"""
+        select {PLAYER_COLUMNS}
+        from standings s
+        join users u
+            on s.USER_ID = u.ID
+        where s.LADDER_ID = %s and s.USER_ID = %s
+    """
+    # Each player's earned points, wins and losses, totalled up from the ladder's matches in one grouped pass (a range scan of each of the covering
+    # LADDER_ID_WINNER_ID_WINNER_POINTS and LADDER_ID_LOSER_ID_LOSER_POINTS indexes, see res/migrations/0007_hot_path_indexes.sql). Takes the
+    # ladder_id twice.
+    MATCH_TOTALS_SQL = """
+        select results.USER_ID, cast(sum(results.POINTS) as signed) as EARNED_POINTS, cast(sum(results.WON) as signed) as WINS,
+          cast(sum(1 - results.WON) as signed) as LOSSES
+        from (
+            select WINNER_ID as USER_ID, WINNER_POINTS as POINTS, 1 as WON from matches where LADDER_ID = %s
+            union all
+            select LOSER_ID as USER_ID, LOSER_POINTS as POINTS, 0 as WON from matches where LADDER_ID = %s
+        ) results
+        group by results.USER_ID
+    """
+    # Computes the standings of a ladder from scratch in a single pass. DENSE_RANK gives tied scores the same ranking without skipping any (the same as
+    # counting the distinct higher scores + 1), and wins/losses come from the match totals. Takes the ladder_id three times.
+    STANDINGS_RECOMPUTE_SQL = f"""
+        select p.LADDER_ID, p.USER_ID, p.EARNED_POINTS, p.BORROWED_POINTS, p.SCORE, p.`ORDER`,
+          dense_rank() over (order by p.SCORE desc) as RANKING,
+          coalesce(m.WINS, 0) as WINS,
+          coalesce(m.LOSSES, 0) as LOSSES
+        from players_vw p
+        left join ({MATCH_TOTALS_SQL}) m
+            on m.USER_ID = p.USER_ID
+        where p.LADDER_ID = %s
+    """
+    STANDINGS_REFRESH_SQL = f"""
+        insert into standings (LADDER_ID, USER_ID, EARNED_POINTS, BORROWED_POINTS, SCORE, `ORDER`, RANKING, WINS, LOSSES)
+        select r.LADDER_ID, r.USER_ID, r.EARNED_POINTS, r.BORROWED_POINTS, r.SCORE, r.`ORDER`, r.RANKING, r.WINS, r.LOSSES
+        from ({STANDINGS_RECOMPUTE_SQL}) r
+        on duplicate key update EARNED_POINTS = r.EARNED_POINTS, BORROWED_POINTS = r.BORROWED_POINTS, SCORE = r.SCORE, `ORDER` = r.`ORDER`, RANKING = r.RANKING, WINS = r.WINS, LOSSES = r.LOSSES
+    """
+    STANDINGS_DISCREPANCIES_SQL = f"""
+        select r.USER_ID
+        from ({STANDINGS_RECOMPUTE_SQL}) r
+        left join standings s
+            on s.LADDER_ID = r.LADDER_ID and s.USER_ID = r.USER_ID
+        where s.USER_ID is null
+            or s.EARNED_POINTS <> r.EARNED_POINTS or s.BORROWED_POINTS <> r.BORROWED_POINTS or s.SCORE <> r.SCORE or s.`ORDER` <> r.`ORDER`
+            or s.RANKING <> r.RANKING or s.WINS <> r.WINS or s.LOSSES <> r.LOSSES
+        order by r.USER_ID
+    """
+
+    # The players whose earned points (which are kept up to date by adding and subtracting each match's points) or standings wins and losses don't match
+    # the totals of their matches. Takes the ladder_id three times.
+    POINTS_DRIFT_SQL = f"""
+        select p.USER_ID, p.EARNED_POINTS, coalesce(m.EARNED_POINTS, 0), coalesce(s.WINS, 0), coalesce(m.WINS, 0), coalesce(s.LOSSES, 0), coalesce(m.LOSSES, 0)
+        from players p
+        left join ({MATCH_TOTALS_SQL}) m
+            on m.USER_ID = p.USER_ID
+        left join standings s
+            on s.LADDER_ID = p.LADDER_ID and s.USER_ID = p.USER_ID
+        where p.LADDER_ID = %s
+            and (p.EARNED_POINTS <> coalesce(m.EARNED_POINTS, 0) or s.USER_ID is null or s.WINS <> coalesce(m.WINS, 0) or s.LOSSES <> coalesce(m.LOSSES, 0))
+        order by p.USER_ID
+    """
+    # Sets every player's earned points to the total of their matches. Takes the ladder_id three times
+    EARNED_POINTS_RECOMPUTE_SQL = f"""
+        update players p
+        left join ({MATCH_TOTALS_SQL}) m
+            on m.USER_ID = p.USER_ID
+        set p.EARNED_POINTS = coalesce(m.EARNED_POINTS, 0)
+        where p.LADDER_ID = %s
+    """
+
+    MATCH_INSERT_SQL = "insert into matches (LADDER_ID, MATCH_DATE, WINNER_ID, LOSER_ID, WINNER_SET1_SCORE, LOSER_SET1_SCORE, WINNER_SET2_SCORE, LOSER_SET2_SCORE, WINNER_SET3_SCORE, LOSER_SET3_SCORE, WINNER_POINTS, LOSER_POINTS) values "
+    MATCH_INSERT_ROW = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    # Rows per insert statement when saving lots of matches at once, which keeps each statement well under max_allowed_packet
+    MATCH_INSERT_BATCH_SIZE = 500
+    MATCH_COLUMNS = "ID, LADDER_ID, MATCH_DATE, WINNER_ID, LOSER_ID, WINNER_SET1_SCORE, LOSER_SET1_SCORE, WINNER_SET2_SCORE, LOSER_SET2_SCORE, WINNER_SET3_SCORE, LOSER_SET3_SCORE, WINNER_POINTS, LOSER_POINTS"
+    # Keyset pagination on (MATCH_DATE, ID), newest first. A page picks up right after the last match of the page before it, so every page is a short range
+    # scan of an index that starts with the ladder (or player) and MATCH_DATE, however far back it is. The after condition takes the date twice, then the ID.
+    MATCH_PAGE_SQL = f"select {MATCH_COLUMNS} from matches where LADDER_ID = %s {{player_condition}} {{after_condition}} order by MATCH_DATE desc, ID desc limit %s"
+    MATCH_PAGE_AFTER_CONDITION = "and (MATCH_DATE < %s or (MATCH_DATE = %s and ID < %s))"
+    LADDER_MATCH_PAGE_SQL = MATCH_PAGE_SQL.format(player_condition="", after_condition="")
+    LADDER_MATCH_PAGE_AFTER_SQL = MATCH_PAGE_SQL.format(player_condition="", after_condition=MATCH_PAGE_AFTER_CONDITION)
+    # A player's matches are the ones they won and the ones they lost, which are each their own index range, so a page of each is merged (rather than
+    # filtering on WINNER_ID = %s or LOSER_ID = %s, which couldn't use an index for the order). Takes the ladder, player, after and limit arguments twice.
+    PLAYER_MATCH_PAGE_TEMPLATE = """
+        select * from (
+            ({winner_page})
+            union all
+            ({loser_page})
+        ) m
+        order by MATCH_DATE desc, ID desc
+        limit %s
+    """
+    PLAYER_MATCH_PAGE_AFTER_SQL = PLAYER_MATCH_PAGE_TEMPLATE.format(
+        winner_page=MATCH_PAGE_SQL.format(player_condition="and WINNER_ID = %s", after_condition=MATCH_PAGE_AFTER_CONDITION),
+        loser_page=MATCH_PAGE_SQL.format(player_condition="and LOSER_ID = %s", after_condition=MATCH_PAGE_AFTER_CONDITION),
+    )
+    PLAYER_MATCH_PAGE_SQL = PLAYER_MATCH_PAGE_TEMPLATE.format(
+        winner_page=MATCH_PAGE_SQL.format(player_condition="and WINNER_ID = %s", after_condition=""),
+        loser_page=MATCH_PAGE_SQL.format(player_condition="and LOSER_ID = %s", after_condition=""),
+    )
+
+    # Reads the counters that the triggers on matches keep (see res/migrations/0006_match_counters.sql), so it's three primary key lookups no matter how
+    # many matches the ladder has
+    MATCH_COUNTS_SQL = """
+        select
+          coalesce((select MATCHES from match_day_counts where LADDER_ID = %s and USER_ID = %s and DAY = %s), 0) as WINNER_MATCHES_THAT_DAY,
+          coalesce((select MATCHES from match_day_counts where LADDER_ID = %s and USER_ID = %s and DAY = %s), 0) as LOSER_MATCHES_THAT_DAY,
+          coalesce((select MATCHES from match_pair_counts where LADDER_ID = %s and USER1_ID = least(%s, %s) and USER2_ID = greatest(%s, %s)), 0) as MATCHES_BETWEEN
+    """
+    # What the database driver raises when a statement fails
+    DATABASE_ERROR = pymysql.MySQLError
+    # Times every statement (see sql_metrics)
+    metrics = SQL_METRICS
+    # MySQL's error code for a write that breaks a CHECK constraint
+    CHECK_CONSTRAINT_VIOLATED = 3819
+    # The CHECK constraints on the match counters, and what to tell the user when one of them stops a write
+    CHECK_CONSTRAINT_MESSAGES = {
+        "MAX_MATCHES_PER_DAY": "One of these players has already played a match that day. Only one match can be played each day.",
+        "MAX_MATCHES_BETWEEN_PLAYERS": "These players have already played each other the maximum number of times.",
+    }
+
+    # The user and the IDs of the ladders they play in and administer, in one round trip. The ID lists come back comma separated (or null if empty).
+    SESSION_SQL = """
+        select u.ID, u.NAME, u.EMAIL, u.PHONE_NUMBER, u.PHOTO_URL, u.AVAILABILITY_TEXT, u.ADMIN,
+          (select group_concat(p.LADDER_ID) from players p where p.USER_ID = u.ID) as LADDER_IDS,
+          (select group_concat(a.LADDER_ID) from ladder_admins a where a.USER_ID = u.ID) as ADMIN_LADDER_IDS
+        from users u
+        where u.ID = %s
     """
-    PLAYERS_SQL_POSTFIX = " order by p.SCORE desc, p.ORDER desc "
-    PLAYER_SQL_POSTFIX = " and p.USER_ID = %s"
-    PLAYERS_SQL = PLAYER_SQL_PREFIX + PLAYERS_SQL_POSTFIX
-    PLAYER_SQL = PLAYER_SQL_PREFIX + PLAYER_SQL_POSTFIX
 
     def __init__(self):
+        self.db = ConnectionManager(lambda: pymysql.connect(
+            host=os.environ["DB_HOST"], user=os.environ["DB_USERNAME"], passwd=os.environ["DB_PASSWORD"], db=os.environ["DB_DATABASE_NAME"], autocommit=True,
+            connect_timeout=5
+        ))
+
+    @contextmanager
+    def transaction(self):
+        """Everything called inside the block runs on one connection, in one transaction (so none of it is retried)"""
         try:
-            self.conn = pymysql.connect(host=os.environ["DB_HOST"], user=os.environ["DB_USERNAME"], passwd=os.environ["DB_PASSWORD"], db=os.environ["DB_DATABASE_NAME"], autocommit=True)
-        except Exception as e:
-            print("ERROR: Could not connect to MySQL", e)
+            with self.db.transaction():
+                yield
+        except ConnectionUnavailableError as e:
+            LOG.error("Could not connect to the database", error=str(e))
             raise ServiceException("Failed to connect to database")
+        except self.DATABASE_ERROR as e:
+            # Statements inside the block raise ServiceExceptions, so these come from beginning or committing the transaction
+            DaoImpl.log_error("Error beginning or committing a transaction", e)
+            raise ServiceException("Error executing database command")
 
     def get_user(self, user_id):
         return self.get_one(User, "select ID, NAME, EMAIL, PHONE_NUMBER, PHOTO_URL, AVAILABILITY_TEXT, ADMIN from users where ID = %s", user_id)
 
+    def get_session(self, user_id) -> Session:
+        return self.get_one(DaoImpl.session_from_row, self.SESSION_SQL, user_id)
+
     def in_same_ladder(self, user1_id, user2_id):
         return self.get_one(bool, "select count(*) > 0 as IN_SAME_LADDER from ladders l join players p1 on l.ID = p1.LADDER_ID and p1.USER_ID = %s join players p2 on l.ID = p2.LADDER_ID and p2.USER_ID = %s", user1_id, user2_id)
 
@@ -96,12 +283,29 @@ class DaoImpl(Dao):
     def get_ladder(self, ladder_id) -> Ladder:
         return self.get_one(Ladder, "select ID, NAME, START_DATE, END_DATE, DISTANCE_PENALTY_ON, WEEKS_FOR_BORROWED_POINTS, WEEKS_FOR_BORROWED_POINTS_LEFT from ladders where ID = %s", ladder_id)
 
+    def lock_ladder(self, ladder_id: int) -> Optional[Ladder]:
+        # Holds a lock on the ladder's row until the transaction ends, so anything else that locks the ladder waits its turn
+        return self.get_one(Ladder, "select ID, NAME, START_DATE, END_DATE, DISTANCE_PENALTY_ON, WEEKS_FOR_BORROWED_POINTS, WEEKS_FOR_BORROWED_POINTS_LEFT from ladders where ID = %s for update", ladder_id)
+
     def get_ladder_admins(self, ladder_id: int) -> [str]:
         return self.get_list(str, "select USER_ID from ladder_admins where LADDER_ID = %s", ladder_id)
 
+    def create_ladder(self, ladder: Ladder, code: str) -> Ladder:
+        ladder_id = self.insert(
+            "insert into ladders (NAME, START_DATE, END_DATE, DISTANCE_PENALTY_ON, WEEKS_FOR_BORROWED_POINTS, WEEKS_FOR_BORROWED_POINTS_LEFT, PASSCODE) values (%s, %s, %s, %s, %s, %s, %s)",
+            ladder.name, ladder.start_date, ladder.end_date, ladder.distance_penalty_on, ladder.weeks_for_borrowed_points, ladder.weeks_for_borrowed_points_left, code
+        )
+        return Ladder(ladder_id, ladder.name, ladder.start_date, ladder.end_date, ladder.distance_penalty_on, ladder.weeks_for_borrowed_points, ladder.weeks_for_borrowed_points_left)
+
     def update_ladder(self, ladder: Ladder):
         self.execute("update ladders set WEEKS_FOR_BORROWED_POINTS_LEFT = %s where ID = %s", ladder.weeks_for_borrowed_points_left, ladder.ladder_id)
 
+    def get_ladder_version(self, ladder_id: int) -> Optional[int]:
+        return self.get_one(int, "select VERSION from ladders where ID = %s", ladder_id)
+
+    def bump_ladder_version(self, ladder_id: int):
+        self.execute("update ladders set VERSION = VERSION + 1 where ID = %s", ladder_id)
+
     def get_users_ladder_ids(self, user_id):
         return self.get_list(int, "select LADDER_ID from players where user_id = %s", user_id)
 
@@ -109,10 +313,27 @@ class DaoImpl(Dao):
         return self.get_list(int, "select LADDER_ID from ladder_admins where USER_ID = %s", user_id)
 
     def get_players(self, ladder_id):
-        return self.get_list(Player, self.PLAYERS_SQL, ladder_id, ladder_id, ladder_id, ladder_id)
+        return self.get_list(Player, self.PLAYERS_SQL, ladder_id)
 
     def get_player(self, ladder_id, user_id):
-        return self.get_one(Player, self.PLAYER_SQL, ladder_id, ladder_id, ladder_id, ladder_id, user_id)
+        return self.get_one(Player, self.PLAYER_SQL, ladder_id, user_id)
+
+    def get_players_by_ids(self, ladder_id: int, user_ids: [str]) -> [Player]:
+        if len(user_ids) == 0:
+            return []
+        return self.get_list(Player, f"{self.PLAYERS_BY_IDS_SQL} ({', '.join(['%s'] * len(user_ids))})", ladder_id, *user_ids)
+
+    def refresh_standings(self, ladder_id):
+        self.execute(self.STANDINGS_REFRESH_SQL, ladder_id, ladder_id, ladder_id)
+
+    def get_standings_discrepancies(self, ladder_id) -> [str]:
+        return self.get_list(str, self.STANDINGS_DISCREPANCIES_SQL, ladder_id, ladder_id, ladder_id)
+
+    def get_points_drift(self, ladder_id: int) -> [PointsDrift]:
+        return self.get_list(PointsDrift, self.POINTS_DRIFT_SQL, ladder_id, ladder_id, ladder_id)
+
+    def recompute_earned_points(self, ladder_id: int):
+        self.execute(self.EARNED_POINTS_RECOMPUTE_SQL, ladder_id, ladder_id, ladder_id)
 
     def create_player(self, ladder_id, user_id):
         self.execute("insert into players (USER_ID, LADDER_ID) values (%s, %s)", user_id, ladder_id)
@@ -123,7 +344,8 @@ class DaoImpl(Dao):
         sql = "update players set `ORDER` = CASE USER_ID "
         for _ in user_ids_with_order:
             sql += "WHEN %s THEN %s "
-        sql += "END where LADDER_ID = %s"
+        # Players that weren't passed in go back to 0
+        sql += "ELSE 0 END where LADDER_ID = %s"
         self.execute(sql, *[item for entry in user_ids_with_order for item in entry], ladder_id)
 
     def update_borrowed_points(self, ladder_id, user_id, new_borrowed_points):
@@ -135,7 +357,8 @@ class DaoImpl(Dao):
         sql = "UPDATE players set BORROWED_POINTS = CASE USER_ID "
         for _ in user_ids_with_borrowed_points:
             sql += "WHEN %s THEN %s "
-        sql += "END where LADDER_ID = %s"
+        # Players that weren't passed in go back to 0
+        sql += "ELSE 0 END where LADDER_ID = %s"
         self.execute(sql, *[item for entry in user_ids_with_borrowed_points for item in entry], ladder_id)
 
     def decrement_borrowed_points(self, ladder_id: int, previous_weeks_left: int, weeks_left: int):
@@ -144,8 +367,23 @@ class DaoImpl(Dao):
     def update_earned_points(self, ladder_id, user_id, new_points_to_add):
         self.execute("UPDATE players set EARNED_POINTS = EARNED_POINTS + %s where LADDER_ID = %s and USER_ID = %s", new_points_to_add, ladder_id, user_id)
 
+    def update_all_earned_points(self, ladder_id: int, user_ids_with_points_to_add: [[str, int]], bump_version: bool = False):
+        if len(user_ids_with_points_to_add) == 0:
+            if bump_version:
+                self.bump_ladder_version(ladder_id)
+            return
+        cases = "WHEN %s THEN %s " * len(user_ids_with_points_to_add)
+        user_ids = ", ".join(["%s"] * len(user_ids_with_points_to_add))
+        if bump_version:
+            # A multi-table update changes each row once, no matter how many rows it's joined to, so the version goes up by one
+            sql = f"UPDATE players p join ladders l on l.ID = p.LADDER_ID set p.EARNED_POINTS = p.EARNED_POINTS + CASE p.USER_ID {cases}END, " \
+                  f"l.VERSION = l.VERSION + 1 where p.LADDER_ID = %s and p.USER_ID in ({user_ids})"
+        else:
+            sql = f"UPDATE players set EARNED_POINTS = EARNED_POINTS + CASE USER_ID {cases}END where LADDER_ID = %s and USER_ID in ({user_ids})"
+        self.execute(sql, *[item for entry in user_ids_with_points_to_add for item in entry], ladder_id, *[user_id for user_id, _ in user_ids_with_points_to_add])
+
     def get_matches(self, ladder_id, user_id=None):
-        sql_prefix = "select ID, LADDER_ID, MATCH_DATE, WINNER_ID, LOSER_ID, WINNER_SET1_SCORE, LOSER_SET1_SCORE, WINNER_SET2_SCORE, LOSER_SET2_SCORE, WINNER_SET3_SCORE, LOSER_SET3_SCORE, WINNER_POINTS, LOSER_POINTS from matches where LADDER_ID = %s"
+        sql_prefix = f"select {self.MATCH_COLUMNS} from matches where LADDER_ID = %s"
         sql_postfix = " order by MATCH_DATE desc"
 
         if user_id is not None:
@@ -154,19 +392,33 @@ class DaoImpl(Dao):
         else:
             return self.get_list(Match, sql_prefix + sql_postfix, ladder_id)
 
+    def get_match_page(self, ladder_id: int, user_id: Optional[str], limit: int, after: Optional[Tuple[datetime, int]] = None) -> [Match]:
+        after_args = [after[0], after[0], after[1]] if after is not None else []
+        if user_id is None:
+            return self.get_list(Match, self.LADDER_MATCH_PAGE_SQL if after is None else self.LADDER_MATCH_PAGE_AFTER_SQL, ladder_id, *after_args, limit)
+        sql = self.PLAYER_MATCH_PAGE_SQL if after is None else self.PLAYER_MATCH_PAGE_AFTER_SQL
+        return self.get_list(Match, sql, ladder_id, user_id, *after_args, limit, ladder_id, user_id, *after_args, limit, limit)
+
+    def get_match_counts(self, ladder_id: int, winner_id: str, loser_id: str, day: date) -> MatchCounts:
+        # The pair is ordered the same way as the triggers order it (with the column's collation), so it's done in SQL rather than in Python
+        return self.get_one(MatchCounts, self.MATCH_COUNTS_SQL, ladder_id, winner_id, day, ladder_id, loser_id, day, ladder_id, winner_id, loser_id, winner_id, loser_id)
+
     def get_match(self, match_id) -> Match:
         return self.get_one(
             Match,
-            "select ID, LADDER_ID, MATCH_DATE, WINNER_ID, LOSER_ID, WINNER_SET1_SCORE, LOSER_SET1_SCORE, WINNER_SET2_SCORE, LOSER_SET2_SCORE, WINNER_SET3_SCORE, LOSER_SET3_SCORE, WINNER_POINTS, LOSER_POINTS from matches where ID = %s",
+            f"select {self.MATCH_COLUMNS} from matches where ID = %s",
             match_id
         )
 
     def create_match(self, match):
-        match_id = self.insert(
-            "insert into matches (LADDER_ID, MATCH_DATE, WINNER_ID, LOSER_ID, WINNER_SET1_SCORE, LOSER_SET1_SCORE, WINNER_SET2_SCORE, LOSER_SET2_SCORE, WINNER_SET3_SCORE, LOSER_SET3_SCORE, WINNER_POINTS, LOSER_POINTS) values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-            *match.get_insert_properties()
-        )
-        return self.get_match(match_id)
+        match_id = self.insert(self.MATCH_INSERT_SQL + self.MATCH_INSERT_ROW, *match.get_insert_properties())
+        # The row is exactly what was inserted, so there's no need to read it back (as long as match_date has no fractional seconds, which MATCH_DATE drops)
+        return Match(match_id, *match.get_insert_properties())
+
+    def create_matches(self, matches: [Match]):
+        for i in range(0, len(matches), self.MATCH_INSERT_BATCH_SIZE):
+            batch = matches[i:i + self.MATCH_INSERT_BATCH_SIZE]
+            self.insert(self.MATCH_INSERT_SQL + ", ".join([self.MATCH_INSERT_ROW] * len(batch)), *[value for match in batch for value in match.get_insert_properties()])
 
     def update_match(self, match: Match):
         self.execute(
@@ -183,45 +435,78 @@ class DaoImpl(Dao):
 
     # region Utils
 
+    @staticmethod
+    def session_from_row(user_id, name, email, phone_number, photo_url, availability_text, admin, ladder_ids, admin_ladder_ids):
+        def parse_ids(ids): return [int(ladder_id) for ladder_id in ids.split(",")] if ids else []
+
+        return Session(User(user_id, name, email, phone_number, photo_url, availability_text, admin), parse_ids(ladder_ids), parse_ids(admin_ladder_ids))
+
     def get_list(self, klass, sql, *args):
-        try:
-            with self.conn.cursor() as cur:
+        def query(conn):
+            with conn.cursor() as cur, self.metrics.timed(sql, args) as statement:
                 cur.execute(sql, args)
                 results = []
                 for row in cur.fetchall():
                     results.append(klass(*row))
+                statement.rows = len(results)
                 return results
-        except Exception as e:
-            print(e)
-            raise ServiceException("Error getting data from database")
+
+        return self.run(query, "Error getting data from database", retry=True)
 
     def get_one(self, klass, sql, *args):
-        try:
-            with self.conn.cursor() as cur:
+        def query(conn):
+            with conn.cursor() as cur, self.metrics.timed(sql, args) as statement:
                 cur.execute(sql, args)
                 row = cur.fetchone()
                 if row is not None:
+                    statement.rows = 1
                     return klass(*row)
                 return None
-        except Exception as e:
-            print(e)
-            raise ServiceException("Error getting data from database")
+
+        return self.run(query, "Error getting data from database", retry=True)
 
     def insert(self, sql, *args):
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute(sql, args)
+        def query(conn):
+            with conn.cursor() as cur, self.metrics.timed(sql, args) as statement:
+                statement.rows = cur.execute(sql, args)
                 return cur.lastrowid
-        except Exception as e:
-            print(e)
-            raise ServiceException("Error inserting data into database")
+
+        return self.run(query, "Error inserting data into database")
 
     def execute(self, sql, *args):
+        def query(conn):
+            with conn.cursor() as cur, self.metrics.timed(sql, args) as statement:
+                statement.rows = cur.execute(sql, args)
+
+        self.run(query, "Error executing database command")
+
+    def violated_check_constraint(self, e) -> Optional[str]:
+        """The name of the CHECK constraint that a failed write broke (or "" if the error doesn't say), or None if it failed for some other reason"""
+        if not e.args or e.args[0] != self.CHECK_CONSTRAINT_VIOLATED:
+            return None
+        # The message names the constraint, e.g. "Check constraint 'MAX_MATCHES_PER_DAY' is violated."
+        return next((name for name in self.CHECK_CONSTRAINT_MESSAGES if f"'{name}'" in str(e.args[-1])), "")
+
+    def run(self, query, error_message, retry=False):
+        # Writes are never retried, since a write that lost its connection part way through may or may not have been applied
         try:
-            with self.conn.cursor() as cur:
-                affected_rows = cur.execute(sql, args)
-                print(sql, args, affected_rows)
+            return self.db.run(query, retry)
+        except ConnectionUnavailableError as e:
+            LOG.error("Could not connect to the database", error=str(e))
+            raise ServiceException("Failed to connect to database")
+        except self.DATABASE_ERROR as e:
+            DaoImpl.log_error(error_message, e)
+            constraint = self.violated_check_constraint(e)
+            if constraint is not None:
+                raise ServiceException(self.CHECK_CONSTRAINT_MESSAGES.get(constraint, "Invalid data"), 400)
+            raise ServiceException(error_message)
         except Exception as e:
-            print(e)
-            raise ServiceException("Error executing database command")
+            DaoImpl.log_error(error_message, e)
+            raise ServiceException(error_message)
+
+    @staticmethod
+    def log_error(message, e):
+        # The database's messages can quote the values in a statement (e.g. a duplicate email), so they're only logged when debugging
+        LOG.error(message, error=type(e).__name__, code=e.args[0] if e.args and isinstance(e.args[0], int) else None)
+        LOG.debug(message, error=type(e).__name__, detail=lambda: str(e))
     # endregion
@@ -0,0 +1,203 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from pymysql import err
+
+from log import LOG
+
+
+class ConnectionUnavailableError(Exception):
+    pass
+
+
+class ConnectionManager:
+    """
+    Hands out MySQL connections from a small pool that's capped at max_connections per process (a Lambda container only ever runs one request at a time,
+    so there it's one connection). Connections that have been idle for longer than ping_after seconds (e.g. across a Lambda freeze/thaw, or past the
+    server's wait_timeout) are pinged before being used, and replaced if they've gone away. Opening a connection is retried with exponential backoff.
+
+    Only operations that are safe to run twice (reads) are retried after failing part way through, and never inside a transaction. The cap across all
+    containers is max_connections times the Lambda's reserved concurrency, which should stay below MySQL's max_connections (or max_user_connections for
+    the app's user). If it's hit anyway, "too many connections" errors are treated as transient and backed off from.
+    """
+    # MySQL/pymysql error codes that mean the connection (or the server) is unavailable, rather than that the statement itself was bad
+    TRANSIENT_ERROR_CODES = {
+        1040,  # Too many connections
+        1053,  # Server shutdown in progress
+        1226,  # User has exceeded a resource limit (max_user_connections)
+        2003,  # Can't connect to the server
+        2006,  # Server has gone away
+        2013,  # Lost connection during query
+        4031,  # Disconnected by the server because of inactivity
+    }
+
+    def __init__(self, connect, max_connections=None, ping_after=None, max_attempts=3, backoff=0.05, pool_timeout=5, clock=time.monotonic, sleep=time.sleep):
+        self.connect = connect
+        self.max_connections = max_connections if max_connections is not None else int(os.environ.get("DB_MAX_CONNECTIONS", 4))
+        self.ping_after = ping_after if ping_after is not None else float(os.environ.get("DB_PING_AFTER_SECONDS", 30))
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.pool_timeout = pool_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.slots = threading.BoundedSemaphore(self.max_connections)
+        self.lock = threading.Lock()
+        self.idle = []  # (connection, last_used)
+        self.local = threading.local()
+        self.reconnects = 0
+        self.retries = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Holds one connection for the current thread until the outermost block exits. Nested blocks get the same connection, so a transaction can be
+        started in an outer block and everything called inside of it will be a part of it.
+        """
+        if getattr(self.local, "connection", None) is not None:
+            self.local.depth += 1
+            try:
+                yield self.local.connection
+            finally:
+                self.local.depth -= 1
+            return
+
+        self.local.connection, self.local.depth, self.local.broken = self.acquire(), 1, False
+        try:
+            yield self.local.connection
+        finally:
+            connection, broken = self.local.connection, self.local.broken
+            self.local.connection = None
+            self.release(connection, broken)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in a transaction on the current thread's connection, which is committed when the block exits (or rolled back if it raises). A
+        transaction started inside of another one just becomes a part of it.
+        """
+        with self.connection() as connection:
+            if getattr(self.local, "in_transaction", False):
+                yield connection
+                return
+
+            self.call_marking_broken(connection.begin)
+            self.local.in_transaction = True
+            try:
+                yield connection
+            except BaseException:
+                try:
+                    connection.rollback()
+                except Exception as e:
+                    LOG.warning("Failed to roll back a transaction", error=str(e))
+                    self.local.broken = True
+                raise
+            else:
+                self.call_marking_broken(connection.commit)
+            finally:
+                self.local.in_transaction = False
+
+    def run(self, operation, retry=False):
+        """Calls operation(connection), retrying it on a fresh connection after a transient error if retry is set and it's not part of a transaction"""
+        in_transaction = getattr(self.local, "connection", None) is not None
+        attempt = 1
+        while True:
+            with self.connection() as connection:
+                try:
+                    return operation(connection)
+                except (err.OperationalError, err.InterfaceError) as e:
+                    if not ConnectionManager.is_transient(e):
+                        raise
+                    self.local.broken = True
+                    if not retry or in_transaction or attempt >= self.max_attempts:
+                        raise
+            self.retries += 1
+            self.sleep(self.backoff_for(attempt))
+            attempt += 1
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            ConnectionManager.close_quietly(connection)
+            self.slots.release()
+
+    # region Utils
+
+    def acquire(self):
+        with self.lock:
+            idle = self.idle.pop() if self.idle else None
+        if idle is not None:
+            connection, last_used = idle
+            if self.clock() - last_used < self.ping_after:
+                return connection
+            try:
+                connection.ping(reconnect=False)
+                return connection
+            except Exception as e:
+                LOG.warning("Replacing a database connection that failed its ping", error=str(e))
+                ConnectionManager.close_quietly(connection)
+                self.reconnects += 1
+            # Keep this connection's slot for the new one
+            try:
+                return self.open()
+            except Exception:
+                self.slots.release()
+                raise
+
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            raise ConnectionUnavailableError(f"Timed out waiting for one of the {self.max_connections} database connections")
+        try:
+            return self.open()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def open(self):
+        attempt = 1
+        while True:
+            try:
+                return self.connect()
+            except (err.OperationalError, err.InterfaceError) as e:
+                if not ConnectionManager.is_transient(e) or attempt >= self.max_attempts:
+                    raise ConnectionUnavailableError(f"Unable to connect to the database: {e}")
+                LOG.warning("Failed to connect to the database", attempt=attempt, error=str(e))
+            self.sleep(self.backoff_for(attempt))
+            attempt += 1
+
+    def release(self, connection, broken):
+        if broken:
+            ConnectionManager.close_quietly(connection)
+            self.reconnects += 1
+            self.slots.release()
+        else:
+            with self.lock:
+                self.idle.append((connection, self.clock()))
+
+    def call_marking_broken(self, statement):
+        try:
+            statement()
+        except (err.OperationalError, err.InterfaceError) as e:
+            if ConnectionManager.is_transient(e):
+                self.local.broken = True
+            raise
+
+    def backoff_for(self, attempt):
+        # Full jitter, so that containers that lost the database at the same time don't all come back at the same time
+        return random.uniform(0, self.backoff * 2 ** (attempt - 1))
+
+    @staticmethod
+    def is_transient(e):
+        # InterfaceErrors are raised for connections that pymysql already knows are closed
+        return isinstance(e, err.InterfaceError) or (len(e.args) > 0 and e.args[0] in ConnectionManager.TRANSIENT_ERROR_CODES)
+
+    @staticmethod
+    def close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # endregion
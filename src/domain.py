@@ -130,6 +130,46 @@ class Player:
                                                                                                                                      admin), ladder_id, score, earned_points, borrowed_points, ranking, wins, losses
 
 
+class Session:
+    """Everything about the logged in user that's needed to authorize a request, loaded together (see Dao.get_session)"""
+
+    def __init__(self, user: User, ladder_ids: [int], admin_ladder_ids: [int]):
+        self.user, self.ladder_ids, self.admin_ladder_ids = user, ladder_ids, admin_ladder_ids
+
+
+class MatchCounts:
+    """How many matches the two players in a new match have already played, for checking it against the rules (see Dao.get_match_counts)"""
+
+    def __init__(self, winner_matches_that_day: int, loser_matches_that_day: int, matches_between: int):
+        self.winner_matches_that_day, self.loser_matches_that_day, self.matches_between = winner_matches_that_day, loser_matches_that_day, matches_between
+
+
+class PointsDrift:
+    """A player whose stored earned points, wins or losses don't match the totals of their matches (see Dao.get_points_drift)"""
+
+    def __init__(self, user_id, earned_points: int, expected_earned_points: int, wins: int, expected_wins: int, losses: int, expected_losses: int):
+        self.user_id, self.earned_points, self.expected_earned_points, self.wins, self.expected_wins, self.losses, self.expected_losses = \
+            user_id, earned_points, expected_earned_points, wins, expected_wins, losses, expected_losses
+
+    def __str__(self):
+        return f"'{self.user_id}' has {self.earned_points} earned points (expected {self.expected_earned_points}), {self.wins} wins (expected " \
+               f"{self.expected_wins}) and {self.losses} losses (expected {self.expected_losses})"
+
+
+class Page:
+    """One page of a longer list. next_cursor is passed back in to get the page after it (or is None if this is the last page)"""
+
+    def __init__(self, items: list, next_cursor: str = None):
+        self.items, self.next_cursor = items, next_cursor
+
+
+class Dashboard:
+    """Everything on a ladder's screen, for one request. The matches have the same Player objects as players attached to them"""
+
+    def __init__(self, ladder: Ladder, players: [Player], recent_matches: Page, my_matches: [Match] = None):
+        self.ladder, self.players, self.recent_matches, self.my_matches = ladder, players, recent_matches, my_matches
+
+
 class ServiceException(Exception):
     def __init__(self, message, status_code=500):
         self.error_message = message
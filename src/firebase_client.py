@@ -1,5 +1,16 @@
-import firebase_admin
-from firebase_admin import auth
+import json
+import os
+import re
+import sys
+import time
+
+from cache import LruCache, MISSING
+from domain import DomainException
+from log import LOG
+
+# firebase_admin and google.auth take ~300ms to import between them, so they're only imported once a token actually needs verifying. That keeps them off
+# of the cold start for the scheduled event and requests without a token. urllib.request (~25ms) is only imported to fetch the certificates, since the
+# Handler imports this module on the cold start to find the project ID. The same goes for hashlib and tempfile (~5ms between them).
 
 
 class FirebaseClient:
@@ -8,7 +19,198 @@ class FirebaseClient:
 
 class FirebaseClientImpl(FirebaseClient):
     def __init__(self):
+        import firebase_admin
         firebase_admin.initialize_app()
 
     def get_firebase_user(self, token):
+        from firebase_admin import auth
         return auth.verify_id_token(token)
+
+
+class CertificateFetchError(Exception):
+    pass
+
+
+class CertificateStore:
+    """
+    Holds the public certificates that Google signs Firebase ID tokens with. They are kept for as long as the Cache-Control max-age of the response that
+    served them, and saved to disk (/tmp survives between invocations of a warm container) so they don't have to be fetched again after a restart.
+    The network is only used when the certificates have expired, or a token is signed with a key ID that isn't known yet.
+    """
+    CERTIFICATES_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+    # Don't let a stream of tokens with made up key IDs turn into a stream of requests to Google
+    MIN_SECONDS_BETWEEN_FETCHES = 60
+
+    def __init__(self, path=None, fetch=None, clock=time.time):
+        self.path = path if path is not None else CertificateStore.default_path()
+        self.fetch = fetch if fetch is not None else CertificateStore.fetch_from_google
+        self.clock = clock
+        self.certificates = None
+        self.expires_at = 0
+        self.fetched_at = None
+
+    def get_certificate(self, key_id):
+        if self.certificates is None:
+            self.load()
+
+        now = self.clock()
+        expired = self.expires_at <= now
+        unknown = key_id not in self.certificates
+        recently_fetched = self.fetched_at is not None and now - self.fetched_at < CertificateStore.MIN_SECONDS_BETWEEN_FETCHES
+        if expired or (unknown and not recently_fetched):
+            try:
+                self.refresh()
+            except CertificateFetchError as e:
+                # Google keeps signing keys valid for a while after they stop being advertised, so an expired copy is better than failing every request
+                if unknown:
+                    raise
+                LOG.warning("Using expired Firebase certificates", error=str(e))
+
+        certificate = self.certificates.get(key_id)
+        if certificate is None:
+            raise ValueError(f"Token was signed with an unknown key ID: '{key_id}'")
+        return certificate
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.certificates, self.expires_at = saved["certificates"], saved["expires_at"]
+        except (OSError, ValueError, KeyError):
+            self.certificates, self.expires_at = {}, 0
+
+    def refresh(self):
+        self.fetched_at = self.clock()
+        certificates, max_age = self.fetch()
+        self.certificates, self.expires_at = certificates, self.clock() + max_age
+
+        # Write to a temporary file first so another process never reads a half written file
+        try:
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"certificates": self.certificates, "expires_at": self.expires_at}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            LOG.warning("Unable to save the Firebase certificates", error=str(e))
+
+    @staticmethod
+    def default_path():
+        import tempfile
+        return os.environ.get("FIREBASE_CERTIFICATES_PATH", os.path.join(tempfile.gettempdir(), "firebase_certificates.json"))
+
+    @staticmethod
+    def fetch_from_google():
+        import urllib.request
+        try:
+            with urllib.request.urlopen(CertificateStore.CERTIFICATES_URL, timeout=5) as response:
+                certificates = json.load(response)
+                max_age = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        except Exception as e:
+            raise CertificateFetchError(f"Unable to fetch the Firebase certificates: {e}")
+        return certificates, int(max_age.group(1)) if max_age is not None else 0
+
+
+class LocalFirebaseClient(FirebaseClient):
+    """
+    Verifies Firebase ID tokens in process, the same way that auth.verify_id_token does (signature, expiration, audience, issuer and subject), but
+    against certificates from a CertificateStore, so that verifying a token normally doesn't need any network calls.
+    """
+    BUNDLED_CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "firebase_creds.json")
+
+    def __init__(self, project_id=None, certificate_store=None):
+        self.project_id = project_id if project_id is not None else LocalFirebaseClient.find_project_id()
+        self.certificate_store = certificate_store if certificate_store is not None else CertificateStore()
+
+    def get_firebase_user(self, token):
+        from google.auth import jwt
+
+        header = jwt.decode_header(token)
+        if header.get("alg") != "RS256":
+            raise ValueError(f"Token has an unexpected algorithm: '{header.get('alg')}'")
+
+        claims = jwt.decode(token, certs=self.certificate_store.get_certificate(header.get("kid")), audience=self.project_id)
+        if claims.get("iss") != f"https://securetoken.google.com/{self.project_id}":
+            raise ValueError(f"Token has an unexpected issuer: '{claims.get('iss')}'")
+        subject = claims.get("sub")
+        if not isinstance(subject, str) or not 0 < len(subject) <= 128:
+            raise ValueError("Token has an invalid subject")
+
+        claims["uid"] = subject
+        return claims
+
+    @staticmethod
+    def find_project_id():
+        """
+        FIREBASE_PROJECT_ID (which deploy sets) or GOOGLE_CLOUD_PROJECT, falling back to the project_id in the service account's credentials (at
+        GOOGLE_APPLICATION_CREDENTIALS, or the firebase_creds.json deployed next to this file)
+        """
+        project_id = os.environ.get("FIREBASE_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT")
+        if not project_id:
+            credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or LocalFirebaseClient.BUNDLED_CREDENTIALS_PATH
+            try:
+                with open(credentials_path) as f:
+                    project_id = json.load(f).get("project_id")
+            except (OSError, ValueError, AttributeError):
+                project_id = None
+        if not project_id:
+            raise ValueError("Unable to find the Firebase project ID. Set FIREBASE_PROJECT_ID, or GOOGLE_APPLICATION_CREDENTIALS to the service account's "
+                             "credentials")
+        return project_id
+
+
+class RejectedToken:
+    """What's cached for a token that failed verification. Only the message is kept, so each rejection raises an exception of its own"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class CachingFirebaseClient(FirebaseClient):
+    """
+    Remembers the result of verifying each ID token until the token expires, since the apps send the same token with every request for up to an hour.
+    Tokens that recently failed verification are remembered for a short time too, so they are rejected without doing the verification again. Only failures
+    that say something about the token itself are remembered (not ones like failing to fetch the signing certificates).
+    """
+
+    def __init__(self, firebase_client: FirebaseClient, max_entries=1024, failure_ttl=30, clock=time.time):
+        self.firebase_client = firebase_client
+        self.failure_ttl = failure_ttl
+        self.clock = clock
+        # Tokens expire at an absolute epoch time, so this cache needs the wall clock
+        self.cache = LruCache(max_entries, clock)
+        self.rejections = 0
+
+    def get_firebase_user(self, token):
+        import hashlib
+        # Never keep the raw tokens around in memory
+        key = hashlib.sha256(token.encode()).hexdigest()
+        cached = self.cache.get(key)
+        if isinstance(cached, RejectedToken):
+            self.rejections += 1
+            raise DomainException(cached.message)
+        elif cached is not MISSING:
+            return cached
+
+        try:
+            firebase_user = self.firebase_client.get_firebase_user(token)
+        except Exception as e:
+            if CachingFirebaseClient.is_invalid_token_error(e):
+                self.cache.put(key, RejectedToken(str(e)), self.failure_ttl)
+            raise
+
+        ttl = firebase_user.get("exp", 0) - self.clock()
+        if ttl > 0:
+            self.cache.put(key, firebase_user, ttl)
+        return firebase_user
+
+    def stats(self):
+        return {**self.cache.stats(), "rejections": self.rejections}
+
+    @staticmethod
+    def is_invalid_token_error(e):
+        """Whether an error means the token itself is bad (InvalidIdTokenError also covers expired and revoked tokens)"""
+        if isinstance(e, ValueError):
+            return True
+        # Only FirebaseClientImpl raises InvalidIdTokenError, so if firebase_admin hasn't been imported, it can't be one
+        auth = sys.modules.get("firebase_admin.auth")
+        return auth is not None and isinstance(e, auth.InvalidIdTokenError)
@@ -1,97 +1,213 @@
-import datetime
 import json
+import os
 
+import serializers
 from bl import ManagerImpl
-from firebase_client import FirebaseClientImpl
-from da import DaoImpl
-from domain import ServiceException, User
+from domain import ServiceException, Page
+from log import LOG
+from router import ROUTER, MethodNotAllowedException
+from sql_metrics import SQL_METRICS
 
 
-def handle(event, _):
-    return Handler.get_instance().handle(event)
+def handle(event, context):
+    return Handler.get_instance().handle(event, context)
 
 
 class Handler:
     instance = None
+    MAX_BATCH_REQUESTS = 20
 
     @staticmethod
     def get_instance():
         if Handler.instance is None:
-            Handler.instance = Handler(ManagerImpl(FirebaseClientImpl(), DaoImpl()))
+            # Nothing is imported, connected to or read until a request needs it (the scheduled event never verifies a token, and rejected requests never
+            # touch the database), which keeps those off of the cold start
+            Handler.instance = Handler(ManagerImpl(Lazy(Handler.create_firebase_client), Lazy(Handler.create_dao)))
         return Handler.instance
 
-    def __init__(self, manager):
+    @staticmethod
+    def create_firebase_client():
+        from firebase_client import CachingFirebaseClient, LocalFirebaseClient
+        try:
+            project_id = LocalFirebaseClient.find_project_id()
+        except ValueError as e:
+            # Only requests with a token get here, and they're treated as not logged in (which routes that need auth answer with a 401). The scheduled
+            # events never verify a token, so they still run
+            LOG.error("Unable to verify Firebase tokens", error=str(e))
+            raise
+        return CachingFirebaseClient(LocalFirebaseClient(project_id))
+
+    @staticmethod
+    def create_dao():
+        from caching_dao import CachingDao
+        from da import DaoImpl
+        return CachingDao(DaoImpl())
+
+    def __init__(self, manager, sql_metrics=SQL_METRICS):
         self.manager = manager
+        self.sql_metrics = sql_metrics
 
-    def handle(self, event):
+    def handle(self, event, context=None):
+        operation = None
+        LOG.start_request(Handler.get_request_id(event, context))
         try:
             if event.get("decrement-borrowed-points"):
+                operation = "decrement_borrowed_points"
+                LOG.set_operation(operation)
                 self.manager.decrement_borrowed_points()
                 return {}
+            elif event.get("reconcile-ladders"):
+                operation = "reconcile_all_ladders"
+                LOG.set_operation(operation)
+                self.manager.reconcile_all_ladders(bool(event.get("dry-run")))
+                return {}
             elif event is None or "resource" not in event or "httpMethod" not in event:
                 raise ServiceException("Invalid request. No 'resource', or 'httpMethod' found in the event", 400)
 
-            resource, method = event["resource"], event["httpMethod"]  # These will be used to specify which endpoint was being hit
-            path_params = event.get("pathParameters", {}) if event.get("pathParameters") is not None else {}  # This will be used to get IDs and other parameters from the URL
-            query_params = event.get("queryStringParameters", {}) if event.get("queryStringParameters") is not None else {}  # This will be used to get IDs and other parameters from the URL
-            try:
-                body = json.loads(event["body"])  # This will be used for most POSTs and PUTs
-            except (TypeError, KeyError, ValueError):
-                body = None
-
-            self.manager.validate_token(self.get_token(event))
-            user = None
-            if hasattr(self.manager, "user") and isinstance(self.manager.user, User):
-                user = self.manager.user
-            print(f"Received a {method} on {resource} from {user} with body {body}")
-
-            if resource == "/users/{user_id}" and method == "GET":
-                response_body = self.manager.get_user(path_params.get("user_id"))
-            elif resource == "/users/{user_id}" and method == "PUT":
-                response_body = self.manager.update_user(path_params.get("user_id"), body)
-            elif resource == "/ladders" and method == "GET":
-                response_body = self.manager.get_ladders()
-            elif resource == "/ladders/{ladder_id}/players" and method == "GET":
-                response_body = self.manager.get_players(int(path_params.get("ladder_id")))
-            elif resource == "/ladders/{ladder_id}/players" and method == "POST":
-                response_body = self.manager.add_player_to_ladder(int(path_params.get("ladder_id")), query_params.get("code"))
-            elif resource == "/ladders/{ladder_id}/players" and method == "PUT":
-                response_body = self.manager.update_player_order(int(path_params.get("ladder_id")), query_params.get("generate_borrowed_points") == "true", body)
-            elif resource == "/ladders/{ladder_id}/players/{user_id}" and method == "PUT":
-                response_body = self.manager.update_player(int(path_params.get("ladder_id")), path_params.get("user_id"), body)
-            elif resource == "/ladders/{ladder_id}/players/{user_id}/matches" and method == "GET":
-                response_body = self.manager.get_matches(int(path_params.get("ladder_id")), path_params.get("user_id"))
-            elif resource == "/ladders/{ladder_id}/matches" and method == "POST":
-                response_body = self.manager.report_match(int(path_params.get("ladder_id")), body)
-            elif resource == "/ladders/{ladder_id}/matches/{match_id}" and method == "PUT":
-                response_body = self.manager.update_match_scores(int(path_params.get("ladder_id")), int(path_params.get("match_id")), body)
-            elif resource == "/ladders/{ladder_id}/matches/{match_id}" and method == "DELETE":
-                self.manager.delete_match(int(path_params.get("ladder_id")), int(path_params.get("match_id")))
-                response_body = {}
-            else:
-                raise ServiceException("Invalid path: '{} {}'".format(resource, method))
-
-            return format_response(response_body)
+            route = ROUTER.match(event["resource"], event["httpMethod"])  # These will be used to specify which endpoint was being hit
+            operation = route.operation_id
+            LOG.set_operation(operation)
+            arguments = self.parse_arguments(route, event)
+
+            # Routes that don't use the logged in user don't need to pay for verifying their token
+            self.manager.validate_token(self.get_token(event) if route.auth != "none" else None)
+            if route.batch:
+                # Its only argument is the body, with the sub-requests
+                return format_response(self.handle_batch(*arguments), headers={"Cache-Control": route.cache_control})
+            return format_response(*self.respond(route, arguments, event))
         except ServiceException as e:
-            return format_response({"error": e.error_message}, e.status_code)
+            return format_response(*error_response(e))
+        finally:
+            # The SQL that this invocation ran, as CloudWatch metrics (nothing is printed if it didn't touch the database)
+            self.sql_metrics.emit(operation, LOG.request_id)
+
+    def handle_batch(self, requests):
+        """
+        Runs each of a batch's sub-requests the same way that it would be run on its own (except that the token was already verified for the whole batch),
+        and returns all of their responses, in order. A sub-request that fails doesn't stop the ones after it.
+        """
+        if not isinstance(requests, list) or len(requests) == 0:
+            raise ServiceException("No requests passed in", 400)
+        elif len(requests) > Handler.MAX_BATCH_REQUESTS:
+            raise ServiceException(f"Only {Handler.MAX_BATCH_REQUESTS} requests can be batched together", 400)
+        LOG.info("Received a batch", requests=len(requests), user_id=self.manager.user.user_id if self.manager.user is not None else None)
+
+        responses = []
+        with self.manager.memoize_reads():
+            for request in requests:
+                try:
+                    if not isinstance(request, dict) or "resource" not in request or "method" not in request:
+                        raise ServiceException("Invalid request. No 'resource', or 'method' found in the request", 400)
+                    route = ROUTER.match(request["resource"], request["method"])
+                    if route.batch:
+                        raise ServiceException("Batches can't be nested", 400)
+                    body, status_code, headers = self.respond(route, self.parse_arguments(route, request), request)
+                except ServiceException as e:
+                    body, status_code, headers = error_response(e)
+                responses.append({"statusCode": status_code, "headers": headers, "body": body})
+        return responses
+
+    def respond(self, route, arguments, request):
+        """Calls the manager for a request that has been routed (and whose token has been verified), and returns the body, status code and headers to send back"""
+        user = self.manager.user
+        LOG.info("Received a request", method=route.method, resource=route.resource, user_id=user.user_id if user is not None else None)
+        if route.takes_body:
+            # Bodies can have users' names, emails and phone numbers in them, so they're only logged when debugging
+            LOG.debug("Request body", body=lambda: arguments[-1])
+        if route.auth == "required" and user is None:
+            raise ServiceException("Unable to authenticate", 401)
+
+        headers = {"Cache-Control": route.cache_control}
+        if route.etag:
+            # Looked up before the response is built, so a change made in between can only make the ETag older than the response (never newer)
+            ladder_id = route.get_argument(arguments, "ladder_id")
+            version = self.manager.get_ladder_version(ladder_id)
+            if version is not None:
+                headers["ETag"] = f'W/"{ladder_id}-{version}"'
+                if etag_matches(self.get_header(request, "if-none-match"), headers["ETag"]):
+                    return None, 304, headers
+
+        response_body = getattr(self.manager, route.operation_id)(*arguments)
+        if isinstance(response_body, Page):
+            if response_body.next_cursor is not None:
+                headers["X-Next-Cursor"] = response_body.next_cursor
+            response_body = response_body.items
+        elif not route.has_response_body:
+            response_body = {}
+        return response_body, 200, headers
+
+    @staticmethod
+    def parse_arguments(route, request):
+        """The manager method's arguments, from an API Gateway event (or one of a batch's sub-requests, which are shaped the same way)"""
+        path_params = request.get("pathParameters") or {}  # This will be used to get IDs and other parameters from the URL
+        query_params = request.get("queryStringParameters") or {}  # This will be used to get IDs and other parameters from the URL
+        arguments = route.parse_arguments(path_params, query_params)
+        if route.takes_body:
+            # Bodies are JSON strings, except in sub-requests, where they can also be left as JSON
+            body = request.get("body")
+            if isinstance(body, str):
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    body = None
+            arguments.append(body)
+        return arguments
+
+    @staticmethod
+    def get_request_id(event, context):
+        """API Gateway's ID for the request (or Lambda's, for scheduled events), so the logs can be matched up with theirs"""
+        request_id = ((event or {}).get("requestContext") or {}).get("requestId") or getattr(context, "aws_request_id", None)
+        return request_id or os.urandom(8).hex()
 
     @staticmethod
     def get_token(event):
-        # Lower case all the keys, then look for token
-        return {k.lower(): v for k, v in event["headers"].items()}.get("x-firebase-token")
+        return Handler.get_header(event, "x-firebase-token")
+
+    @staticmethod
+    def get_header(event, name):
+        # Lower case all the keys, then look for the header
+        return {k.lower(): v for k, v in (event.get("headers") or {}).items()}.get(name)
 
 
-def format_response(body=None, status_code=200):
-    return {
+class Lazy:
+    """Stands in for the object that create() returns, which is only created the first time that one of its attributes is used"""
+
+    def __init__(self, create):
+        self.create = create
+        self.instance = None
+
+    def __getattr__(self, name):
+        # Only called for attributes that Lazy doesn't have itself
+        if self.instance is None:
+            self.instance = self.create()
+        return getattr(self.instance, name)
+
+
+def error_response(e: ServiceException):
+    """The body, status code and headers for an error"""
+    if isinstance(e, MethodNotAllowedException):
+        return {"error": e.error_message}, e.status_code, {"Allow": ", ".join(e.allowed_methods)}
+    return {"error": e.error_message}, e.status_code, None
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    # If-None-Match is a list of ETags, and is always compared weakly
+    etags = [value.strip() for value in if_none_match.split(",")]
+    return "*" in etags or strip_weak_prefix(etag) in [strip_weak_prefix(value) for value in etags]
+
+
+def strip_weak_prefix(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def format_response(body=None, status_code=200, headers=None):
+    response = {
         "statusCode": status_code,
-        "body": json.dumps(body, default=default_serialize) if body is not None else None
+        "body": serializers.dumps(body) if body is not None else None
     }
+    if headers is not None:
+        response["headers"] = headers
+    return response
 
-
-def default_serialize(x):
-    if isinstance(x, datetime.datetime):
-        return x.isoformat()
-    elif isinstance(x, datetime.date):
-        return x.isoformat()
-    else:
-        return x.__dict__
@@ -0,0 +1,102 @@
+import json
+import os
+import random
+from contextvars import ContextVar
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+
+
+class RequestContext:
+    def __init__(self, request_id, operation=None, sampled=True):
+        self.request_id, self.operation, self.sampled = request_id, operation, sampled
+
+
+class Logger:
+    """
+    Logs one JSON object per line (which CloudWatch Logs Insights can filter and aggregate by field), with the current request's ID and operation, so
+    that everything logged for a request (by the handler, bl and da) can be found together.
+
+    Nothing is formatted for a line that isn't logged: fields are only serialized when they are, and a field can be a function, which is only called
+    then. Lines below level (LOG_LEVEL, INFO by default) are never logged. Below WARNING, requests are also sampled by operation, with sample_rates like
+    LOG_SAMPLE_RATES="get_players=0.1,get_ladders=0.05,*=1" (every request is logged by default). Warnings and errors are always logged.
+    """
+
+    def __init__(self, level=None, sample_rates=None, out=print, random=random.random):
+        self.out = out
+        self.random = random
+        self.context = ContextVar("log_context", default=RequestContext(None))
+        # A typo in either variable falls back to its default (with a warning), rather than failing every cold start
+        invalid = {}
+        self.level = level if level is not None else Logger.from_environment("LOG_LEVEL", "INFO", lambda value: LEVELS[value.upper()], invalid)
+        self.sample_rates = sample_rates if sample_rates is not None else Logger.from_environment("LOG_SAMPLE_RATES", "", Logger.parse_sample_rates, invalid)
+        if invalid:
+            self.warning("Invalid logging configuration, so the defaults are being used", **invalid)
+
+    @staticmethod
+    def from_environment(name, default, parse, invalid: dict):
+        """The parsed value of an environment variable, or of its default if it can't be parsed (in which case its value is added to invalid)"""
+        value = os.environ.get(name, default)
+        try:
+            return parse(value)
+        except (KeyError, ValueError):
+            invalid[name] = value
+            return parse(default)
+
+    @staticmethod
+    def parse_sample_rates(value) -> {str: float}:
+        rates = {}
+        for entry in value.split(","):
+            if entry.strip():
+                operation, rate = entry.split("=")
+                rates[operation.strip()] = float(rate)
+        return rates
+
+    def start_request(self, request_id):
+        """Everything logged from here (until the next request) is tagged with request_id"""
+        self.context.set(RequestContext(request_id))
+
+    def set_operation(self, operation):
+        """Tags the rest of the request with its operation, and decides whether the request is sampled"""
+        rate = self.sample_rates.get(operation, self.sample_rates.get("*", 1))
+        context = self.context.get()
+        self.context.set(RequestContext(context.request_id, operation, rate >= 1 or self.random() < rate))
+
+    @property
+    def request_id(self):
+        return self.context.get().request_id
+
+    def is_enabled(self, level) -> bool:
+        return level >= self.level and (level >= WARNING or self.context.get().sampled)
+
+    def debug(self, message, **fields):
+        if self.is_enabled(DEBUG):
+            self.write("DEBUG", message, fields)
+
+    def info(self, message, **fields):
+        if self.is_enabled(INFO):
+            self.write("INFO", message, fields)
+
+    def warning(self, message, **fields):
+        if self.is_enabled(WARNING):
+            self.write("WARNING", message, fields)
+
+    def error(self, message, **fields):
+        if self.is_enabled(ERROR):
+            self.write("ERROR", message, fields)
+
+    def write(self, level, message, fields):
+        context = self.context.get()
+        line = {"level": level, "message": message, "request_id": context.request_id, "operation": context.operation}
+        for name, value in fields.items():
+            line[name] = value() if callable(value) else value
+        self.out(json.dumps(line, default=to_json))
+
+
+def to_json(value):
+    # Domain objects are logged as their fields, and anything else (like dates) as its string
+    return vars(value) if hasattr(value, "__dict__") else str(value)
+
+
+# Shared by every module (the handler starts each request on it)
+LOG = Logger()
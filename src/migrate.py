@@ -0,0 +1,154 @@
+# Brings the database schema up to date by running the numbered SQL files in res/migrations that haven't been run against it yet, in order. Each one is
+# recorded in the schema_migrations table once it has run. A database that was set up before migrations were tracked can be marked as already being at a
+# version with --baseline (without running anything).
+#   cd src && python migrate.py [--dry-run] [--baseline VERSION]
+import argparse
+import os
+import re
+import sys
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(__file__), "..", "res", "migrations")
+# e.g. 0007_hot_path_indexes.sql
+FILE_NAME_PATTERN = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+class Migration:
+    def __init__(self, version: int, name: str, statements: [str]):
+        self.version, self.name, self.statements = version, name, statements
+
+    def __str__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+class MigrationError(Exception):
+    pass
+
+
+def load_migrations(path=MIGRATIONS_PATH) -> [Migration]:
+    migrations = []
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith(".sql"):
+            continue
+        match = FILE_NAME_PATTERN.match(file_name)
+        if match is None:
+            raise MigrationError(f"Invalid migration file name: '{file_name}' (expected something like 0001_description.sql)")
+        with open(os.path.join(path, file_name)) as f:
+            migrations.append(Migration(int(match.group(1)), match.group(2), split_statements(f.read())))
+
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise MigrationError(f"Duplicate migration versions in {path}: {sorted(v for v in set(versions) if versions.count(v) > 1)}")
+    return migrations
+
+
+def split_statements(sql) -> [str]:
+    """
+    Splits a file into its statements, the same way the mysql client would: on the delimiter (; unless it's changed with a "delimiter" line, which is how
+    trigger bodies with ; in them are written). Lines that are only a # or -- comment are dropped.
+    """
+    statements, current, delimiter = [], [], ";"
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#") or stripped.startswith("--") or (not stripped and not current):
+            continue
+        if stripped.lower().startswith("delimiter "):
+            delimiter = stripped.split()[1]
+            continue
+        if stripped.endswith(delimiter):
+            current.append(line.rstrip()[:-len(delimiter)])
+            statements.append("\n".join(current).strip())
+            current = []
+        else:
+            current.append(line)
+    if "\n".join(current).strip():
+        raise MigrationError(f"Statement is missing its delimiter ('{delimiter}'): {' '.join(current).strip()[:100]}")
+    return statements
+
+
+class MigrationRunner:
+    CREATE_TABLE_SQL = """
+        create table if not exists schema_migrations (
+          VERSION int not null primary key,
+          NAME varchar(128) not null,
+          APPLIED_AT timestamp not null default current_timestamp
+        )
+    """
+
+    def __init__(self, db, migrations: [Migration]):
+        """db is a ConnectionManager (or anything else with its run method)"""
+        self.db, self.migrations = db, sorted(migrations, key=lambda migration: migration.version)
+
+    def applied_versions(self) -> {int}:
+        self.execute(self.CREATE_TABLE_SQL)
+        return set(self.db.run(lambda connection: self.fetch_versions(connection)))
+
+    def pending(self) -> [Migration]:
+        applied = self.applied_versions()
+        return [migration for migration in self.migrations if migration.version not in applied]
+
+    def migrate(self, dry_run=False) -> [Migration]:
+        """Runs every pending migration in order, and returns them. Stops at the first one that fails"""
+        pending = self.pending()
+        for migration in pending:
+            print(f"{'Would apply' if dry_run else 'Applying'} {migration}")
+            if dry_run:
+                continue
+            for i, statement in enumerate(migration.statements):
+                try:
+                    self.execute(statement)
+                except Exception as e:
+                    # MySQL commits DDL as it goes, so the statements before this one have already been applied
+                    raise MigrationError(f"{migration} failed on statement {i + 1} of {len(migration.statements)}: {e}") from e
+            self.record(migration)
+        return pending
+
+    def baseline(self, version: int):
+        """Records every migration up to and including version as applied, without running them"""
+        applied = self.applied_versions()
+        for migration in self.migrations:
+            if migration.version <= version and migration.version not in applied:
+                print(f"Marking {migration} as applied")
+                self.record(migration)
+
+    def record(self, migration: Migration):
+        self.execute("insert into schema_migrations (VERSION, NAME) values (%s, %s)", migration.version, migration.name)
+
+    def execute(self, sql, *args):
+        def statement(connection):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, args or None)
+
+        self.db.run(statement)
+
+    @staticmethod
+    def fetch_versions(connection) -> [int]:
+        with connection.cursor() as cursor:
+            cursor.execute("select VERSION from schema_migrations")
+            return [row[0] for row in cursor.fetchall()]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Applies the pending migrations in res/migrations")
+    arg_parser.add_argument("--dry-run", action="store_true", help="only list the migrations that would be applied")
+    arg_parser.add_argument("--baseline", type=int, metavar="VERSION", help="mark every migration up to VERSION as applied without running it")
+    args = arg_parser.parse_args()
+
+    if "DB_HOST" not in os.environ:
+        # properties.py (with the test database's credentials) lives with the tests
+        sys.path.append(os.path.abspath(__file__ + "/../../test/"))
+        import properties
+        os.environ["DB_HOST"] = properties.db_host
+        os.environ["DB_USERNAME"] = properties.db_username
+        os.environ["DB_PASSWORD"] = properties.db_password
+        os.environ["DB_DATABASE_NAME"] = properties.db_database_name
+
+    from da import DaoImpl
+    runner = MigrationRunner(DaoImpl().db, load_migrations())
+    if args.baseline is not None:
+        runner.baseline(args.baseline)
+    elif not runner.migrate(args.dry_run):
+        print("Already up to date")
+
+
+if __name__ == "__main__":
+    main()
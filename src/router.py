@@ -0,0 +1,100 @@
+import json
+import os
+
+from domain import ServiceException
+
+# deploy copies api.json in next to the code, and when running from the repo it's in res/
+API_PATHS = [os.path.join(os.path.dirname(__file__), "api.json"), os.path.join(os.path.dirname(__file__), "..", "res", "api.json")]
+
+
+class Parameter:
+    # Parameters are strings in API Gateway events, but a batch's sub-requests can also pass them as JSON values
+    TRUE_VALUES = [True, "true", "1"]
+
+    def __init__(self, name, location, schema, required):
+        self.name, self.location, self.type, self.default, self.required = name, location, schema.get("type", "string"), schema.get("default"), required
+        self.minimum, self.maximum = schema.get("minimum"), schema.get("maximum")
+
+    def parse(self, value):
+        if value is None:
+            if self.required:
+                raise ServiceException(f"No {self.name} passed in", 400)
+            return self.default
+        elif self.type == "integer":
+            try:
+                # int() would also take True as 1 (and truncate 1.5)
+                if not isinstance(value, (int, str)) or isinstance(value, bool):
+                    raise TypeError()
+                parsed = int(value)
+            except (TypeError, ValueError):
+                raise ServiceException(f"Invalid {self.name}: '{value}'", 400)
+            if (self.minimum is not None and parsed < self.minimum) or (self.maximum is not None and parsed > self.maximum):
+                raise ServiceException(f"Invalid {self.name}: '{value}'", 400)
+            return parsed
+        elif self.type == "boolean":
+            return value in Parameter.TRUE_VALUES
+        return value
+
+
+class Route:
+    """
+    One operation from api.json. The operationId is the name of the Manager method that handles it, and the x-tennis-ladder extension holds its flags:
+    auth is "required", "optional" or "none" (a token isn't even verified), etag means the response only changes when its ladder's version does, and
+    cacheControl is the Cache-Control header that its responses are sent with (which says whether they can be shared between users). batch marks the
+    route whose body is a list of other requests, which the Handler runs itself (instead of a Manager method). Who else can use a route, like only a
+    ladder's admins, is up to its Manager method.
+    """
+
+    def __init__(self, resource, method, operation):
+        flags = operation.get("x-tennis-ladder", {})
+        self.resource, self.method, self.operation_id = resource, method, operation["operationId"]
+        self.auth, self.etag = flags.get("auth", "required"), flags.get("etag", False)
+        self.cache_control, self.batch = flags.get("cacheControl", "no-store"), flags.get("batch", False)
+        self.parameters = [Parameter(p["name"], p["in"], p.get("schema", {}), p.get("required", False)) for p in operation.get("parameters", [])]
+        self.takes_body = "requestBody" in operation
+        # An empty content (like DELETE on a match declares) means there's no body, which is sent as {}
+        self.has_response_body = bool(operation.get("responses", {}).get("200", {}).get("content"))
+
+    def parse_arguments(self, path_params, query_params):
+        """The Manager method's arguments, in the order that api.json lists the parameters"""
+        return [p.parse((path_params if p.location == "path" else query_params).get(p.name)) for p in self.parameters]
+
+    def get_argument(self, arguments, name):
+        return arguments[[p.name for p in self.parameters].index(name)]
+
+
+class Router:
+    def __init__(self, api):
+        self.routes = {}
+        for resource, operations in api["paths"].items():
+            for method, operation in operations.items():
+                self.routes[(resource, method.upper())] = Route(resource, method.upper(), operation)
+        self.methods_by_resource = {}
+        for resource, method in self.routes:
+            self.methods_by_resource.setdefault(resource, []).append(method)
+
+    def match(self, resource, method) -> Route:
+        route = self.routes.get((resource, method))
+        if route is None:
+            if resource in self.methods_by_resource:
+                raise MethodNotAllowedException(resource, method, self.methods_by_resource[resource])
+            raise ServiceException(f"Invalid path: '{resource} {method}'", 404)
+        return route
+
+    @staticmethod
+    def from_file(paths=None):
+        for path in paths or API_PATHS:
+            if os.path.exists(path):
+                with open(path) as f:
+                    return Router(json.load(f))
+        raise FileNotFoundError(f"Unable to find api.json in {paths or API_PATHS}")
+
+
+class MethodNotAllowedException(ServiceException):
+    def __init__(self, resource, method, allowed_methods):
+        super().__init__(f"Invalid method: '{resource} {method}'", 405)
+        self.allowed_methods = allowed_methods
+
+
+# Built once per container
+ROUTER = Router.from_file()
@@ -0,0 +1,162 @@
+import datetime
+import json
+
+from domain import User, Ladder, Player, Match, Dashboard, PointsDrift
+
+try:
+    import orjson
+except ImportError:
+    # Everything still works with json (and gives the same JSON, apart from whitespace), it's just slower
+    orjson = None
+
+
+def dumps(body) -> str:
+    """Serializes a response body (domain objects, or any nesting of them in lists and dicts) to JSON, with orjson if it's installed"""
+    if orjson is not None:
+        return orjson_dumps(body)
+    return json_dumps(body)
+
+
+def orjson_dumps(body) -> str:
+    # Dates go through the default hook, so they're formatted the same as with json
+    return orjson.dumps(body, default=Encoder().default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+
+
+def json_dumps(body) -> str:
+    return json.dumps(body, default=default)
+
+
+def default(value):
+    """
+    json's default hook: each object's __dict__, the way responses have always been serialized. Under json, that's faster than the per-class encoders
+    (which only pay off with orjson), so they're only used for the classes whose attributes aren't what gets sent
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if type(value) is Dashboard:
+        return encode_dashboard(None, value)
+    return value.__dict__
+
+
+class Encoder:
+    """
+    Used as orjson's default hook. Each domain class has its own encoder that lists its fields explicitly, in the order they've always been
+    serialized in, and encodes the objects nested inside of it directly. An object that shows up more than once in a body (like the Player attached to
+    every one of their matches) is only encoded once.
+    """
+
+    def __init__(self):
+        self.encoded = {}  # id(obj) -> encoded dict, for this body only
+
+    def default(self, value):
+        encoded = self.encoded.get(id(value))
+        if encoded is None:
+            encoder = ENCODERS.get(type(value))
+            if encoder is not None:
+                encoded = encoder(self, value)
+            elif isinstance(value, (datetime.datetime, datetime.date)):
+                return value.isoformat()
+            else:
+                encoded = value.__dict__
+            self.encoded[id(value)] = encoded
+        return encoded
+
+    def optional(self, value):
+        return self.default(value) if value is not None else None
+
+
+def encode_user(_, user: User):
+    return {
+        "user_id": user.user_id,
+        "name": user.name,
+        "email": user.email,
+        "phone_number": user.phone_number,
+        "photo_url": user.photo_url,
+        "availability_text": user.availability_text,
+        "admin": user.admin,
+    }
+
+
+def encode_ladder(_, ladder: Ladder):
+    encoded = {
+        "ladder_id": ladder.ladder_id,
+        "name": ladder.name,
+        "start_date": ladder.start_date.isoformat(),
+        "end_date": ladder.end_date.isoformat(),
+        "distance_penalty_on": ladder.distance_penalty_on,
+        "weeks_for_borrowed_points": ladder.weeks_for_borrowed_points,
+        "weeks_for_borrowed_points_left": ladder.weeks_for_borrowed_points_left,
+    }
+    # ManagerImpl.get_ladders only adds these for a logged in user
+    for flag in ["logged_in_user_has_joined", "logged_in_user_is_admin"]:
+        if hasattr(ladder, flag):
+            encoded[flag] = getattr(ladder, flag)
+    return encoded
+
+
+def encode_player(encoder: Encoder, player: Player):
+    return {
+        "user": encode_user(encoder, player.user),
+        "ladder_id": player.ladder_id,
+        "score": player.score,
+        "earned_points": player.earned_points,
+        "borrowed_points": player.borrowed_points,
+        "ranking": player.ranking,
+        "wins": player.wins,
+        "losses": player.losses,
+    }
+
+
+def encode_match(encoder: Encoder, match: Match):
+    return {
+        "match_id": match.match_id,
+        "ladder_id": match.ladder_id,
+        "match_date": match.match_date.isoformat() if match.match_date is not None else None,
+        "winner_id": match.winner_id,
+        "loser_id": match.loser_id,
+        "winner_set1_score": match.winner_set1_score,
+        "loser_set1_score": match.loser_set1_score,
+        "winner_set2_score": match.winner_set2_score,
+        "loser_set2_score": match.loser_set2_score,
+        "winner_set3_score": match.winner_set3_score,
+        "loser_set3_score": match.loser_set3_score,
+        "winner_points": match.winner_points,
+        "loser_points": match.loser_points,
+        "winner": encoder.optional(match.winner),
+        "loser": encoder.optional(match.loser),
+    }
+
+
+def encode_points_drift(_, drift: PointsDrift):
+    return {
+        "user_id": drift.user_id,
+        "earned_points": drift.earned_points,
+        "expected_earned_points": drift.expected_earned_points,
+        "wins": drift.wins,
+        "expected_wins": drift.expected_wins,
+        "losses": drift.losses,
+        "expected_losses": drift.expected_losses,
+    }
+
+
+def encode_dashboard(_, dashboard: Dashboard):
+    # The objects inside are passed back to the default hook to be encoded
+    return {
+        "ladder": dashboard.ladder,
+        "players": dashboard.players,
+        "recent_matches": dashboard.recent_matches.items,
+        # Pass to GET /ladders/{ladder_id}/matches as the cursor to keep going
+        "recent_matches_next_cursor": dashboard.recent_matches.next_cursor,
+        "my_matches": dashboard.my_matches,
+    }
+
+
+ENCODERS = {
+    User: encode_user,
+    Ladder: encode_ladder,
+    Player: encode_player,
+    Match: encode_match,
+    Dashboard: encode_dashboard,
+    PointsDrift: encode_points_drift,
+}
+
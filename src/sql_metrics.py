@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from log import LOG
+
+# Compiled (and cached by re) the first time a statement is fingerprinted, rather than on the cold start
+STRING_LITERAL = r"'(?:[^'\\]|\\.)*'"
+NUMBER = r"\b\d+(?:\.\d+)?\b"
+PLACEHOLDER_LIST = r"\(\?(?:, \?)*\)"
+ROW_LIST = r"\(\.\.\.\)(?:, \(\.\.\.\))+"
+CASE_CHAIN = r"(?i)(?:WHEN \? THEN \? )+"
+MAX_REDACTED_ARGS = 10
+
+
+@lru_cache(maxsize=256)
+def fingerprint(sql: str) -> str:
+    """
+    The shape of a statement, without its values: literals and placeholders become ?, and the lists that grow with the number of values passed in
+    (IN lists, rows of a multi-row insert and CASE chains) are collapsed, so the same query always has the same fingerprint
+    """
+    sql = " ".join(sql.split())
+    sql = re.sub(STRING_LITERAL, "?", sql)
+    sql = re.sub(NUMBER, "?", sql)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(CASE_CHAIN, "WHEN ? THEN ? ... ", sql)
+    sql = re.sub(PLACEHOLDER_LIST, "(...)", sql)
+    return re.sub(ROW_LIST, "(...)", sql)
+
+
+def redact(args) -> [str]:
+    """The types of a statement's arguments (never their values, which include users' names, emails and phone numbers)"""
+    types = [type(arg).__name__ for arg in args[:MAX_REDACTED_ARGS]]
+    if len(args) > MAX_REDACTED_ARGS:
+        types.append(f"... ({len(args)} in total)")
+    return types
+
+
+class StatementStats:
+    def __init__(self):
+        self.count, self.seconds, self.rows, self.errors = 0, 0.0, 0, 0
+
+
+class SqlMetrics:
+    """
+    Times every statement that a DaoImpl runs, and adds it up by its fingerprint and the ManagerImpl method that it was run for. emit prints the totals
+    for an invocation in CloudWatch's Embedded Metric Format (a JSON log line that CloudWatch turns into metrics), and starts over for the next one.
+    Statements slower than slow_query_ms are logged as they happen, with their arguments redacted. Failed ones are only counted, since the DaoImpl logs
+    their errors.
+    """
+    NAMESPACE = os.environ.get("METRICS_NAMESPACE", "TennisLadder")
+    # Where a statement's caller is looked for on the stack
+    CALLER_MODULE = "bl"
+
+    def __init__(self, slow_query_ms=None, clock=time.perf_counter, out=print, log=LOG):
+        self.slow_query_ms = slow_query_ms if slow_query_ms is not None else float(os.environ.get("SLOW_QUERY_MS", 100))
+        self.clock = clock
+        self.out = out
+        self.log = log
+        self.statements = {}  # (fingerprint, caller) -> StatementStats
+
+    @contextmanager
+    def timed(self, sql, args):
+        """Times the block around a statement. Whatever it sets as the rows on the yielded StatementStats is counted as the rows that it fetched or changed"""
+        statement = StatementStats()
+        error = None
+        start = self.clock()
+        try:
+            yield statement
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.record(sql, args, self.clock() - start, statement.rows, error)
+
+    def record(self, sql, args, seconds, rows, error=None):
+        key = (fingerprint(sql), self.calling_method())
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats()
+        stats.count += 1
+        stats.seconds += seconds
+        stats.rows += rows
+
+        if error is not None:
+            stats.errors += 1
+        elif seconds * 1000 >= self.slow_query_ms:
+            self.log.warning("SLOW_QUERY", fingerprint=key[0], caller=key[1], ms=round(seconds * 1000, 1), rows=rows, args=lambda: redact(args))
+
+    def calling_method(self):
+        """The innermost ManagerImpl method on the stack (or None, if the statement wasn't run by one)"""
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_globals.get("__name__") == self.CALLER_MODULE and not frame.f_code.co_name.startswith("<"):
+                return frame.f_code.co_name
+            frame = frame.f_back
+        return None
+
+    def emit(self, operation, request_id=None):
+        """
+        Prints (and returns) the metrics for everything recorded since the last emit, if anything was. operation becomes the metrics' dimension, and
+        request_id ties them to the request's logs
+        """
+        if not self.statements:
+            return None
+        statements, self.statements = self.statements, {}
+        totals = StatementStats()
+        for stats in statements.values():
+            totals.count += stats.count
+            totals.seconds += stats.seconds
+            totals.rows += stats.rows
+            totals.errors += stats.errors
+
+        metrics = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.NAMESPACE,
+                    "Dimensions": [["Operation"]],
+                    "Metrics": [
+                        {"Name": "SqlStatements", "Unit": "Count"},
+                        {"Name": "SqlTime", "Unit": "Milliseconds"},
+                        {"Name": "SqlRows", "Unit": "Count"},
+                        {"Name": "SqlErrors", "Unit": "Count"},
+                    ],
+                }],
+            },
+            "Operation": operation or "unknown",
+            "request_id": request_id,
+            "SqlStatements": totals.count,
+            "SqlTime": round(totals.seconds * 1000, 3),
+            "SqlRows": totals.rows,
+            "SqlErrors": totals.errors,
+            # Not metrics, but searchable in Logs Insights (slowest first)
+            "Statements": [
+                {"fingerprint": shape, "caller": caller, "count": stats.count, "ms": round(stats.seconds * 1000, 3), "rows": stats.rows, "errors": stats.errors}
+                for (shape, caller), stats in sorted(statements.items(), key=lambda item: -item[1].seconds)
+            ],
+        }
+        self.out(json.dumps(metrics))
+        return metrics
+
+
+# Shared by every DaoImpl (and emitted by the Handler at the end of each invocation)
+SQL_METRICS = SqlMetrics()
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+from datetime import date, datetime
+
+from da import DaoImpl
+from db import ConnectionManager
+from migrate import split_statements
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "res", "sqlite_schema.sql")
+
+# MATCH_DATE (and the other date columns) are stored as text in the same format that MySQL prints them in, so they sort and compare the same way
+sqlite3.register_converter("date", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("datetime", lambda value: datetime.fromisoformat(value.decode()))
+
+
+def to_sqlite(value):
+    # Like a MySQL DATETIME, the time zone and any fractional seconds are dropped
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class SqliteCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def __enter__(self): return self
+
+    def __exit__(self, *_):
+        self.cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, sql, args=None):
+        self.cursor.execute(sql.replace("%s", "?"), [to_sqlite(arg) for arg in args or ()])
+        return self.cursor.rowcount
+
+    def fetchall(self): return self.cursor.fetchall()
+
+    def fetchone(self): return self.cursor.fetchone()
+
+
+class SqliteConnection:
+    """Gives a sqlite3 connection the parts of pymysql's interface that DaoImpl and ConnectionManager use (including its %s placeholders)"""
+
+    def __init__(self, path):
+        # Transactions are only started by begin (like pymysql with autocommit on)
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.connection.execute("pragma foreign_keys = on")
+
+    def cursor(self):
+        return SqliteCursor(self.connection.cursor())
+
+    def begin(self):
+        # Takes the database's write lock up front, which is what lock_ladder relies on
+        self.connection.execute("begin immediate")
+
+    def commit(self):
+        self.connection.execute("commit")
+
+    def rollback(self):
+        self.connection.execute("rollback")
+
+    def ping(self, reconnect=False): pass
+
+    def close(self):
+        self.connection.close()
+
+
+class SqliteDao(DaoImpl):
+    """
+    Runs DaoImpl's queries against SQLite (a file, or an in-memory database) instead of MySQL, so the whole service can be run, tested and benchmarked
+    without a database server. The schema (res/sqlite_schema.sql) is created the first time a database is opened. Only the statements that SQLite doesn't
+    understand are rewritten here. Everything goes through one connection, since an in-memory database only exists on the connection that created it.
+    """
+    DATABASE_ERROR = sqlite3.Error
+
+    # SQLite's upserts name the conflicting key (and need the "where true" to tell the upsert apart from a join condition)
+    STANDINGS_REFRESH_SQL = f"""
+        insert into standings (LADDER_ID, USER_ID, EARNED_POINTS, BORROWED_POINTS, SCORE, `ORDER`, RANKING, WINS, LOSSES)
+        select r.LADDER_ID, r.USER_ID, r.EARNED_POINTS, r.BORROWED_POINTS, r.SCORE, r.`ORDER`, r.RANKING, r.WINS, r.LOSSES
+        from ({DaoImpl.STANDINGS_RECOMPUTE_SQL}) r
+        where true
+        on conflict (LADDER_ID, USER_ID) do update set EARNED_POINTS = excluded.EARNED_POINTS, BORROWED_POINTS = excluded.BORROWED_POINTS,
+          SCORE = excluded.SCORE, `ORDER` = excluded.`ORDER`, RANKING = excluded.RANKING, WINS = excluded.WINS, LOSSES = excluded.LOSSES
+    """
+    # SQLite can't join in an update, so each player's total is looked up from the match totals. Takes the ladder_id three times, like DaoImpl's
+    EARNED_POINTS_RECOMPUTE_SQL = f"""
+        update players
+        set EARNED_POINTS = coalesce((select m.EARNED_POINTS from ({DaoImpl.MATCH_TOTALS_SQL}) m where m.USER_ID = players.USER_ID), 0)
+        where LADDER_ID = %s
+    """
+    # The halves of a union can't have their own order by and limit in SQLite unless they're subqueries
+    PLAYER_MATCH_PAGE_TEMPLATE = """
+        select * from (
+            select * from ({winner_page})
+            union all
+            select * from ({loser_page})
+        ) m
+        order by MATCH_DATE desc, ID desc
+        limit %s
+    """
+    PLAYER_MATCH_PAGE_AFTER_SQL = PLAYER_MATCH_PAGE_TEMPLATE.format(
+        winner_page=DaoImpl.MATCH_PAGE_SQL.format(player_condition="and WINNER_ID = %s", after_condition=DaoImpl.MATCH_PAGE_AFTER_CONDITION),
+        loser_page=DaoImpl.MATCH_PAGE_SQL.format(player_condition="and LOSER_ID = %s", after_condition=DaoImpl.MATCH_PAGE_AFTER_CONDITION),
+    )
+    PLAYER_MATCH_PAGE_SQL = PLAYER_MATCH_PAGE_TEMPLATE.format(
+        winner_page=DaoImpl.MATCH_PAGE_SQL.format(player_condition="and WINNER_ID = %s", after_condition=""),
+        loser_page=DaoImpl.MATCH_PAGE_SQL.format(player_condition="and LOSER_ID = %s", after_condition=""),
+    )
+    # SQLite's least and greatest are min and max (the same as the triggers use)
+    MATCH_COUNTS_SQL = """
+        select
+          coalesce((select MATCHES from match_day_counts where LADDER_ID = %s and USER_ID = %s and DAY = %s), 0) as WINNER_MATCHES_THAT_DAY,
+          coalesce((select MATCHES from match_day_counts where LADDER_ID = %s and USER_ID = %s and DAY = %s), 0) as LOSER_MATCHES_THAT_DAY,
+          coalesce((select MATCHES from match_pair_counts where LADDER_ID = %s and USER1_ID = min(%s, %s) and USER2_ID = max(%s, %s)), 0) as MATCHES_BETWEEN
+    """
+
+    def __init__(self, path=":memory:"):
+        self.db = ConnectionManager(lambda: SqliteConnection(path), max_connections=1)
+        if self.get_one(int, "select count(*) from sqlite_master where type = 'table' and name = 'users'") == 0:
+            self.run(SqliteDao.create_schema, "Error creating the database")
+
+    def lock_ladder(self, ladder_id: int):
+        # There's no "for update" in SQLite. A transaction already holds the write lock for the whole database (see SqliteConnection.begin)
+        return self.get_ladder(ladder_id)
+
+    def update_all_earned_points(self, ladder_id: int, user_ids_with_points_to_add: [[str, int]], bump_version: bool = False):
+        # SQLite can't update two tables in one statement, so the version is bumped on its own
+        super().update_all_earned_points(ladder_id, user_ids_with_points_to_add)
+        if bump_version:
+            self.bump_ladder_version(ladder_id)
+
+    def decrement_borrowed_points(self, ladder_id: int, previous_weeks_left: int, weeks_left: int):
+        # MySQL rounds the result when it's saved, where SQLite's integer division would truncate it
+        self.execute("update players set BORROWED_POINTS = cast(round(BORROWED_POINTS * %s * 1.0 / %s) as integer) where LADDER_ID = %s", weeks_left, previous_weeks_left, ladder_id)
+
+    # region Utils
+
+    @staticmethod
+    def create_schema(connection):
+        with open(SCHEMA_PATH) as f:
+            statements = split_statements(f.read())
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def violated_check_constraint(self, e):
+        # e.g. "CHECK constraint failed: MAX_MATCHES_PER_DAY"
+        message = str(e)
+        if not isinstance(e, sqlite3.IntegrityError) or not message.startswith("CHECK constraint failed"):
+            return None
+        return message.split(": ", 1)[-1]
+    # endregion
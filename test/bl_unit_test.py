@@ -1,10 +1,12 @@
+import base64
 import unittest
-from datetime import datetime, timedelta, date
-from unittest.mock import patch
+from contextlib import nullcontext
+from datetime import datetime, timedelta, date, timezone as tz
+from unittest.mock import patch, call
 
-from bl import ManagerImpl
+from bl import ManagerImpl, parse_date, rank_by_score
 from da import Dao
-from domain import ServiceException, Match, User
+from domain import ServiceException, Match, MatchCounts, PointsDrift, User
 from firebase_client import FirebaseClient
 from pytz import timezone
 import fixtures
@@ -13,25 +15,37 @@ import fixtures
 class Test(unittest.TestCase):
     def setUp(self):
         self.manager = ManagerImpl(FirebaseClient(), Dao())
-        self.manager.user = fixtures.user(user_id="USER1", admin=True)
+        self.manager.session = fixtures.session(fixtures.user(user_id="USER1", admin=True))
+        # Every change to a ladder bumps its version
+        patcher = patch.object(self.manager.dao, "bump_ladder_version")
+        self.bump_ladder_version_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(self.manager.dao, "transaction", return_value=nullcontext())
+        self.transaction_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Changes to matches lock their ladder
+        patcher = patch.object(self.manager.dao, "lock_ladder")
+        self.lock_ladder_mock = patcher.start()
+        self.addCleanup(patcher.stop)
 
     # region validate_token
     def test_validate_token_with_no_token(self):
-        self.manager.user = None
+        # The user from the last request shouldn't carry over
         self.manager.validate_token(None)
+        self.assertIsNone(self.manager.session)
         self.assertIsNone(self.manager.user)
 
     def test_validate_token_throws_error(self):
         def raise_error(_): raise ValueError()
 
         with patch.object(self.manager.firebase_client, "get_firebase_user", side_effect=raise_error):
-            self.manager.user = None
+            self.manager.session = None
             self.manager.validate_token("bad_token")
             self.assertIsNone(self.manager.user)
 
     def test_validate_token_when_firebase_user_missing_required_fields(self):
         with patch.object(self.manager.firebase_client, "get_firebase_user", return_value={}) as mock:
-            self.manager.user = None
+            self.manager.session = None
             self.manager.validate_token("token")
             self.assertIsNone(self.manager.user)
         mock.assert_called_once_with("token")
@@ -39,9 +53,9 @@ class Test(unittest.TestCase):
     # noinspection PyUnresolvedReferences
     def test_validate_token_with_new_user(self):
         with patch.object(self.manager.firebase_client, "get_firebase_user", return_value={"user_id": "NEW_FB_ID", "name": "NAME", "email": "EMAIL", "picture": "PICTURE"}):
-            with patch.object(self.manager.dao, "get_user", return_value=None):
+            with patch.object(self.manager.dao, "get_session", return_value=None):
                 with patch.object(self.manager.dao, "create_user") as create_user_mock:
-                    self.manager.user = None
+                    self.manager.session = None
                     self.manager.validate_token("")
                     self.assertIsNotNone(self.manager.user)
                     self.assertEqual("NEW_FB_ID", self.manager.user.user_id)
@@ -51,13 +65,15 @@ class Test(unittest.TestCase):
                     self.assertEqual("PICTURE", self.manager.user.photo_url)
                     self.assertIsNone(self.manager.user.availability_text)
                     self.assertFalse(self.manager.user.admin)
+                    self.assertEqual([], self.manager.session.ladder_ids)
+                    self.assertEqual([], self.manager.session.admin_ladder_ids)
 
                 create_user_mock.assert_called_once_with(self.manager.user)
 
     # noinspection PyUnresolvedReferences
     def test_validate_token_with_new_user_without_name(self):
         with patch.object(self.manager.firebase_client, "get_firebase_user", return_value={"user_id": "NEW_FB_ID", "email": "EMAIL", "picture": "PICTURE"}):
-            with patch.object(self.manager.dao, "get_user", return_value=None):
+            with patch.object(self.manager.dao, "get_session", return_value=None):
                 with patch.object(self.manager.dao, "create_user"):
                     self.manager.validate_token("")
         self.assertIsNotNone(self.manager.user)
@@ -65,7 +81,7 @@ class Test(unittest.TestCase):
 
     def test_validate_token_with_new_user_with_empty_picture(self):
         with patch.object(self.manager.firebase_client, "get_firebase_user", return_value={"user_id": "NEW_FB_ID", "email": "EMAIL", "picture": ""}):
-            with patch.object(self.manager.dao, "get_user", return_value=None):
+            with patch.object(self.manager.dao, "get_session", return_value=None):
                 with patch.object(self.manager.dao, "create_user"):
                     self.manager.validate_token("")
         self.assertIsNotNone(self.manager.user)
@@ -73,15 +89,31 @@ class Test(unittest.TestCase):
 
     def test_validate_token_with_existing_user(self):
         with patch.object(self.manager.firebase_client, "get_firebase_user", return_value={"user_id": "FB_ID"}):
-            existing_user = fixtures.user()
-            with patch.object(self.manager.dao, "get_user", return_value=existing_user):
+            existing_session = fixtures.session(fixtures.user(user_id="FB_ID"), ladder_ids=[1, 2], admin_ladder_ids=[2])
+            with patch.object(self.manager.dao, "get_session", return_value=existing_session) as get_session_mock:
                 self.manager.validate_token("")
-        self.assertEqual(existing_user, self.manager.user)
+        get_session_mock.assert_called_once_with("FB_ID")
+        self.assertEqual(existing_session, self.manager.session)
+        self.assertEqual(existing_session.user, self.manager.user)
+
+    def test_validate_token_error_clears_the_previous_session(self):
+        def raise_error(_): raise ValueError()
+
+        with patch.object(self.manager.firebase_client, "get_firebase_user", side_effect=raise_error):
+            self.manager.validate_token("bad_token")
+        self.assertIsNone(self.manager.session)
+        self.assertIsNone(self.manager.user)
+
+    def test_memoize_reads_wraps_the_dao_until_its_done(self):
+        dao = self.manager.dao
+        with self.manager.memoize_reads():
+            self.assertIs(dao, self.manager.dao.dao)
+        self.assertIs(dao, self.manager.dao)
 
     # endregion
     # region get_user
     def test_get_user_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.get_user(None), 401, "Unable to authenticate")
 
     def test_get_user_with_no_user_id_param(self):
@@ -107,7 +139,7 @@ class Test(unittest.TestCase):
     # endregion
     # region update_user
     def test_update_user_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.update_user(None, None), 401, "Unable to authenticate")
 
     def test_update_user_with_no_user_id_param(self):
@@ -121,6 +153,7 @@ class Test(unittest.TestCase):
 
     def test_update_user_specifying_all_info_should_only_update_info_that_can_be_updated(self):
         user = fixtures.user()
+        self.manager.session.ladder_ids = [1, 2]
         with patch.object(self.manager.dao, "update_user") as update_user_mock:
             with patch.object(self.manager.dao, "get_user", return_value=user):
                 returned_user = self.manager.update_user(self.manager.user.user_id, {"user_id": "bad", "name": "new name", "email": "new email", "phone_number": "new phone", "photo_url": "new url", "availability_text": "new availability"})
@@ -134,6 +167,15 @@ class Test(unittest.TestCase):
         self.assertEqual("new phone", saved_user.phone_number)
         self.assertEqual("new url", saved_user.photo_url)
         self.assertEqual("new availability", saved_user.availability_text)
+        # The user shows up in the players of both of their ladders
+        self.assertEqual([((1,),), ((2,),)], self.bump_ladder_version_mock.call_args_list)
+
+    # endregion
+    # region get_ladder_version
+    def test_get_ladder_version(self):
+        with patch.object(self.manager.dao, "get_ladder_version", return_value=4) as get_ladder_version_mock:
+            self.assertEqual(4, self.manager.get_ladder_version(1))
+        get_ladder_version_mock.assert_called_once_with(1)
 
     # endregion
     # region get_ladders
@@ -142,7 +184,7 @@ class Test(unittest.TestCase):
             fixtures.ladder(1, "Ladder 1", date.today(), date.today(), False),
             fixtures.ladder(2, "Ladder 2", date.today(), date.today(), False),
         ]):
-            self.manager.user = None
+            self.manager.session = None
             ladders = self.manager.get_ladders()
             self.assertEqual(2, len(ladders))
             self.assertEqual(1, ladders[0].ladder_id)
@@ -155,63 +197,56 @@ class Test(unittest.TestCase):
             fixtures.ladder(1, "Ladder 1", date.today(), date.today(), False),
             fixtures.ladder(2, "Ladder 2", date.today(), date.today(), False),
         ]):
-            with patch.object(self.manager.dao, "get_users_ladder_ids", return_value=[]):
-                with patch.object(self.manager.dao, "get_users_admin_ladder_ids", return_value=[]):
-                    ladders = self.manager.get_ladders()
-                    self.assertEqual(2, len(ladders))
-                    self.assertEqual(1, ladders[0].ladder_id)
-                    self.assertFalse(ladders[0].logged_in_user_has_joined)
-                    self.assertEqual(2, ladders[1].ladder_id)
-                    self.assertFalse(ladders[1].logged_in_user_has_joined)
+            ladders = self.manager.get_ladders()
+            self.assertEqual(2, len(ladders))
+            self.assertEqual(1, ladders[0].ladder_id)
+            self.assertFalse(ladders[0].logged_in_user_has_joined)
+            self.assertEqual(2, ladders[1].ladder_id)
+            self.assertFalse(ladders[1].logged_in_user_has_joined)
 
     def test_get_ladders_when_in_a_ladder_should_put_your_ladder_at_the_top_and_have_true_flag(self):
         with patch.object(self.manager.dao, "get_ladders", return_value=[
             fixtures.ladder(1),
             fixtures.ladder(2),
         ]):
-            with patch.object(self.manager.dao, "get_users_ladder_ids", return_value=[2]):
-                with patch.object(self.manager.dao, "get_users_admin_ladder_ids", return_value=[]):
-                    self.manager.user = User("TEST1", "User", "user@test.com", "555-555-5555", "user.jpg", "availability", False)
-                    ladders = self.manager.get_ladders()
-                    self.assertEqual(2, len(ladders))
-                    self.assertEqual(2, ladders[0].ladder_id)
-                    self.assertTrue(ladders[0].logged_in_user_has_joined)
-                    self.assertEqual(1, ladders[1].ladder_id)
-                    self.assertFalse(ladders[1].logged_in_user_has_joined)
+            self.manager.session = fixtures.session(User("TEST1", "User", "user@test.com", "555-555-5555", "user.jpg", "availability", False), ladder_ids=[2])
+            ladders = self.manager.get_ladders()
+            self.assertEqual(2, len(ladders))
+            self.assertEqual(2, ladders[0].ladder_id)
+            self.assertTrue(ladders[0].logged_in_user_has_joined)
+            self.assertEqual(1, ladders[1].ladder_id)
+            self.assertFalse(ladders[1].logged_in_user_has_joined)
 
     def test_get_ladders_as_uber_admin_should_return_admin_for_all_ladders(self):
-        self.manager.user = fixtures.user(admin=True)
+        self.manager.session = fixtures.session(fixtures.user(admin=True))
         with patch.object(self.manager.dao, "get_ladders", return_value=[
             fixtures.ladder(ladder_id=1),
             fixtures.ladder(ladder_id=2),
             fixtures.ladder(ladder_id=3),
         ]):
-            with patch.object(self.manager.dao, "get_users_ladder_ids", return_value=[]):
-                ladders = self.manager.get_ladders()
-                self.assertEqual(3, len(ladders))
-                self.assertTrue(ladders[0].logged_in_user_is_admin)
-                self.assertTrue(ladders[1].logged_in_user_is_admin)
-                self.assertTrue(ladders[2].logged_in_user_is_admin)
+            ladders = self.manager.get_ladders()
+            self.assertEqual(3, len(ladders))
+            self.assertTrue(ladders[0].logged_in_user_is_admin)
+            self.assertTrue(ladders[1].logged_in_user_is_admin)
+            self.assertTrue(ladders[2].logged_in_user_is_admin)
 
     def test_get_ladders_should_return_ladder_admins(self):
-        self.manager.user = fixtures.user(admin=False)
+        self.manager.session = fixtures.session(fixtures.user(admin=False), admin_ladder_ids=[1, 2])
         with patch.object(self.manager.dao, "get_ladders", return_value=[
             fixtures.ladder(ladder_id=1),
             fixtures.ladder(ladder_id=2),
             fixtures.ladder(ladder_id=3),
         ]):
-            with patch.object(self.manager.dao, "get_users_ladder_ids", return_value=[]):
-                with patch.object(self.manager.dao, "get_users_admin_ladder_ids", return_value=[1, 2]):
-                    ladders = self.manager.get_ladders()
-                    self.assertEqual(3, len(ladders))
-                    self.assertTrue(ladders[0].logged_in_user_is_admin)
-                    self.assertTrue(ladders[1].logged_in_user_is_admin)
-                    self.assertFalse(ladders[2].logged_in_user_is_admin)
+            ladders = self.manager.get_ladders()
+            self.assertEqual(3, len(ladders))
+            self.assertTrue(ladders[0].logged_in_user_is_admin)
+            self.assertTrue(ladders[1].logged_in_user_is_admin)
+            self.assertFalse(ladders[2].logged_in_user_is_admin)
 
     # endregion
     # region add_player_to_ladder
     def test_add_player_to_ladder_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.add_player_to_ladder(None, None), 401, "Unable to authenticate")
 
     def test_add_player_to_ladder_with_null_ladder_id(self):
@@ -235,41 +270,48 @@ class Test(unittest.TestCase):
         with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder()):
             with patch.object(self.manager.dao, "get_ladder_code", return_value="good"):
                 with patch.object(self.manager.dao, "create_player") as create_player_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[fixtures.player()]) as get_players_mock:
-                        players = self.manager.add_player_to_ladder(1, "good")
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        with patch.object(self.manager.dao, "get_players", return_value=[fixtures.player()]) as get_players_mock:
+                            players = self.manager.add_player_to_ladder(1, "good")
         create_player_mock.assert_called_once_with(1, self.manager.user.user_id)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_called_once_with(1)
+        # The standings were refreshed in the same transaction as the new player
+        self.transaction_mock.assert_called_once_with()
         get_players_mock.assert_called_once_with(1)
         self.assertEqual(1, len(players))
+        self.assertEqual([1], self.manager.session.ladder_ids)
 
     def test_add_player_to_ladder_without_a_code_when_no_code_is_required_should_create_player(self):
         with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder()):
             with patch.object(self.manager.dao, "get_ladder_code", return_value=None):
                 with patch.object(self.manager.dao, "create_player") as create_player_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[]):
-                        self.manager.add_player_to_ladder(2, None)
+                    with patch.object(self.manager.dao, "refresh_standings"):
+                        with patch.object(self.manager.dao, "get_players", return_value=[]):
+                            self.manager.add_player_to_ladder(2, None)
         create_player_mock.assert_called_once()
 
     def test_add_player_to_ladder_with_a_code_when_no_code_is_required_should_create_player(self):
         with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder()):
             with patch.object(self.manager.dao, "get_ladder_code", return_value=None):
                 with patch.object(self.manager.dao, "create_player") as create_player_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[]):
-                        self.manager.add_player_to_ladder(2, "bad")
+                    with patch.object(self.manager.dao, "refresh_standings"):
+                        with patch.object(self.manager.dao, "get_players", return_value=[]):
+                            self.manager.add_player_to_ladder(2, "bad")
         create_player_mock.assert_called_once()
 
     # endregion
     # region update_player_order
     def test_update_player_order_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.update_player_order(None, False, None), 401, "Unable to authenticate")
 
     def test_update_player_order_with_no_ladder_id_param(self):
         self.assert_error(lambda: self.manager.update_player_order(None, False, None), 400, "No ladder_id passed in")
 
     def test_update_player_order_when_not_an_admin(self):
-        self.manager.user = fixtures.user(user_id="me", admin=False)
-        with patch.object(self.manager.dao, "get_ladder_admins", return_value=["not me"]):
-            self.assert_error(lambda: self.manager.update_player_order(1, False, None), 403, "Only admins can update player orders")
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.update_player_order(1, False, None), 403, "Only admins can update player orders")
 
     def test_update_player_order_with_no_players_param(self):
         self.assert_error(lambda: self.manager.update_player_order(1, False, None), 400, "No players passed in")
@@ -289,17 +331,22 @@ class Test(unittest.TestCase):
     def test_update_player_order_without_generating_borrowed_points_should_update_order_and_return_players(self):
         with patch.object(self.manager.dao, "get_ladder", return_value=pre_open_ladder()):
             with patch.object(self.manager.dao, "update_player_order") as update_player_order_mock:
-                with patch.object(self.manager.dao, "get_players", return_value=[]):
-                    response = self.manager.update_player_order(1, False, [{"user": {"user_id": "1"}}, {"user": {"user_id": "2"}}])
+                with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                    with patch.object(self.manager.dao, "get_players", return_value=[]):
+                        response = self.manager.update_player_order(1, False, [{"user": {"user_id": "1"}}, {"user": {"user_id": "2"}}])
         update_player_order_mock.assert_called_once_with(1, [["2", 1], ["1", 2]])
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_called_once_with(1)
+        self.transaction_mock.assert_called_once_with()
         self.assertEqual([], response)
 
     def test_update_player_order_with_generating_borrowed_points_should_update_order_and_borrowed_points_and_return_players(self):
         with patch.object(self.manager.dao, "get_ladder", return_value=pre_open_ladder(weeks_for_borrowed_points=5)):
             with patch.object(self.manager.dao, "update_player_order") as update_player_order_mock:
                 with patch.object(self.manager.dao, "update_all_borrowed_points") as update_all_borrowed_points_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[]):
-                        response = self.manager.update_player_order(1, True, [{"user": {"user_id": "1"}}, {"user": {"user_id": "2"}}])
+                    with patch.object(self.manager.dao, "refresh_standings"):
+                        with patch.object(self.manager.dao, "get_players", return_value=[]):
+                            response = self.manager.update_player_order(1, True, [{"user": {"user_id": "1"}}, {"user": {"user_id": "2"}}])
         update_player_order_mock.assert_called_once_with(1, [["2", 1], ["1", 2]])
         update_all_borrowed_points_mock.assert_called_once_with(1, [["2", 5], ["1", 10]])
         self.assertEqual([], response)
@@ -307,16 +354,15 @@ class Test(unittest.TestCase):
     # endregion
     # region update_player
     def test_update_player_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.update_player(None, None, None), 401, "Unable to authenticate")
 
     def test_update_player_with_no_ladder_id_param(self):
         self.assert_error(lambda: self.manager.update_player(None, None, None), 400, "No ladder_id passed in")
 
     def test_update_player_when_not_an_admin(self):
-        self.manager.user = fixtures.user(user_id="me", admin=False)
-        with patch.object(self.manager.dao, "get_ladder_admins", return_value=["not me"]):
-            self.assert_error(lambda: self.manager.update_player(0, None, None), 403, "Only admins can update players")
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.update_player(0, None, None), 403, "Only admins can update players")
 
     def test_update_player_with_no_user_id_param(self):
         self.assert_error(lambda: self.manager.update_player(-1, None, None), 400, "No user_id passed in")
@@ -346,8 +392,12 @@ class Test(unittest.TestCase):
         with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
             with patch.object(self.manager.dao, "get_players", return_value=[fixtures.player(borrowed_points=4), fixtures.player(borrowed_points=8)]):
                 with patch.object(self.manager.dao, "update_borrowed_points") as update_borrowed_points_mock:
-                    self.manager.update_player(1, "2", {"borrowed_points": 8})
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        self.manager.update_player(1, "2", {"borrowed_points": 8})
         update_borrowed_points_mock.assert_called_once_with(1, "2", 8)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_called_once_with(1)
+        self.transaction_mock.assert_called_once_with()
 
     # endregion
     # region get_matches
@@ -366,10 +416,81 @@ class Test(unittest.TestCase):
         self.assertEqual("TEST2", matches[0].loser.user.user_id)
         self.assertEqual("Player 2", matches[0].loser.user.name)
 
+    def test_get_matches_pages_through_matches_with_a_cursor(self):
+        matches = [fixtures.match(match_id=i, match_date=datetime(2020, 1, 10 - i), winner_id="TEST1", loser_id="TEST2") for i in range(1, 4)]
+        with patch.object(self.manager.dao, "get_match_page", side_effect=[matches, matches[2:]]) as get_match_page_mock:
+            with patch.object(self.manager.dao, "get_players", return_value=[fixtures.player(user_=fixtures.user(user_id="TEST1")), fixtures.player(user_=fixtures.user(user_id="TEST2"))]):
+                page = self.manager.get_matches(1, "TEST1", 2)
+                self.assertEqual([1, 2], [match.match_id for match in page.items])
+                self.assertEqual("TEST1", page.items[0].winner.user.user_id)
+                self.assertIsNotNone(page.next_cursor)
+
+                next_page = self.manager.get_matches(1, "TEST1", 2, page.next_cursor)
+                self.assertEqual([3], [match.match_id for match in next_page.items])
+                self.assertIsNone(next_page.next_cursor)
+        # One more than the limit is asked for, to find out whether there's another page
+        self.assertEqual((1, "TEST1", 3, None), get_match_page_mock.mock_calls[0].args)
+        self.assertEqual((1, "TEST1", 3, (datetime(2020, 1, 8), 2)), get_match_page_mock.mock_calls[1].args)
+
+    def test_get_ladder_matches_defaults_the_page_size(self):
+        with patch.object(self.manager.dao, "get_match_page", return_value=[]) as get_match_page_mock:
+            with patch.object(self.manager.dao, "get_players", return_value=[]):
+                page = self.manager.get_ladder_matches(1, None, None)
+        self.assertEqual([], page.items)
+        self.assertIsNone(page.next_cursor)
+        get_match_page_mock.assert_called_once_with(1, None, ManagerImpl.MATCH_PAGE_SIZE + 1, None)
+
+    def test_get_matches_with_an_invalid_cursor(self):
+        for cursor in ["abc", "", "W10", base64.urlsafe_b64encode(b'["bad date", 1]').decode()]:
+            with self.subTest(cursor=cursor):
+                self.assert_error(lambda: self.manager.get_ladder_matches(1, 10, cursor), 400, f"Invalid cursor: '{cursor}'")
+
+    # endregion
+    # region get_ladder_dashboard
+    def test_get_ladder_dashboard_with_a_non_existent_ladder(self):
+        self.assert_error(lambda: self.manager.get_ladder_dashboard(None, None), 400, "No ladder_id passed in")
+        with patch.object(self.manager.dao, "get_ladder", return_value=None):
+            self.assert_error(lambda: self.manager.get_ladder_dashboard(1, None), 404, "No ladder with ID: 1")
+
+    def test_get_ladder_dashboard_when_not_logged_in(self):
+        self.manager.session = None
+        with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder(ladder_id=1)):
+            with patch.object(self.manager.dao, "get_players", return_value=players_with_ids("TEST1", "TEST2")):
+                with patch.object(self.manager.dao, "get_match_page", return_value=[]) as get_match_page_mock:
+                    with patch.object(self.manager.dao, "get_matches") as get_matches_mock:
+                        dashboard = self.manager.get_ladder_dashboard(1, None)
+        self.assertEqual(1, dashboard.ladder.ladder_id)
+        self.assertEqual(["TEST1", "TEST2"], [player.user.user_id for player in dashboard.players])
+        self.assertEqual([], dashboard.recent_matches.items)
+        self.assertIsNone(dashboard.my_matches)
+        get_match_page_mock.assert_called_once_with(1, None, ManagerImpl.DASHBOARD_MATCHES + 1, None)
+        get_matches_mock.assert_not_called()
+
+    def test_get_ladder_dashboard_as_a_player_shares_the_standings(self):
+        self.manager.session = fixtures.session(fixtures.user(user_id="TEST1", admin=False), ladder_ids=[1], admin_ladder_ids=[])
+        players = players_with_ids("TEST1", "TEST2", "TEST3")
+        recent_matches = [fixtures.match(match_id=i, match_date=datetime(2020, 1, 10 - i), winner_id="TEST2", loser_id="TEST3") for i in range(1, 4)]
+        with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder(ladder_id=1)):
+            with patch.object(self.manager.dao, "get_players", return_value=players) as get_players_mock:
+                with patch.object(self.manager.dao, "get_match_page", return_value=recent_matches):
+                    with patch.object(self.manager.dao, "get_matches", return_value=[fixtures.match(match_id=4, winner_id="TEST1", loser_id="TEST2")]) as get_matches_mock:
+                        dashboard = self.manager.get_ladder_dashboard(1, 2)
+        get_players_mock.assert_called_once_with(1)
+        get_matches_mock.assert_called_once_with(1, "TEST1")
+        self.assertTrue(dashboard.ladder.logged_in_user_has_joined)
+        self.assertFalse(dashboard.ladder.logged_in_user_is_admin)
+        self.assertEqual([1, 2], [match.match_id for match in dashboard.recent_matches.items])
+        self.assertIsNotNone(dashboard.recent_matches.next_cursor)
+        self.assertEqual([4], [match.match_id for match in dashboard.my_matches])
+        # Every section has the same Player objects
+        self.assertIs(players[1], dashboard.recent_matches.items[0].winner)
+        self.assertIs(players[0], dashboard.my_matches[0].winner)
+        self.assertIs(players[1], dashboard.my_matches[0].loser)
+
     # endregion
     # region report_match
     def test_report_match_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.report_match(0, {}), 401, "Unable to authenticate")
 
     def test_report_match_with_a_null_ladder_id_param(self):
@@ -379,120 +500,104 @@ class Test(unittest.TestCase):
         self.assert_error(lambda: self.manager.report_match(0, None), 400, "Null match param")
 
     def test_report_match_with_a_non_existent_ladder_id(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=None):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=None):
             self.assert_error(lambda: self.manager.report_match(0, {}), 404, "No ladder with id: '0'")
 
     def test_report_match_before_the_ladder_is_open(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=pre_open_ladder()):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=pre_open_ladder()):
             self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST0", "TEST0", 0, 0, 0, 0)), 400, "This ladder is not currently open. You can only report matches between the ladder's start and end dates")
 
     def test_report_match_after_the_ladder_is_closed(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=fixtures.ladder(start_date=date.today() - timedelta(days=2), end_date=date.today() - timedelta(days=1))):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=fixtures.ladder(start_date=date.today() - timedelta(days=2), end_date=date.today() - timedelta(days=1))):
             self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST0", "TEST0", 0, 0, 0, 0)), 400, "This ladder is not currently open. You can only report matches between the ladder's start and end dates")
 
     def test_report_match_with_a_winner_and_loser_not_in_the_specified_ladder(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_player", return_value=None):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder()):
+            with patch.object(self.manager.dao, "get_players_by_ids", return_value=[]):
                 self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST0", "TEST1", 6, 0, 6, 0)), 400, "No user with id: 'TEST0'")
-            with patch.object(self.manager.dao, "get_player", side_effect=[fixtures.player(), None]):
+            with patch.object(self.manager.dao, "get_players_by_ids", return_value=players_with_ids("TEST1")):
                 self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST1", "TEST0", 6, 0, 6, 0)), 400, "No user with id: 'TEST0'")
 
     def test_report_match_when_each_player_has_already_played_a_match_that_day(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_player", return_value=fixtures.player()):
-                with patch.object(self.manager.dao, "get_matches", return_value=[fixtures.match(match_date=datetime.now(tz=timezone("US/Mountain")), winner_id="TEST1", loser_id="TEST2")]):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder()):
+            with patch.object(self.manager.dao, "get_players_by_ids", side_effect=lambda ladder_id, user_ids: players_with_ids(*user_ids)):
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(1, 0, 0)):
                     self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST1", "TEST3", 6, 0, 6, 0)), 400, "Reported winner has already played a match today. Only one match can be played each day.")
-                    self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST2", "TEST3", 6, 0, 6, 0)), 400, "Reported winner has already played a match today. Only one match can be played each day.")
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(0, 1, 0)):
                     self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST3", "TEST1", 6, 0, 6, 0)), 400, "Reported loser has already played a match today. Only one match can be played each day.")
-                    self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST3", "TEST2", 6, 0, 6, 0)), 400, "Reported loser has already played a match today. Only one match can be played each day.")
 
     def test_report_match_when_the_two_have_already_played_the_max_number_of_times(self):
-        test_match = fixtures.match(match_date=datetime.today() - timedelta(days=1), winner_id="TEST1", loser_id="TEST2")
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_player", return_value=fixtures.player()):
-                with patch.object(self.manager.dao, "get_matches", return_value=[test_match] * 5):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder()):
+            with patch.object(self.manager.dao, "get_players_by_ids", side_effect=lambda ladder_id, user_ids: players_with_ids(*user_ids)):
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(0, 0, 5)):
                     self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST1", "TEST2", 6, 0, 6, 0)), 400, "Players have already played 5 times.")
-                    self.assert_error(lambda: self.manager.report_match(1, create_match_dict("TEST2", "TEST1", 6, 0, 6, 0)), 400, "Players have already played 5 times.")
 
     @patch.object(Match, "calculate_scores", return_value=(10, 5))
     def test_report_match_valid_match_should_update_player_scores_and_create_match_with_new_date(self, _):
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_match", return_value=fixtures.match()):
-                with patch.object(self.manager.dao, "get_player", return_value=fixtures.player()):
-                    with patch.object(self.manager.dao, "get_matches", return_value=[]):
-                        with patch.object(self.manager.dao, "update_earned_points") as update_earned_points_mock:
-                            with patch.object(self.manager.dao, "create_match", return_value=fixtures.match(winner_id="TEST1", loser_id="TEST2")) as create_match_mock:
-                                with patch.object(self.manager.dao, "get_players", return_value=[
-                                    fixtures.player(user_=fixtures.user(user_id="TEST1")),
-                                    fixtures.player(user_=fixtures.user(user_id="TEST2"))
-                                ]):
-                                    match = self.manager.report_match(1, create_match_dict("TEST1", "TEST2", 6, 0, 6, 0))
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder()) as lock_ladder_mock:
+            with patch.object(self.manager.dao, "get_players_by_ids", side_effect=[
+                players_with_ids("TEST1", "TEST2"),
+                # With their new standings
+                [fixtures.player(user_=fixtures.user(user_id="TEST1"), earned_points=10), fixtures.player(user_=fixtures.user(user_id="TEST2"), earned_points=5)],
+            ]) as get_players_by_ids_mock:
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(0, 0, 0)) as get_match_counts_mock:
+                    with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
+                        with patch.object(self.manager.dao, "create_match", return_value=fixtures.match(ladder_id=1, winner_id="TEST1", loser_id="TEST2")) as create_match_mock:
+                            with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                                match = self.manager.report_match(1, create_match_dict("TEST1", "TEST2", 6, 0, 6, 0))
         self.assertIsNotNone(match)
-        self.assertEqual(2, update_earned_points_mock.call_count)
-        update_earned_points_mock.assert_any_call(1, "TEST1", 10)
-        update_earned_points_mock.assert_any_call(1, "TEST2", 5)
+        self.assertEqual(10, match.winner.earned_points)
+        self.assertEqual(5, match.loser.earned_points)
+        # Everything happened in one transaction, with the ladder locked
+        self.transaction_mock.assert_called_once_with()
+        lock_ladder_mock.assert_called_once_with(1)
+        self.assertEqual(2, get_players_by_ids_mock.call_count)
+        get_match_counts_mock.assert_called_once_with(1, "TEST1", "TEST2", datetime.now(timezone("US/Mountain")).date())
+        refresh_standings_mock.assert_called_once_with(1)
+        # The version is bumped along with the earned points, rather than on its own
+        self.bump_ladder_version_mock.assert_not_called()
+        update_all_earned_points_mock.assert_called_once_with(1, [["TEST1", 10], ["TEST2", 5]], bump_version=True)
         create_match_mock.assert_called_once()
         saved_match = create_match_mock.call_args.args[0]
         self.assertIsNotNone(saved_match)
         self.assertIsNotNone(saved_match.match_date)
+        self.assertEqual(0, saved_match.match_date.microsecond)
 
     def test_report_match_where_players_are_too_far_apart_when_distance_penalty_off_should_create_match(self):
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder(distance_penalty_on=False)):
-            with patch.object(self.manager.dao, "get_player", side_effect=[
-                fixtures.player(ranking=1),
-                fixtures.player(ranking=17),
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder(distance_penalty_on=False)):
+            with patch.object(self.manager.dao, "get_players_by_ids", side_effect=[
+                [fixtures.player(user_=fixtures.user(user_id="TEST1"), ranking=1), fixtures.player(user_=fixtures.user(user_id="TEST17"), ranking=17)],
+                players_with_ids("TEST1", "TEST2"),
             ]):
-                with patch.object(self.manager.dao, "get_matches", return_value=[]):
-                    with patch.object(self.manager.dao, "update_earned_points"):
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(0, 0, 0)):
+                    with patch.object(self.manager.dao, "update_all_earned_points"):
                         with patch.object(self.manager.dao, "create_match", return_value=fixtures.match(winner_id="TEST1", loser_id="TEST2")) as create_match_mock:
-                            with patch.object(self.manager.dao, "get_players", return_value=[
-                                fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
-                                fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
-                            ]):
+                            with patch.object(self.manager.dao, "refresh_standings"):
                                 self.manager.report_match(1, create_match_dict("TEST1", "TEST17", 6, 0, 6, 0))
         create_match_mock.assert_called_once()
 
-    def test_report_match_when_you_have_played_the_max_but_not_with_this_opponent_should_create_match(self):
-        test_match = fixtures.match(match_date=datetime.now() - timedelta(days=1), winner_id="TEST1", loser_id="TEST2")
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_player", return_value=fixtures.player()):
-                with patch.object(self.manager.dao, "get_matches", return_value=[test_match] * 5):
-                    with patch.object(self.manager.dao, "update_earned_points"):
-                        with patch.object(self.manager.dao, "create_match", return_value=fixtures.match(winner_id="TEST1", loser_id="TEST2")) as create_match_mock:
-                            with patch.object(self.manager.dao, "get_players", return_value=[
-                                fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
-                                fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
-                            ]):
-                                self.manager.report_match(1, create_match_dict("TEST1", "TEST3", 6, 0, 6, 0))
-        create_match_mock.assert_called_once()
-
     def test_report_match_when_you_have_played_your_opponent_one_less_than_the_max_number_of_times_should_create_match(self):
-        test_match = fixtures.match(match_date=datetime.now() - timedelta(days=1), winner_id="TEST1", loser_id="TEST2")
-        with patch.object(self.manager.dao, "get_ladder", return_value=open_ladder()):
-            with patch.object(self.manager.dao, "get_player", return_value=fixtures.player()):
-                with patch.object(self.manager.dao, "get_matches", return_value=[test_match] * 4):
-                    with patch.object(self.manager.dao, "update_earned_points"):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=open_ladder()):
+            with patch.object(self.manager.dao, "get_players_by_ids", side_effect=lambda ladder_id, user_ids: players_with_ids(*user_ids)):
+                with patch.object(self.manager.dao, "get_match_counts", return_value=MatchCounts(0, 0, 4)):
+                    with patch.object(self.manager.dao, "update_all_earned_points"):
                         with patch.object(self.manager.dao, "create_match", return_value=fixtures.match(winner_id="TEST1", loser_id="TEST2")) as create_match_mock:
-                            with patch.object(self.manager.dao, "get_players", return_value=[
-                                fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
-                                fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
-                            ]):
+                            with patch.object(self.manager.dao, "refresh_standings"):
                                 self.manager.report_match(1, create_match_dict("TEST1", "TEST2", 6, 0, 6, 0))
         create_match_mock.assert_called_once()
 
     # endregion
     # region update_match
     def test_update_match_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.update_match_scores(0, 0, {}), 401, "Unable to authenticate")
 
     def test_update_match_with_a_null_ladder_id(self):
         self.assert_error(lambda: self.manager.update_match_scores(None, 0, {}), 400, "No ladder_id passed in")
 
     def test_update_match_when_the_user_isnt_an_admin(self):
-        self.manager.user = fixtures.user(user_id="me", admin=False)
-        with patch.object(self.manager.dao, "get_ladder_admins", return_value=["not me"]):
-            self.assert_error(lambda: self.manager.update_match_scores(0, 0, {}), 403, "Only admins can update matches")
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.update_match_scores(0, 0, {}), 403, "Only admins can update matches")
 
     def test_update_match_with_a_null_match_id(self):
         self.assert_error(lambda: self.manager.update_match_scores(0, None, None), 400, "Null match_id param")
@@ -521,12 +626,13 @@ class Test(unittest.TestCase):
         )
         with patch.object(self.manager.dao, "get_match", return_value=existing_match):
             with patch.object(self.manager.dao, "update_match") as update_match_mock:
-                with patch.object(self.manager.dao, "update_earned_points") as update_earned_points_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[
-                        fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
-                        fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
-                    ]):
-                        returned_match = self.manager.update_match_scores(0, 1, create_match_dict('BAD1', 'BAD2', 6, 0, 0, 6, 6, 1, ladder_id=2))
+                with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        with patch.object(self.manager.dao, "get_players_by_ids", return_value=[
+                            fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
+                            fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
+                        ]):
+                            returned_match = self.manager.update_match_scores(1, 1, create_match_dict('BAD1', 'BAD2', 6, 0, 0, 6, 6, 1, ladder_id=2))
         # Test that returned value has winner/loser info
         self.assertEqual("Player 1", returned_match.winner.user.name)
         self.assertEqual("Player 2", returned_match.loser.user.name)
@@ -550,28 +656,36 @@ class Test(unittest.TestCase):
         self.assertEqual("TEST2", updated_match.loser_id)
 
         # Test earned points updated
-        self.assertEqual(2, update_earned_points_mock.call_count)
-        update_earned_points_mock.assert_any_call(1, "TEST1", -1)
-        update_earned_points_mock.assert_any_call(1, "TEST2", 1)
+        update_all_earned_points_mock.assert_called_once_with(1, [["TEST1", -1], ["TEST2", 1]], bump_version=True)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.transaction_mock.assert_called_once_with()
+        self.lock_ladder_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_not_called()
+
+    def test_update_match_locks_the_ladder_before_reading_the_match(self):
+        calls = []
+        with patch.object(self.manager.dao, "lock_ladder", side_effect=lambda ladder_id: calls.append(("lock_ladder", ladder_id))):
+            with patch.object(self.manager.dao, "get_match", side_effect=lambda match_id: calls.append(("get_match", match_id))):
+                self.assert_error(lambda: self.manager.update_match_scores(1, 2, {}), 404, "No match with ID: 2")
+        self.assertEqual([("lock_ladder", 1), ("get_match", 2)], calls)
 
     def test_update_match_when_the_winner_would_go_below_the_min_amount_should_stay_at_min_amount(self):
         existing_match = fixtures.match(ladder_id=1, winner_id='TEST1', loser_id='TEST2', winner_set1_score=6, loser_set1_score=0, winner_set2_score=6, loser_set2_score=0, winner_points=Match.MIN_WINNER_POINTS, loser_points=0)
         with patch.object(self.manager.dao, "get_match", return_value=existing_match):
             with patch.object(self.manager.dao, "update_match") as update_match_mock:
-                with patch.object(self.manager.dao, "update_earned_points") as update_earned_points_mock:
-                    with patch.object(self.manager.dao, "get_players", return_value=[
-                        fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
-                        fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
-                    ]):
-                        self.manager.update_match_scores(0, 1, create_match_dict('BAD1', 'BAD2', 6, 0, 6, 1))
+                with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
+                    with patch.object(self.manager.dao, "refresh_standings"):
+                        with patch.object(self.manager.dao, "get_players_by_ids", return_value=[
+                            fixtures.player(user_=fixtures.user(user_id="TEST1", name="Player 1")),
+                            fixtures.player(user_=fixtures.user(user_id="TEST2", name="Player 2")),
+                        ]):
+                            self.manager.update_match_scores(0, 1, create_match_dict('BAD1', 'BAD2', 6, 0, 6, 1))
         update_match_mock.assert_called_once()
         updated_match = update_match_mock.call_args.args[0]
         self.assertIsNotNone(updated_match)
         self.assertEqual(Match.MIN_WINNER_POINTS, updated_match.winner_points)  # Can't go below the min amount, even though you're losing points
         self.assertEqual(1, updated_match.loser_points)
-        self.assertEqual(2, update_earned_points_mock.call_count)
-        update_earned_points_mock.assert_any_call(1, "TEST1", 0)
-        update_earned_points_mock.assert_any_call(1, "TEST2", 1)
+        update_all_earned_points_mock.assert_called_once_with(1, [["TEST1", 0], ["TEST2", 1]], bump_version=True)
 
     # endregion
     # region get_score_diff
@@ -597,50 +711,194 @@ class Test(unittest.TestCase):
     # endregion
     # region delete_match
     def test_delete_match_when_not_logged_in(self):
-        self.manager.user = None
+        self.manager.session = None
         self.assert_error(lambda: self.manager.delete_match(0, 0), 401, "Unable to authenticate")
 
     def test_delete_match_with_a_null_ladder_id(self):
         self.assert_error(lambda: self.manager.delete_match(None, 0), 400, "No ladder_id passed in")
 
     def test_delete_match_when_not_an_admin(self):
-        self.manager.user = fixtures.user(user_id="me", admin=False)
-        with patch.object(self.manager.dao, "get_ladder_admins", return_value=["not me"]):
-            self.assert_error(lambda: self.manager.delete_match(0, 0), 403, "Only admins can delete matches")
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.delete_match(0, 0), 403, "Only admins can delete matches")
 
     def test_delete_match_with_a_null_match_id(self):
         self.assert_error(lambda: self.manager.delete_match(0, None), 400, "Null match_id param")
 
     def test_delete_match_that_doesnt_exist_should_do_nothing_but_succeed(self):
         with patch.object(self.manager.dao, "get_match", return_value=None):
-            with patch.object(self.manager.dao, "update_earned_points") as update_earned_points_mock:
+            with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
                 with patch.object(self.manager.dao, "delete_match") as delete_match_mock:
                     self.manager.delete_match(0, -1)
-        update_earned_points_mock.assert_not_called()
+        update_all_earned_points_mock.assert_not_called()
         delete_match_mock.assert_not_called()
 
     def test_delete_match_valid_should_delete_match_and_reverse_players_earned_points(self):
         with patch.object(self.manager.dao, "get_match", return_value=fixtures.match(match_id=123, ladder_id=1, winner_id="TEST1", loser_id="TEST2", winner_points=33, loser_points=6)):
-            with patch.object(self.manager.dao, "update_earned_points") as update_earned_points_mock:
+            with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
                 with patch.object(self.manager.dao, "delete_match") as delete_match_mock:
-                    self.manager.delete_match(0, 1)
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        self.manager.delete_match(1, 1)
         # Test that match was deleted
         delete_match_mock.assert_called_once_with(1)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_not_called()
         # Test earned points updated
-        self.assertEqual(2, update_earned_points_mock.call_count)
-        update_earned_points_mock.assert_any_call(1, "TEST1", -33)
-        update_earned_points_mock.assert_any_call(1, "TEST2", -6)
+        update_all_earned_points_mock.assert_called_once_with(1, [["TEST1", -33], ["TEST2", -6]], bump_version=True)
+        self.transaction_mock.assert_called_once_with()
+        self.lock_ladder_mock.assert_called_once_with(1)
+
+    def test_delete_match_locks_the_ladder_before_reading_the_match(self):
+        calls = []
+        with patch.object(self.manager.dao, "lock_ladder", side_effect=lambda ladder_id: calls.append(("lock_ladder", ladder_id))):
+            with patch.object(self.manager.dao, "get_match", side_effect=lambda match_id: calls.append(("get_match", match_id))):
+                self.manager.delete_match(1, 2)
+        self.assertEqual([("lock_ladder", 1), ("get_match", 2)], calls)
 
     def test_delete_match_valid_as_a_ladder_admin_should_delete_match(self):
-        self.manager.user = fixtures.user(user_id="me", admin=False)
-        with patch.object(self.manager.dao, "get_ladder_admins", return_value=["not me", "me"]):
-            with patch.object(self.manager.dao, "get_match", return_value=fixtures.match(match_id=123, ladder_id=1, winner_id="TEST1", loser_id="TEST2", winner_points=33, loser_points=6)):
-                with patch.object(self.manager.dao, "update_earned_points"):
-                    with patch.object(self.manager.dao, "delete_match") as delete_match_mock:
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[0])
+        with patch.object(self.manager.dao, "get_match", return_value=fixtures.match(match_id=123, ladder_id=1, winner_id="TEST1", loser_id="TEST2", winner_points=33, loser_points=6)):
+            with patch.object(self.manager.dao, "update_all_earned_points"):
+                with patch.object(self.manager.dao, "delete_match") as delete_match_mock:
+                    with patch.object(self.manager.dao, "refresh_standings"):
                         self.manager.delete_match(0, 1)
         # Test that match was deleted
         delete_match_mock.assert_called_once_with(1)
+        # Along with the ladder in the URL, the match's own ladder was locked
+        self.assertEqual([call(0), call(1)], self.lock_ladder_mock.call_args_list)
+
+    # endregion
+    # region import_matches
+    def test_import_matches_when_not_logged_in(self):
+        self.manager.session = None
+        self.assert_error(lambda: self.manager.import_matches(1, []), 401, "Unable to authenticate")
+
+    def test_import_matches_when_not_an_admin(self):
+        self.manager.session = fixtures.session(fixtures.user(user_id="me", admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0)]), 403, "Only admins can import matches")
+
+    def test_import_matches_with_no_matches(self):
+        self.assert_error(lambda: self.manager.import_matches(1, None), 400, "No matches passed in")
+        self.assert_error(lambda: self.manager.import_matches(1, []), 400, "No matches passed in")
+        self.assert_error(lambda: self.manager.import_matches(1, {}), 400, "No matches passed in")
+
+    def test_import_matches_with_too_many_matches(self):
+        match_dicts = [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0)] * (ManagerImpl.MAX_IMPORTED_MATCHES + 1)
+        self.assert_error(lambda: self.manager.import_matches(1, match_dicts), 400, f"Only {ManagerImpl.MAX_IMPORTED_MATCHES} matches can be imported at a time")
+
+    def test_import_matches_with_an_invalid_match(self):
+        played = (datetime.now() - timedelta(days=1)).isoformat()
+        valid = create_match_dict("TEST1", "TEST2", 6, 0, 6, 0, match_date=played)
+        self.assert_error(lambda: self.manager.import_matches(1, [valid, create_match_dict("TEST1", "TEST2", 6, 0, 6, 0)]), 400, "Invalid match #2: Missing match_date")
+        self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST1", 6, 0, 6, 0, match_date=played)]), 400, "Invalid match #1: A match cannot be played against oneself")
+        self.assert_error(lambda: self.manager.import_matches(1, [valid, "not a match"]), 400, "Invalid match #2: 'str' object has no attribute 'get'")
+        self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0, match_date="yesterday")]), 400,
+                          "Invalid match #1: Invalid match_date: 'yesterday'")
+        tomorrow = (datetime.now() + timedelta(days=1)).isoformat()
+        self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0, match_date=tomorrow)]), 400, "Invalid match #1: It hasn't been played yet")
+
+    def test_import_matches_with_a_non_existent_ladder(self):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=None):
+            played = (datetime.now() - timedelta(days=1)).isoformat()
+            self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0, match_date=played)]), 404, "No ladder with ID: 1")
+
+    def test_import_matches_with_players_not_in_the_ladder_or_dates_outside_of_it(self):
+        ladder = fixtures.ladder(start_date=date.today() - timedelta(days=5), end_date=date.today())
+        with patch.object(self.manager.dao, "lock_ladder", return_value=ladder):
+            with patch.object(self.manager.dao, "get_players", return_value=players_with_ids("TEST1", "TEST2")):
+                played = datetime.now() - timedelta(days=1)
+                self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST3", 6, 0, 6, 0, match_date=played.isoformat())]), 400, "No user with id: 'TEST3'")
+                played = datetime.now() - timedelta(days=6)
+                self.assert_error(lambda: self.manager.import_matches(1, [create_match_dict("TEST1", "TEST2", 6, 0, 6, 0, match_date=played.isoformat())]), 400,
+                                  f"Match on {played.date()} was played outside of the ladder's dates")
+
+    def test_import_matches_scores_matches_in_the_order_they_were_played(self):
+        ladder = fixtures.ladder(ladder_id=1, start_date=date.today() - timedelta(days=30), end_date=date.today(), distance_penalty_on=True)
+        players = [
+            fixtures.player(user_=fixtures.user(user_id="TEST1"), score=20),
+            fixtures.player(user_=fixtures.user(user_id="TEST2"), score=10),
+            fixtures.player(user_=fixtures.user(user_id="TEST3"), score=0),
+        ]
+        first_day, second_day = datetime.now() - timedelta(days=10), datetime.now() - timedelta(days=9)
+        with patch.object(self.manager.dao, "lock_ladder", return_value=ladder):
+            with patch.object(self.manager.dao, "get_players", return_value=players) as get_players_mock:
+                with patch.object(self.manager.dao, "create_matches") as create_matches_mock:
+                    with patch.object(self.manager.dao, "update_all_earned_points") as update_all_earned_points_mock:
+                        with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                            returned_players = self.manager.import_matches(1, [
+                                create_match_dict("TEST3", "TEST1", 6, 0, 6, 0, match_date=second_day.isoformat()),
+                                create_match_dict("TEST3", "TEST2", 6, 0, 6, 0, match_date=first_day.isoformat()),
+                            ])
+        self.assertEqual(players, returned_players)
+        self.assertEqual(2, get_players_mock.call_count)
+        self.transaction_mock.assert_called_once_with()
+
+        # Saved in the order they were played
+        create_matches_mock.assert_called_once()
+        saved_matches = create_matches_mock.call_args.args[0]
+        self.assertEqual(["TEST2", "TEST1"], [match.loser_id for match in saved_matches])
+        self.assertEqual([1, 1], [match.ladder_id for match in saved_matches])
+        self.assertEqual(0, saved_matches[0].match_date.microsecond)
+        # The first match was 3rd place beating 2nd (a premium of 3 points). That put TEST3 in 1st, so the second was 1st place beating 2nd (a penalty of 2)
+        self.assertEqual([42, 37], [match.winner_points for match in saved_matches])
+        self.assertEqual([0, 0], [match.loser_points for match in saved_matches])
+
+        # All of the points are applied at once, and the standings are refreshed once
+        update_all_earned_points_mock.assert_called_once_with(1, [["TEST3", 79], ["TEST2", 0], ["TEST1", 0]], bump_version=True)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_not_called()
 
+    # endregion
+
+    # region reconcile
+    def test_reconcile_ladder_when_not_allowed(self):
+        self.manager.session = None
+        self.assert_error(lambda: self.manager.reconcile_ladder(1, False), 401, "Unable to authenticate")
+        self.manager.session = fixtures.session(fixtures.user(admin=False), admin_ladder_ids=[2])
+        self.assert_error(lambda: self.manager.reconcile_ladder(None, False), 400, "No ladder_id passed in")
+        self.assert_error(lambda: self.manager.reconcile_ladder(1, False), 403, "Only admins can reconcile ladders")
+
+    def test_reconcile_ladder_with_a_non_existent_ladder(self):
+        with patch.object(self.manager.dao, "lock_ladder", return_value=None):
+            self.assert_error(lambda: self.manager.reconcile_ladder(1, False), 404, "No ladder with ID: 1")
+
+    def test_reconcile_ladder_rebuilds_drifted_points(self):
+        drift = [PointsDrift("TEST1", 40, 35, 2, 2, 0, 0)]
+        with patch.object(self.manager.dao, "lock_ladder", return_value=fixtures.ladder(ladder_id=1)) as lock_ladder_mock:
+            with patch.object(self.manager.dao, "get_points_drift", return_value=drift):
+                with patch.object(self.manager.dao, "recompute_earned_points") as recompute_earned_points_mock:
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        self.assertEqual(drift, self.manager.reconcile_ladder(1, False))
+        self.transaction_mock.assert_called_once_with()
+        lock_ladder_mock.assert_called_once_with(1)
+        recompute_earned_points_mock.assert_called_once_with(1)
+        refresh_standings_mock.assert_called_once_with(1)
+        self.bump_ladder_version_mock.assert_called_once_with(1)
+
+    def test_reconcile_ladder_without_drift_or_as_a_dry_run_makes_no_changes(self):
+        for drift, dry_run in [([], False), ([PointsDrift("TEST1", 40, 35, 2, 2, 0, 0)], True)]:
+            with self.subTest(dry_run=dry_run):
+                with patch.object(self.manager.dao, "lock_ladder", return_value=fixtures.ladder(ladder_id=1)):
+                    with patch.object(self.manager.dao, "get_points_drift", return_value=drift):
+                        with patch.object(self.manager.dao, "recompute_earned_points") as recompute_earned_points_mock:
+                            with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                                self.assertEqual(drift, self.manager.reconcile_ladder(1, dry_run))
+                recompute_earned_points_mock.assert_not_called()
+                refresh_standings_mock.assert_not_called()
+                self.bump_ladder_version_mock.assert_not_called()
+
+    def test_reconcile_all_ladders(self):
+        with patch.object(self.manager.dao, "get_ladders", return_value=[fixtures.ladder(ladder_id=1), fixtures.ladder(ladder_id=2)]):
+            with patch.object(self.manager.dao, "lock_ladder", side_effect=lambda ladder_id: fixtures.ladder(ladder_id=ladder_id)):
+                with patch.object(self.manager.dao, "get_points_drift", side_effect=[[], [PointsDrift("TEST1", 40, 35, 2, 2, 0, 0)]]) as get_points_drift_mock:
+                    with patch.object(self.manager.dao, "recompute_earned_points") as recompute_earned_points_mock:
+                        with patch.object(self.manager.dao, "refresh_standings"):
+                            self.manager.reconcile_all_ladders(False)
+        self.assertEqual([1, 2], [c.args[0] for c in get_points_drift_mock.mock_calls])
+        recompute_earned_points_mock.assert_called_once_with(2)
+        self.bump_ladder_version_mock.assert_called_once_with(2)
+
+    # endregion
+    # region decrement_borrowed_points
     def test_decrement_borrowed_points_with_all_invalid_ladders_should_make_no_updates(self):
         with patch.object(self.manager.dao, "get_ladders", return_value=[
             # Hasn't started yet
@@ -690,13 +948,34 @@ class Test(unittest.TestCase):
         ]):
             with patch.object(self.manager.dao, "decrement_borrowed_points") as decrement_borrowed_points_mock:
                 with patch.object(self.manager.dao, "update_ladder") as update_ladder_mock:
-                    self.manager.decrement_borrowed_points()
+                    with patch.object(self.manager.dao, "refresh_standings") as refresh_standings_mock:
+                        self.manager.decrement_borrowed_points()
         self.assertEqual(2, decrement_borrowed_points_mock.call_count)
+        self.assertEqual(2, refresh_standings_mock.call_count)
+        self.assertEqual((1,), refresh_standings_mock.mock_calls[0].args)
+        self.assertEqual((2,), refresh_standings_mock.mock_calls[1].args)
         self.assertEqual((1, 5, 4), decrement_borrowed_points_mock.mock_calls[0].args)
         self.assertEqual((2, 5, 3), decrement_borrowed_points_mock.mock_calls[1].args)
         self.assertEqual(2, update_ladder_mock.call_count)
         self.assertEqual(4, update_ladder_mock.mock_calls[0].args[0].weeks_for_borrowed_points_left)
         self.assertEqual(3, update_ladder_mock.mock_calls[1].args[0].weeks_for_borrowed_points_left)
+        self.assertEqual([((1,),), ((2,),)], self.bump_ladder_version_mock.call_args_list)
+
+    # endregion
+    # region rank_by_score
+    def test_rank_by_score(self):
+        self.assertEqual({}, rank_by_score({}))
+        self.assertEqual({"A": 2, "B": 1, "C": 2, "D": 3}, rank_by_score({"A": 10, "B": 20, "C": 10, "D": 0}))
+
+    # endregion
+    # region parse_date
+    def test_parse_date(self):
+        self.assertEqual(datetime(2020, 1, 2, 3, 4, 5, tzinfo=tz.utc), parse_date("2020-01-02T03:04:05Z"))
+        self.assertEqual(datetime(2020, 1, 2, 3, 4, 5, 123000, tzinfo=tz(timedelta(hours=-7))), parse_date("2020-01-02T03:04:05.123-07:00"))
+        self.assertEqual(datetime(2020, 1, 2, 3, 4, 5), parse_date("2020-01-02T03:04:05"))
+        # Formats that only dateutil understands
+        self.assertEqual(datetime(2020, 1, 3), parse_date("2020-01-02T24:00:00"))
+        self.assertRaises(ValueError, lambda: parse_date("not a date"))
 
     # endregion
     # region utils
@@ -735,6 +1014,10 @@ def closed_ladder():
     return fixtures.ladder(start_date=date.today() - timedelta(days=2), end_date=date.today() - timedelta(days=1))
 
 
+def players_with_ids(*user_ids):
+    return [fixtures.player(user_=fixtures.user(user_id=user_id)) for user_id in user_ids]
+
+
 def open_ladder(distance_penalty_on=False):
     return fixtures.ladder(start_date=date.today() - timedelta(days=1), end_date=date.today() + timedelta(days=1), distance_penalty_on=distance_penalty_on)
 
@@ -0,0 +1,80 @@
+import unittest
+
+from cache import LruCache, MISSING
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LruCache(2, self.clock)
+
+    def test_get_missing_key(self):
+        self.assertIs(MISSING, self.cache.get("key"))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_get_cached_none(self):
+        self.cache.put("key", None, 10)
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_entries_expire_after_their_ttl(self):
+        self.cache.put("short", 1, 5)
+        self.cache.put("long", 2, 50)
+
+        self.clock.now = 4
+        self.assertEqual(1, self.cache.get("short"))
+
+        self.clock.now = 5
+        self.assertIs(MISSING, self.cache.get("short"))
+        self.assertEqual(2, self.cache.get("long"))
+        self.assertEqual(1, self.cache.expirations)
+        self.assertEqual(1, len(self.cache))
+
+    def test_least_recently_used_entry_is_evicted_when_full(self):
+        self.cache.put("a", 1, 10)
+        self.cache.put("b", 2, 10)
+        # Reading "a" makes "b" the least recently used
+        self.cache.get("a")
+        self.cache.put("c", 3, 10)
+
+        self.assertEqual(1, self.cache.get("a"))
+        self.assertIs(MISSING, self.cache.get("b"))
+        self.assertEqual(3, self.cache.get("c"))
+        self.assertEqual(1, self.cache.evictions)
+
+    def test_overwriting_a_key_does_not_evict(self):
+        self.cache.put("a", 1, 10)
+        self.cache.put("b", 2, 10)
+        self.cache.put("a", 3, 10)
+        self.assertEqual(3, self.cache.get("a"))
+        self.assertEqual(2, self.cache.get("b"))
+        self.assertEqual(0, self.cache.evictions)
+
+    def test_invalidate(self):
+        self.cache.put("a", 1, 10)
+        self.cache.invalidate("a")
+        self.cache.invalidate("not there")
+        self.assertIs(MISSING, self.cache.get("a"))
+        self.assertEqual(1, self.cache.invalidations)
+
+    def test_invalidate_where(self):
+        self.cache.put(("x", 1), "one", 10)
+        self.cache.put(("x", 2), "two", 10)
+        self.cache.invalidate_where(lambda key, value: key[1] == 1 or value == "nope")
+        self.assertIs(MISSING, self.cache.get(("x", 1)))
+        self.assertEqual("two", self.cache.get(("x", 2)))
+        self.assertEqual(1, self.cache.invalidations)
+
+    def test_stats(self):
+        self.cache.put("a", 1, 10)
+        self.cache.get("a")
+        self.cache.get("b")
+        self.assertEqual({"size": 1, "max_size": 2, "hits": 1, "misses": 1, "evictions": 0, "expirations": 0, "invalidations": 0}, self.cache.stats())
@@ -0,0 +1,239 @@
+import unittest
+from contextlib import nullcontext
+from unittest.mock import patch
+
+import fixtures
+from cache_unit_test import FakeClock
+from caching_dao import CachingDao, MemoDao
+from da import Dao
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dao = CachingDao(Dao(), max_entries=10, clock=self.clock)
+
+    def test_reads_are_cached_until_their_ttl_expires(self):
+        with patch.object(self.dao.dao, "get_players", return_value=[fixtures.player()]) as get_players_mock:
+            self.dao.get_players(1)
+            self.dao.get_players(1)
+            self.clock.now = CachingDao.DEFAULT_TTLS["get_players"]
+            self.dao.get_players(1)
+        self.assertEqual(2, get_players_mock.call_count)
+        self.assertEqual({"hits": 1, "misses": 2}, self.dao.stats()["methods"]["get_players"])
+
+    def test_reads_are_cached_by_arguments(self):
+        with patch.object(self.dao.dao, "get_matches", return_value=[]) as get_matches_mock:
+            self.dao.get_matches(1)
+            self.dao.get_matches(1, "TEST1")
+            self.dao.get_matches(2)
+            self.dao.get_matches(1, "TEST1")
+        self.assertEqual(3, get_matches_mock.call_count)
+
+    def test_missing_ladder_is_cached(self):
+        with patch.object(self.dao.dao, "get_ladder", return_value=None) as get_ladder_mock:
+            self.assertIsNone(self.dao.get_ladder(1))
+            self.assertIsNone(self.dao.get_ladder(1))
+        get_ladder_mock.assert_called_once_with(1)
+
+    def test_ttls_can_be_overridden(self):
+        self.dao = CachingDao(Dao(), ttls={"get_ladders": 0}, clock=self.clock)
+        with patch.object(self.dao.dao, "get_ladders", return_value=[]) as get_ladders_mock:
+            self.dao.get_ladders()
+            self.dao.get_ladders()
+        self.assertEqual(2, get_ladders_mock.call_count)
+
+    def test_cached_instances_are_never_handed_out(self):
+        with patch.object(self.dao.dao, "get_ladders", return_value=[fixtures.ladder(ladder_id=1)]):
+            ladder = self.dao.get_ladders()[0]
+            ladder.logged_in_user_is_admin = "changed"
+            self.assertFalse(self.dao.get_ladders()[0].logged_in_user_is_admin)
+
+        with patch.object(self.dao.dao, "get_matches", return_value=[fixtures.match(match_id=1)]):
+            self.dao.get_matches(1)[0].winner = fixtures.player()
+            self.assertIsNone(self.dao.get_matches(1)[0].winner)
+
+    def test_least_recently_used_reads_are_evicted(self):
+        self.dao = CachingDao(Dao(), max_entries=2, clock=self.clock)
+        with patch.object(self.dao.dao, "get_ladder", side_effect=lambda ladder_id: fixtures.ladder(ladder_id=ladder_id)) as get_ladder_mock:
+            self.dao.get_ladder(1)
+            self.dao.get_ladder(2)
+            self.dao.get_ladder(3)
+            self.dao.get_ladder(1)
+        self.assertEqual(4, get_ladder_mock.call_count)
+        self.assertEqual(2, self.dao.stats()["evictions"])
+
+    def test_writes_invalidate_only_the_ladder_they_touch(self):
+        writes = [
+            ("create_player", lambda: self.dao.create_player(1, "TEST1")),
+            ("update_player_order", lambda: self.dao.update_player_order(1, [])),
+            ("update_all_borrowed_points", lambda: self.dao.update_all_borrowed_points(1, [])),
+            ("decrement_borrowed_points", lambda: self.dao.decrement_borrowed_points(1, 5, 4)),
+            ("update_borrowed_points", lambda: self.dao.update_borrowed_points(1, "TEST1", 5)),
+            ("update_earned_points", lambda: self.dao.update_earned_points(1, "TEST1", 5)),
+            ("update_all_earned_points", lambda: self.dao.update_all_earned_points(1, [["TEST1", 5]])),
+            ("refresh_standings", lambda: self.dao.refresh_standings(1)),
+            ("recompute_earned_points", lambda: self.dao.recompute_earned_points(1)),
+            ("create_match", lambda: self.dao.create_match(fixtures.match(ladder_id=1))),
+            ("create_matches", lambda: self.dao.create_matches([fixtures.match(ladder_id=1)])),
+            ("update_match", lambda: self.dao.update_match(fixtures.match(ladder_id=1))),
+            ("update_ladder", lambda: self.dao.update_ladder(fixtures.ladder(ladder_id=1))),
+            ("bump_ladder_version", lambda: self.dao.bump_ladder_version(1)),
+        ]
+        for method, write in writes:
+            with self.subTest(method):
+                self.dao.cache.clear()
+                with patch.object(self.dao.dao, "get_players", return_value=[]) as get_players_mock:
+                    with patch.object(self.dao.dao, "get_matches", return_value=[]) as get_matches_mock:
+                        with patch.object(self.dao.dao, "get_ladder_admins", return_value=[]) as get_ladder_admins_mock:
+                            with patch.object(self.dao.dao, method):
+                                for ladder_id in [1, 2]:
+                                    self.dao.get_players(ladder_id)
+                                    self.dao.get_matches(ladder_id, "TEST1")
+                                    self.dao.get_ladder_admins(ladder_id)
+                                write()
+                                for ladder_id in [1, 2]:
+                                    self.dao.get_players(ladder_id)
+                                    self.dao.get_matches(ladder_id, "TEST1")
+                                    self.dao.get_ladder_admins(ladder_id)
+                # Ladder 1 was loaded again, ladder 2 was still cached
+                self.assertEqual([1, 2, 1], [c.args[0] for c in get_players_mock.mock_calls])
+                self.assertEqual([1, 2, 1], [c.args[0] for c in get_matches_mock.mock_calls])
+                self.assertEqual([1, 2, 1], [c.args[0] for c in get_ladder_admins_mock.mock_calls])
+
+    def test_reads_inside_a_transaction_are_not_cached(self):
+        with patch.object(self.dao.dao, "transaction", return_value=nullcontext()):
+            with patch.object(self.dao.dao, "get_players", return_value=[]) as get_players_mock:
+                self.dao.get_players(1)
+                with self.dao.transaction():
+                    self.dao.get_players(1)
+                    self.dao.get_players(1)
+                self.dao.get_players(1)
+        self.assertEqual(3, get_players_mock.call_count)
+
+    def test_ladder_is_invalidated_when_its_version_changes(self):
+        with patch.object(self.dao.dao, "get_players", return_value=[]) as get_players_mock:
+            with patch.object(self.dao.dao, "get_ladder_version", side_effect=[1, 1, 2, 2]) as get_ladder_version_mock:
+                for _ in range(4):
+                    self.dao.get_ladder_version(1)
+                    self.dao.get_players(1)
+        # Loaded when the version was first seen, and again once another container had bumped it
+        self.assertEqual(2, get_players_mock.call_count)
+        self.assertEqual(4, get_ladder_version_mock.call_count)
+
+    def test_reads_after_a_write_are_not_trusted_until_the_version_is_looked_up_again(self):
+        with patch.object(self.dao.dao, "get_players", return_value=[]) as get_players_mock:
+            with patch.object(self.dao.dao, "get_ladder_version", return_value=1):
+                with patch.object(self.dao.dao, "refresh_standings"):
+                    self.dao.get_ladder_version(1)
+                    self.dao.refresh_standings(1)
+                    # Could have been read before or after the version was bumped by whoever made the write
+                    self.dao.get_players(1)
+                    self.dao.get_ladder_version(1)
+                    self.dao.get_players(1)
+        self.assertEqual(2, get_players_mock.call_count)
+
+    def test_update_ladder_invalidates_all_ladders(self):
+        with patch.object(self.dao.dao, "get_ladders", return_value=[]) as get_ladders_mock:
+            with patch.object(self.dao.dao, "update_ladder"):
+                self.dao.get_ladders()
+                self.dao.update_ladder(fixtures.ladder(ladder_id=1))
+                self.dao.get_ladders()
+        self.assertEqual(2, get_ladders_mock.call_count)
+
+    def test_create_ladder_invalidates_all_ladders(self):
+        with patch.object(self.dao.dao, "get_ladders", return_value=[]) as get_ladders_mock:
+            with patch.object(self.dao.dao, "create_ladder", return_value=fixtures.ladder(ladder_id=1)):
+                self.dao.get_ladders()
+                self.assertEqual(1, self.dao.create_ladder(fixtures.ladder(), "").ladder_id)
+                self.dao.get_ladders()
+        self.assertEqual(2, get_ladders_mock.call_count)
+
+    def test_delete_match_invalidates_the_ladders_that_contain_it(self):
+        with patch.object(self.dao.dao, "get_matches", side_effect=lambda ladder_id, _: [fixtures.match(match_id=ladder_id * 10, ladder_id=ladder_id)]) as get_matches_mock:
+            with patch.object(self.dao.dao, "delete_match"):
+                self.dao.get_matches(1)
+                self.dao.get_matches(2)
+                self.dao.delete_match(20)
+                self.dao.get_matches(1)
+                self.dao.get_matches(2)
+        self.assertEqual([1, 2, 2], [c.args[0] for c in get_matches_mock.mock_calls])
+
+    def test_update_match_invalidates_the_ladder_it_moved_from(self):
+        with patch.object(self.dao.dao, "get_matches", side_effect=lambda ladder_id, _: [fixtures.match(match_id=ladder_id * 10, ladder_id=ladder_id)]) as get_matches_mock:
+            with patch.object(self.dao.dao, "update_match"):
+                self.dao.get_matches(1)
+                self.dao.get_matches(2)
+                self.dao.update_match(fixtures.match(match_id=20, ladder_id=1))
+                self.dao.get_matches(1)
+                self.dao.get_matches(2)
+        self.assertEqual([1, 2, 1, 2], [c.args[0] for c in get_matches_mock.mock_calls])
+
+    def test_update_user_invalidates_the_ladders_they_play_in(self):
+        with patch.object(self.dao.dao, "get_players", side_effect=lambda ladder_id: [fixtures.player(user_=fixtures.user(user_id=f"TEST{ladder_id}"))]) as get_players_mock:
+            with patch.object(self.dao.dao, "update_user"):
+                self.dao.get_players(1)
+                self.dao.get_players(2)
+                self.dao.update_user(fixtures.user(user_id="TEST2"))
+                self.dao.get_players(1)
+                self.dao.get_players(2)
+        self.assertEqual([1, 2, 2], [c.args[0] for c in get_players_mock.mock_calls])
+
+    def test_sessions_are_invalidated_when_the_user_joins_a_ladder_or_changes(self):
+        writes = [
+            ("create_user", lambda: self.dao.create_user(fixtures.user(user_id="TEST1"))),
+            ("update_user", lambda: self.dao.update_user(fixtures.user(user_id="TEST1"))),
+            ("create_player", lambda: self.dao.create_player(1, "TEST1")),
+        ]
+        for method, write in writes:
+            with self.subTest(method):
+                self.dao.cache.clear()
+                with patch.object(self.dao.dao, "get_session", side_effect=lambda user_id: fixtures.session(fixtures.user(user_id=user_id))) as get_session_mock:
+                    with patch.object(self.dao.dao, method):
+                        self.dao.get_session("TEST1")
+                        self.dao.get_session("TEST2")
+                        write()
+                        self.dao.get_session("TEST1")
+                        self.dao.get_session("TEST2")
+                self.assertEqual(["TEST1", "TEST2", "TEST1"], [c.args[0] for c in get_session_mock.mock_calls])
+
+    def test_cached_sessions_are_copied_all_the_way_down(self):
+        with patch.object(self.dao.dao, "get_session", return_value=fixtures.session(fixtures.user(name="name"), ladder_ids=[1])):
+            session = self.dao.get_session("TEST1")
+            session.user.name = "changed"
+            session.ladder_ids.append(2)
+            self.assertEqual("name", self.dao.get_session("TEST1").user.name)
+            self.assertEqual([1], self.dao.get_session("TEST1").ladder_ids)
+
+    def test_memo_dao_only_reads_each_thing_once(self):
+        memo_dao = MemoDao(Dao())
+        with patch.object(memo_dao.dao, "get_players", return_value=[fixtures.player()]) as get_players_mock:
+            with patch.object(memo_dao.dao, "get_players_by_ids", return_value=[]) as get_players_by_ids_mock:
+                first = memo_dao.get_players(1)
+                second = memo_dao.get_players(1)
+                memo_dao.get_players(2)
+                memo_dao.get_players_by_ids(1, ["TEST1"])
+                memo_dao.get_players_by_ids(1, ["TEST1"])
+        self.assertEqual([1, 2], [c.args[0] for c in get_players_mock.mock_calls])
+        get_players_by_ids_mock.assert_called_once_with(1, ["TEST1"])
+        # Each caller gets its own copy
+        self.assertIsNot(first[0], second[0])
+
+    def test_memo_dao_writes_clear_the_memo(self):
+        memo_dao = MemoDao(Dao())
+        with patch.object(memo_dao.dao, "get_ladder", return_value=fixtures.ladder()) as get_ladder_mock:
+            with patch.object(memo_dao.dao, "update_ladder") as update_ladder_mock:
+                memo_dao.get_ladder(1)
+                memo_dao.update_ladder(fixtures.ladder(ladder_id=2))
+                memo_dao.get_ladder(1)
+        self.assertEqual(2, get_ladder_mock.call_count)
+        update_ladder_mock.assert_called_once()
+
+    def test_memo_dao_reads_inside_a_transaction_are_not_memoized(self):
+        memo_dao = MemoDao(Dao())
+        with patch.object(memo_dao.dao, "transaction", return_value=nullcontext()):
+            with patch.object(memo_dao.dao, "get_players", return_value=[]) as get_players_mock:
+                with memo_dao.transaction():
+                    memo_dao.get_players(1)
+                    memo_dao.get_players(1)
+        self.assertEqual(2, get_players_mock.call_count)
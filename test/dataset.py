@@ -0,0 +1,178 @@
+# Generates realistic ladders (at any size) for measuring the service against, and loads them into a database through a Dao. Everything comes from a seeded
+# random number generator, so the same arguments always generate the same data. The matches follow all of the rules that reporting one would check (valid
+# scores, one match per player per day, and a limited number between any two players), and are scored with the standings as they were when each was played.
+#   cd test && python dataset.py [--players 2000] [--ladders 1] [--weeks 12] [--weeks-played 8] [--seed 0] [--dry-run]
+import argparse
+import contextlib
+import io
+import math
+import os
+import random
+import sys
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+sys.path.append(os.path.abspath(__file__ + "/../../src/"))
+
+from bl import ManagerImpl, rank_by_score
+from domain import Ladder, Match, User
+
+# Set scores that the winner of a set can have won it by
+SET_SCORES = [(6, 0), (6, 1), (6, 2), (6, 3), (6, 4), (7, 5), (7, 6)]
+
+
+class GeneratedPlayer:
+    def __init__(self, ladder_id, user_id, order: int, borrowed_points: int, earned_points=0):
+        self.ladder_id, self.user_id, self.order, self.borrowed_points, self.earned_points = ladder_id, user_id, order, borrowed_points, earned_points
+
+
+class Dataset:
+    """
+    Users, the ladders they play in, and the matches played in them. Ladder IDs are numbered from 1 here, and replaced with the IDs the database assigns when
+    the dataset is loaded.
+    """
+
+    def __init__(self, users: [User], ladders: [Ladder], players: [GeneratedPlayer], matches: [Match]):
+        self.users, self.ladders, self.players, self.matches = users, ladders, players, matches
+
+    def __str__(self):
+        return f"{len(self.users)} users, {len(self.ladders)} ladders, {len(self.players)} players and {len(self.matches)} matches"
+
+
+def generate(players=200, ladders=1, weeks=12, weeks_played=8, match_rate=0.15, weeks_for_borrowed_points=10, distance_penalty_on=False,
+             seed=0, today=None, user_id_prefix="GEN") -> Dataset:
+    """
+    Generates ladders that are weeks_played weeks into a weeks long season (through yesterday), each with the same players. Each day, every player plays a match
+    with a match_rate chance. Players have a hidden skill, which decides who wins. Every player starts with borrowed points (their place in a random starting
+    order times the ladder's weeks_for_borrowed_points, like update_player_order gives them) that run down by their order each week, the same way that
+    decrement_borrowed_points takes them away.
+    """
+    if not 0 <= weeks_played <= weeks:
+        raise ValueError(f"weeks_played ({weeks_played}) has to be between 0 and weeks ({weeks})")
+    rng = random.Random(seed)
+    today = today or date.today()
+    start_date = today - timedelta(weeks=weeks_played)
+    end_date = start_date + timedelta(weeks=weeks, days=-1)
+    # How far the borrowed points have run down, as of each week of the season
+    weeks_left = [max(weeks_for_borrowed_points - week, 0) for week in range(weeks + 1)]
+
+    users = [User(f"{user_id_prefix}{i + 1:05d}", f"Generated Player {i + 1}", f"{user_id_prefix.lower()}{i + 1}@example.com", None, None, None, False)
+             for i in range(players)]
+    dataset = Dataset(users, [], [], [])
+    for ladder_id in range(1, ladders + 1):
+        ladder = Ladder(ladder_id, f"Generated Ladder {ladder_id}", start_date, end_date, distance_penalty_on, weeks_for_borrowed_points,
+                        weeks_left[weeks_played])
+        dataset.ladders.append(ladder)
+
+        orders = rng.sample(range(1, players + 1), players)
+        ladder_players = {user.user_id: GeneratedPlayer(ladder_id, user.user_id, order, order * ladder.weeks_for_borrowed_points_left)
+                          for user, order in zip(users, orders)}
+        dataset.players.extend(ladder_players.values())
+        skills = {user_id: rng.gauss(0, 1) for user_id in ladder_players}
+        matches_between = Counter()
+
+        for day in range(weeks_played * 7):
+            match_date = start_date + timedelta(days=day)
+            scores = {user_id: player.earned_points + player.order * weeks_left[day // 7] for user_id, player in ladder_players.items()}
+
+            # Pairing up that day's players means nobody plays more than once a day
+            playing = [user_id for user_id in ladder_players if rng.random() < match_rate]
+            rng.shuffle(playing)
+            for player1_id, player2_id in zip(playing[::2], playing[1::2]):
+                pair = frozenset([player1_id, player2_id])
+                if matches_between[pair] >= ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS:
+                    continue
+                matches_between[pair] += 1
+
+                player1_wins = rng.random() < 1 / (1 + math.exp(skills[player2_id] - skills[player1_id]))
+                winner_id, loser_id = (player1_id, player2_id) if player1_wins else (player2_id, player1_id)
+                match = Match(None, ladder_id, datetime.combine(match_date, time(rng.randint(7, 20), rng.choice([0, 15, 30, 45]))), winner_id, loser_id,
+                              *random_set_scores(rng)).validate()
+
+                # The rankings only matter to the points when there's a distance penalty (and they're the slow part)
+                rankings = rank_by_score(scores) if distance_penalty_on else {}
+                match.winner_points, match.loser_points = match.calculate_scores(rankings.get(winner_id), rankings.get(loser_id), distance_penalty_on)
+                for user_id, points in [(winner_id, match.winner_points), (loser_id, match.loser_points)]:
+                    ladder_players[user_id].earned_points += points
+                    scores[user_id] += points
+                dataset.matches.append(match)
+    return dataset
+
+
+def random_set_scores(rng: random.Random) -> [int]:
+    """The winner's and loser's scores for each set, from the winner's side. About a third of matches go to a third set, half of which are tiebreaks"""
+    first_set, second_set = rng.choice(SET_SCORES), rng.choice(SET_SCORES)
+    if rng.random() < 0.67:
+        return [*first_set, *second_set]
+
+    # The loser won one of the first two sets
+    if rng.random() < 0.5:
+        first_set = tuple(reversed(first_set))
+    else:
+        second_set = tuple(reversed(second_set))
+    if rng.random() < 0.5:
+        third_set = rng.choice([(10, rng.randint(0, 8)), (12, 10)])
+    else:
+        third_set = rng.choice(SET_SCORES)
+    return [*first_set, *second_set, *third_set]
+
+
+def load(dataset: Dataset, dao) -> [Ladder]:
+    """Saves a dataset through any Dao, and returns its ladders (with the IDs that they were given)"""
+    for user in dataset.users:
+        dao.create_user(user)
+
+    created_ladders = []
+    for ladder in dataset.ladders:
+        with dao.transaction():
+            created_ladder = dao.create_ladder(ladder, "")
+            players = [player for player in dataset.players if player.ladder_id == ladder.ladder_id]
+            for player in players:
+                dao.create_player(created_ladder.ladder_id, player.user_id)
+            dao.update_player_order(created_ladder.ladder_id, [[player.user_id, player.order] for player in players])
+            dao.update_all_borrowed_points(created_ladder.ladder_id, [[player.user_id, player.borrowed_points] for player in players])
+
+            matches = [match for match in dataset.matches if match.ladder_id == ladder.ladder_id]
+            dao.create_matches([Match(None, created_ladder.ladder_id, *match.get_insert_properties()[1:]) for match in matches])
+            dao.update_all_earned_points(created_ladder.ladder_id, [[player.user_id, player.earned_points] for player in players])
+            dao.refresh_standings(created_ladder.ladder_id)
+        created_ladders.append(created_ladder)
+    return created_ladders
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Generates ladders full of players and matches, and loads them into the database")
+    arg_parser.add_argument("--players", type=int, default=200, help="players in each ladder")
+    arg_parser.add_argument("--ladders", type=int, default=1)
+    arg_parser.add_argument("--weeks", type=int, default=12, help="length of the season")
+    arg_parser.add_argument("--weeks-played", type=int, default=8, help="weeks of the season that have been played (through yesterday)")
+    arg_parser.add_argument("--match-rate", type=float, default=0.15, help="chance of each player playing on any given day")
+    arg_parser.add_argument("--distance-penalty", action="store_true", help="turn on the distance penalty/premium")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--user-id-prefix", default="GEN", help="prefix of the generated users' IDs, which can't already be taken")
+    arg_parser.add_argument("--dry-run", action="store_true", help="only generate the data, and print how much there is")
+    args = arg_parser.parse_args()
+
+    dataset = generate(args.players, args.ladders, args.weeks, args.weeks_played, args.match_rate, distance_penalty_on=args.distance_penalty, seed=args.seed,
+                       user_id_prefix=args.user_id_prefix)
+    print(f"Generated {dataset}")
+    if args.dry_run:
+        return
+
+    if "DB_HOST" not in os.environ:
+        import properties
+        os.environ["DB_HOST"] = properties.db_host
+        os.environ["DB_USERNAME"] = properties.db_username
+        os.environ["DB_PASSWORD"] = properties.db_password
+        os.environ["DB_DATABASE_NAME"] = properties.db_database_name
+
+    from da import DaoImpl
+    # Loading a big dataset runs a lot of slow statements, which are each logged (see sql_metrics)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ladders = load(dataset, DaoImpl())
+    for ladder in ladders:
+        print(f"Loaded ladder {ladder.ladder_id} ('{ladder.name}')")
+
+
+if __name__ == "__main__":
+    main()
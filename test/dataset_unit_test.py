@@ -0,0 +1,96 @@
+import random
+import unittest
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date
+from unittest.mock import patch
+
+import dataset
+from bl import ManagerImpl
+from da import Dao
+from domain import Ladder
+
+TODAY = date(2020, 3, 1)
+
+
+class Test(unittest.TestCase):
+    def test_generate_is_deterministic(self):
+        def summary(d):
+            return [match.get_insert_properties() for match in d.matches], [(p.user_id, p.order, p.earned_points) for p in d.players]
+
+        self.assertEqual(summary(dataset.generate(50, today=TODAY, seed=1)), summary(dataset.generate(50, today=TODAY, seed=1)))
+        self.assertNotEqual(summary(dataset.generate(50, today=TODAY, seed=1)), summary(dataset.generate(50, today=TODAY, seed=2)))
+
+    def test_generate(self):
+        generated = dataset.generate(100, ladders=2, weeks=12, weeks_played=8, weeks_for_borrowed_points=10, distance_penalty_on=True, today=TODAY)
+        self.assertEqual(100, len(generated.users))
+        self.assertEqual([1, 2], [ladder.ladder_id for ladder in generated.ladders])
+        self.assertEqual(200, len(generated.players))
+        self.assertGreater(len(generated.matches), 0)
+
+        for ladder in generated.ladders:
+            self.assertEqual(date(2020, 1, 5), ladder.start_date)
+            self.assertEqual(date(2020, 3, 28), ladder.end_date)
+            self.assertEqual(2, ladder.weeks_for_borrowed_points_left)
+
+            matches = [match for match in generated.matches if match.ladder_id == ladder.ladder_id]
+            players = [player for player in generated.players if player.ladder_id == ladder.ladder_id]
+            # Everyone has a different place in the starting order, and has borrowed as much as update_player_order and decrement_borrowed_points leave them
+            self.assertEqual(list(range(1, 101)), sorted(player.order for player in players))
+            for player in players:
+                self.assertEqual(player.order * 2, player.borrowed_points)
+
+            per_day, between = Counter(), Counter()
+            earned_points = Counter()
+            for match in matches:
+                match.validate()
+                self.assertTrue(ladder.start_date <= match.match_date.date() < TODAY)
+                per_day[(match.winner_id, match.match_date.date())] += 1
+                per_day[(match.loser_id, match.match_date.date())] += 1
+                between[frozenset([match.winner_id, match.loser_id])] += 1
+                earned_points[match.winner_id] += match.winner_points
+                earned_points[match.loser_id] += match.loser_points
+            self.assertEqual(ManagerImpl.MAX_MATCHES_PER_DAY, max(per_day.values()))
+            self.assertLessEqual(max(between.values()), ManagerImpl.MAX_MATCHES_BETWEEN_PLAYERS)
+            for player in players:
+                self.assertEqual(earned_points[player.user_id], player.earned_points)
+
+    def test_generate_validates_weeks_played(self):
+        self.assertRaises(ValueError, lambda: dataset.generate(10, weeks=4, weeks_played=5))
+
+    def test_random_set_scores(self):
+        rng = random.Random(0)
+        lengths = Counter(len(dataset.random_set_scores(rng)) for _ in range(1000))
+        self.assertEqual({4, 6}, set(lengths))
+        self.assertGreater(lengths[4], lengths[6])
+
+    def test_load(self):
+        generated = dataset.generate(10, ladders=2, today=TODAY)
+        dao = Dao()
+        with patch.object(dao, "transaction", side_effect=lambda: nullcontext()) as transaction_mock, \
+                patch.object(dao, "create_user") as create_user_mock, \
+                patch.object(dao, "create_ladder", side_effect=lambda ladder, code: Ladder(ladder.ladder_id + 10, ladder.name, ladder.start_date, ladder.end_date,
+                                                                                          ladder.distance_penalty_on, ladder.weeks_for_borrowed_points,
+                                                                                          ladder.weeks_for_borrowed_points_left)), \
+                patch.object(dao, "create_player") as create_player_mock, \
+                patch.object(dao, "update_player_order") as update_player_order_mock, \
+                patch.object(dao, "update_all_borrowed_points") as update_all_borrowed_points_mock, \
+                patch.object(dao, "create_matches") as create_matches_mock, \
+                patch.object(dao, "update_all_earned_points") as update_all_earned_points_mock, \
+                patch.object(dao, "refresh_standings") as refresh_standings_mock:
+            ladders = dataset.load(generated, dao)
+        self.assertEqual([11, 12], [ladder.ladder_id for ladder in ladders])
+        self.assertEqual(2, transaction_mock.call_count)
+        self.assertEqual(10, create_user_mock.call_count)
+        self.assertEqual(20, create_player_mock.call_count)
+        self.assertEqual([11, 12], [call.args[0] for call in update_player_order_mock.call_args_list])
+        self.assertEqual([11, 12], [call.args[0] for call in update_all_borrowed_points_mock.call_args_list])
+        self.assertEqual([11, 12], [call.args[0] for call in update_all_earned_points_mock.call_args_list])
+        self.assertEqual([11, 12], [call.args[0] for call in refresh_standings_mock.call_args_list])
+
+        # The matches are saved in the ladder they were created in
+        loaded_matches = [match for call in create_matches_mock.call_args_list for match in call.args[0]]
+        self.assertEqual(len(generated.matches), len(loaded_matches))
+        self.assertEqual({11, 12}, {match.ladder_id for match in loaded_matches})
+        self.assertEqual([match.get_insert_properties()[1:] for match in generated.matches],
+                         [match.get_insert_properties()[1:] for match in loaded_matches])
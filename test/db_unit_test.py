@@ -0,0 +1,220 @@
+import threading
+import unittest
+
+from pymysql import err
+
+from cache_unit_test import FakeClock
+from db import ConnectionManager, ConnectionUnavailableError
+
+
+class FakeConnection:
+    def __init__(self, connection_id):
+        self.connection_id = connection_id
+        self.alive = True
+        self.pings = 0
+        self.closed = False
+        self.statements = []
+        self.commit_error = None
+
+    def ping(self, reconnect):
+        self.pings += 1
+        if not self.alive:
+            raise err.OperationalError(2006, "MySQL server has gone away")
+
+    def close(self):
+        self.closed = True
+
+    def begin(self):
+        self.statements.append("begin")
+
+    def commit(self):
+        if self.commit_error is not None:
+            raise self.commit_error
+        self.statements.append("commit")
+
+    def rollback(self):
+        self.statements.append("rollback")
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleeps = []
+        self.connections = []
+        self.connect_errors = []
+        self.manager = self.create_manager()
+
+    def create_manager(self, max_connections=2):
+        return ConnectionManager(self.connect, max_connections=max_connections, ping_after=30, max_attempts=3, pool_timeout=0, clock=self.clock, sleep=self.sleeps.append)
+
+    def connect(self):
+        if self.connect_errors:
+            raise self.connect_errors.pop(0)
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+    def test_connections_are_reused(self):
+        self.manager.run(lambda connection: None)
+        self.manager.run(lambda connection: None)
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual(0, self.connections[0].pings)
+
+    def test_idle_connections_are_pinged_before_being_used(self):
+        self.manager.run(lambda connection: None)
+        self.clock.now = 30
+        self.manager.run(lambda connection: None)
+        self.assertEqual(1, self.connections[0].pings)
+        self.assertEqual(1, len(self.connections))
+
+    def test_idle_connections_that_have_gone_away_are_replaced(self):
+        self.manager.run(lambda connection: None)
+        self.connections[0].alive = False
+        self.clock.now = 60
+        self.assertEqual(1, self.manager.run(lambda connection: connection.connection_id))
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(1, self.manager.reconnects)
+
+    def test_a_failed_reconnect_gives_back_the_connections_slot(self):
+        self.manager = self.create_manager(max_connections=1)
+        self.manager.run(lambda connection: None)
+        self.connections[0].alive = False
+        self.clock.now = 60
+        self.connect_errors = [err.OperationalError(2003, "Can't connect")] * 3
+        self.assertRaises(ConnectionUnavailableError, lambda: self.manager.run(lambda connection: None))
+        self.assertEqual(1, self.manager.run(lambda connection: connection.connection_id))
+
+    def test_connecting_is_retried_with_backoff(self):
+        self.connect_errors = [err.OperationalError(2003, "Can't connect"), err.OperationalError(1040, "Too many connections")]
+        self.assertEqual(0, self.manager.run(lambda connection: connection.connection_id))
+        self.assertEqual(2, len(self.sleeps))
+
+    def test_connecting_gives_up_after_max_attempts(self):
+        self.connect_errors = [err.OperationalError(2003, "Can't connect")] * 3
+        self.assertRaises(ConnectionUnavailableError, lambda: self.manager.run(lambda connection: None))
+        # The failed attempts didn't use up the pool
+        self.assertEqual(0, self.manager.run(lambda connection: connection.connection_id))
+
+    def test_connecting_isnt_retried_for_permanent_errors(self):
+        self.connect_errors = [err.OperationalError(1045, "Access denied")]
+        self.assertRaises(ConnectionUnavailableError, lambda: self.manager.run(lambda connection: None))
+        self.assertEqual([], self.sleeps)
+
+    def test_reads_are_retried_on_a_new_connection_after_a_transient_error(self):
+        def query(connection):
+            if connection.connection_id == 0:
+                raise err.OperationalError(2013, "Lost connection to MySQL server during query")
+            return "result"
+
+        self.assertEqual("result", self.manager.run(query, retry=True))
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(1, self.manager.retries)
+
+    def test_writes_are_not_retried(self):
+        calls = []
+
+        def query(connection):
+            calls.append(connection)
+            raise err.OperationalError(2013, "Lost connection to MySQL server during query")
+
+        self.assertRaises(err.OperationalError, lambda: self.manager.run(query))
+        self.assertEqual(1, len(calls))
+        # But the broken connection isn't handed out again
+        self.assertEqual(1, self.manager.run(lambda connection: connection.connection_id))
+
+    def test_statement_errors_are_not_retried(self):
+        calls = []
+
+        def query(connection):
+            calls.append(connection)
+            raise err.ProgrammingError(1064, "You have an error in your SQL syntax")
+
+        self.assertRaises(err.ProgrammingError, lambda: self.manager.run(query, retry=True))
+        self.assertEqual(1, len(calls))
+        self.assertFalse(self.connections[0].closed)
+
+    def test_nested_blocks_share_a_connection(self):
+        with self.manager.connection() as outer:
+            with self.manager.connection() as inner:
+                self.assertIs(outer, inner)
+                self.assertIs(outer, self.manager.run(lambda connection: connection))
+        self.assertEqual(1, len(self.connections))
+
+    def test_reads_are_not_retried_inside_a_transaction(self):
+        calls = []
+
+        def query(connection):
+            calls.append(connection)
+            raise err.OperationalError(2013, "Lost connection to MySQL server during query")
+
+        with self.manager.connection():
+            self.assertRaises(err.OperationalError, lambda: self.manager.run(query, retry=True))
+        self.assertEqual(1, len(calls))
+        self.assertTrue(self.connections[0].closed)
+
+    def test_transactions_are_committed(self):
+        with self.manager.transaction() as connection:
+            connection.statements.append("update")
+        self.assertEqual(["begin", "update", "commit"], self.connections[0].statements)
+
+    def test_transactions_are_rolled_back_when_the_block_raises(self):
+        with self.assertRaises(ValueError):
+            with self.manager.transaction():
+                raise ValueError()
+        self.assertEqual(["begin", "rollback"], self.connections[0].statements)
+        # The connection is still fine to use
+        self.assertEqual(0, self.manager.run(lambda connection: connection.connection_id))
+
+    def test_nested_transactions_join_the_outer_one(self):
+        with self.manager.transaction() as outer:
+            with self.manager.transaction() as inner:
+                self.assertIs(outer, inner)
+        self.assertEqual(["begin", "commit"], self.connections[0].statements)
+
+    def test_reads_are_not_retried_inside_a_transaction_block(self):
+        calls = []
+
+        def query(connection):
+            calls.append(connection)
+            raise err.OperationalError(2013, "Lost connection to MySQL server during query")
+
+        with self.assertRaises(err.OperationalError):
+            with self.manager.transaction():
+                self.manager.run(query, retry=True)
+        self.assertEqual(1, len(calls))
+        self.assertTrue(self.connections[0].closed)
+
+    def test_a_connection_lost_while_committing_is_not_reused(self):
+        self.manager.run(lambda connection: None)
+        self.connections[0].commit_error = err.OperationalError(2013, "Lost connection to MySQL server during query")
+        with self.assertRaises(err.OperationalError):
+            with self.manager.transaction():
+                pass
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(1, self.manager.run(lambda connection: connection.connection_id))
+
+    def test_pool_is_capped(self):
+        self.manager = self.create_manager(max_connections=1)
+        held, release = threading.Event(), threading.Event()
+
+        def hold_connection():
+            with self.manager.connection():
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_connection)
+        thread.start()
+        held.wait()
+        try:
+            self.assertRaises(ConnectionUnavailableError, lambda: self.manager.run(lambda connection: None))
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(0, self.manager.run(lambda connection: connection.connection_id))
+        self.assertEqual(1, len(self.connections))
+
+    def test_close(self):
+        self.manager.run(lambda connection: None)
+        self.manager.close()
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(1, self.manager.run(lambda connection: connection.connection_id))
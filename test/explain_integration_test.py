@@ -0,0 +1,128 @@
+import inspect
+import os
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+
+import properties
+from da import Dao, DaoImpl
+from domain import Ladder, Match, User
+
+# Every Dao method, called the way the service calls it. A method with more than one shape of query has an entry for each (named "method (variant)")
+QUERIES = {
+    "get_user": lambda dao: dao.get_user("TEST1"),
+    "get_session": lambda dao: dao.get_session("TEST1"),
+    "in_same_ladder": lambda dao: dao.in_same_ladder("TEST1", "TEST2"),
+    "create_user": lambda dao: dao.create_user(User("TEST1", "Tester One", "test1@mail.com", None, None, None, False)),
+    "update_user": lambda dao: dao.update_user(User("TEST1", "Tester One", "test1@mail.com", None, None, None, False)),
+    "get_ladders": lambda dao: dao.get_ladders(),
+    "get_ladder": lambda dao: dao.get_ladder(1),
+    "lock_ladder": lambda dao: dao.lock_ladder(1),
+    "get_ladder_admins": lambda dao: dao.get_ladder_admins(1),
+    "create_ladder": lambda dao: dao.create_ladder(Ladder(None, "Test", date(2020, 1, 1), date(2020, 2, 1), False, 4, 3), ""),
+    "update_ladder": lambda dao: dao.update_ladder(Ladder(1, "Test", date(2020, 1, 1), date(2020, 2, 1), False, 4, 3)),
+    "get_ladder_version": lambda dao: dao.get_ladder_version(1),
+    "bump_ladder_version": lambda dao: dao.bump_ladder_version(1),
+    "get_users_ladder_ids": lambda dao: dao.get_users_ladder_ids("TEST1"),
+    "get_users_admin_ladder_ids": lambda dao: dao.get_users_admin_ladder_ids("TEST1"),
+    "get_players": lambda dao: dao.get_players(1),
+    "get_player": lambda dao: dao.get_player(1, "TEST1"),
+    "get_players_by_ids": lambda dao: dao.get_players_by_ids(1, ["TEST1", "TEST2"]),
+    "refresh_standings": lambda dao: dao.refresh_standings(1),
+    "get_standings_discrepancies": lambda dao: dao.get_standings_discrepancies(1),
+    "get_points_drift": lambda dao: dao.get_points_drift(1),
+    "recompute_earned_points": lambda dao: dao.recompute_earned_points(1),
+    "create_player": lambda dao: dao.create_player(1, "TEST1"),
+    "update_player_order": lambda dao: dao.update_player_order(1, [["TEST1", 1], ["TEST2", 2]]),
+    "update_all_borrowed_points": lambda dao: dao.update_all_borrowed_points(1, [["TEST1", 10], ["TEST2", 20]]),
+    "decrement_borrowed_points": lambda dao: dao.decrement_borrowed_points(1, 5, 4),
+    "update_borrowed_points": lambda dao: dao.update_borrowed_points(1, "TEST1", 10),
+    "update_earned_points": lambda dao: dao.update_earned_points(1, "TEST1", 10),
+    "update_all_earned_points": lambda dao: dao.update_all_earned_points(1, [["TEST1", 10], ["TEST2", 5]]),
+    "update_all_earned_points (bump_version)": lambda dao: dao.update_all_earned_points(1, [["TEST1", 10], ["TEST2", 5]], bump_version=True),
+    "get_matches (ladder)": lambda dao: dao.get_matches(1),
+    "get_matches (player)": lambda dao: dao.get_matches(1, "TEST1"),
+    "get_match_page (ladder)": lambda dao: dao.get_match_page(1, None, 50),
+    "get_match_page (ladder, after)": lambda dao: dao.get_match_page(1, None, 50, (datetime(2020, 1, 1), 10)),
+    "get_match_page (player)": lambda dao: dao.get_match_page(1, "TEST1", 50),
+    "get_match_page (player, after)": lambda dao: dao.get_match_page(1, "TEST1", 50, (datetime(2020, 1, 1), 10)),
+    "get_match_counts": lambda dao: dao.get_match_counts(1, "TEST1", "TEST2", date(2020, 1, 1)),
+    "get_match": lambda dao: dao.get_match(1),
+    "create_match": lambda dao: dao.create_match(Match(None, 1, datetime(2020, 1, 1), "TEST1", "TEST2", 6, 0, 6, 0)),
+    "create_matches": lambda dao: dao.create_matches([Match(None, 1, datetime(2020, 1, 1), "TEST1", "TEST2", 6, 0, 6, 0)]),
+    "update_match": lambda dao: dao.update_match(Match(1, 1, datetime(2020, 1, 1), "TEST1", "TEST2", 6, 0, 6, 0)),
+    "delete_match": lambda dao: dao.delete_match(1),
+    "get_ladder_code": lambda dao: dao.get_ladder_code(1),
+}
+# Queries that are meant to read a whole table, and why
+FULL_SCANS_ALLOWED = {
+    "get_ladders": "lists every ladder",
+}
+
+
+class RecordingConnection:
+    """Stands in for the database while a Dao method runs, so that its SQL can be captured (and then explained) without running it"""
+
+    def __init__(self):
+        self.statements = []
+        self.lastrowid = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self): return self
+
+    def __exit__(self, *_): pass
+
+    def execute(self, sql, args=None):
+        self.statements.append((sql, args))
+        return 0
+
+    def fetchall(self): return []
+
+    def fetchone(self): return None
+
+
+class Test(unittest.TestCase):
+    dao: DaoImpl
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ["DB_HOST"] = properties.db_host
+        os.environ["DB_USERNAME"] = properties.db_username
+        os.environ["DB_PASSWORD"] = properties.db_password
+        os.environ["DB_DATABASE_NAME"] = properties.db_database_name
+
+        cls.dao = DaoImpl()
+
+    def test_every_dao_method_is_explained(self):
+        methods = {name for name, _ in inspect.getmembers(Dao, inspect.isfunction) if not name.startswith("_")} - {"transaction"}
+        self.assertEqual(sorted(methods), sorted({name.split(" ")[0] for name in QUERIES}))
+
+    def test_no_query_scans_a_whole_table(self):
+        for name, call in QUERIES.items():
+            with self.subTest(name):
+                for sql, args in self.capture(call):
+                    for row in self.explain(sql, args):
+                        # The test tables are tiny, so the optimizer may choose to scan one even when an index would work. What matters is that there's
+                        # always an index it could use. Derived tables (<derived2>, <union1,2>) and the row being inserted don't count
+                        table = row["table"]
+                        if table is None or table.startswith("<") or row["select_type"] in ("INSERT", "REPLACE"):
+                            continue
+                        if row["type"] == "ALL" and not row["possible_keys"] and name not in FULL_SCANS_ALLOWED:
+                            self.fail(f"{name} scans all of {table} (no index it can use):\n{' '.join(sql.split())}")
+
+    def capture(self, call):
+        connection = RecordingConnection()
+        with patch.object(self.dao.db, "run", side_effect=lambda operation, retry=False: operation(connection)):
+            call(self.dao)
+        return connection.statements
+
+    def explain(self, sql, args):
+        def query(connection):
+            with connection.cursor() as cursor:
+                cursor.execute("explain " + sql, args)
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        return self.dao.db.run(query)
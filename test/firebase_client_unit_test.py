@@ -0,0 +1,242 @@
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from firebase_admin import auth
+from google.auth import crypt, jwt
+
+from cache_unit_test import FakeClock
+from domain import DomainException
+from firebase_client import CachingFirebaseClient, CertificateFetchError, CertificateStore, FirebaseClient, LocalFirebaseClient
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 1000
+        self.client = CachingFirebaseClient(FirebaseClient(), failure_ttl=30, clock=self.clock)
+
+    def test_verified_tokens_are_cached_until_they_expire(self):
+        with patch.object(self.client.firebase_client, "get_firebase_user", return_value={"user_id": "TEST1", "exp": 1100}) as get_firebase_user_mock:
+            self.assertEqual("TEST1", self.client.get_firebase_user("token")["user_id"])
+            self.clock.now = 1099
+            self.assertEqual("TEST1", self.client.get_firebase_user("token")["user_id"])
+            self.clock.now = 1100
+            self.client.get_firebase_user("token")
+        self.assertEqual(2, get_firebase_user_mock.call_count)
+        self.assertEqual(1, self.client.stats()["hits"])
+        self.assertEqual(2, self.client.stats()["misses"])
+
+    def test_tokens_are_cached_separately(self):
+        with patch.object(self.client.firebase_client, "get_firebase_user", side_effect=lambda token: {"user_id": token, "exp": 1100}) as get_firebase_user_mock:
+            self.assertEqual("token1", self.client.get_firebase_user("token1")["user_id"])
+            self.assertEqual("token2", self.client.get_firebase_user("token2")["user_id"])
+            self.assertEqual("token1", self.client.get_firebase_user("token1")["user_id"])
+        self.assertEqual(2, get_firebase_user_mock.call_count)
+
+    def test_tokens_are_not_kept_in_memory(self):
+        with patch.object(self.client.firebase_client, "get_firebase_user", return_value={"user_id": "TEST1", "exp": 1100}):
+            self.client.get_firebase_user("secret_token")
+        self.assertNotIn("secret_token", [key for key, _ in self.client.cache.items()])
+
+    def test_already_expired_tokens_are_not_cached(self):
+        with patch.object(self.client.firebase_client, "get_firebase_user", return_value={"user_id": "TEST1", "exp": 1000}) as get_firebase_user_mock:
+            self.client.get_firebase_user("token")
+            self.client.get_firebase_user("token")
+        self.assertEqual(2, get_firebase_user_mock.call_count)
+
+    def test_invalid_tokens_are_rejected_without_verifying_again_for_a_while(self):
+        def raise_error(_): raise auth.InvalidIdTokenError("bad token")
+
+        with patch.object(self.client.firebase_client, "get_firebase_user", side_effect=raise_error) as get_firebase_user_mock:
+            self.assertRaises(auth.InvalidIdTokenError, lambda: self.client.get_firebase_user("bad_token"))
+            self.clock.now = 1029
+            self.assertRaisesRegex(DomainException, "bad token", lambda: self.client.get_firebase_user("bad_token"))
+            self.clock.now = 1030
+            self.assertRaises(auth.InvalidIdTokenError, lambda: self.client.get_firebase_user("bad_token"))
+        self.assertEqual(2, get_firebase_user_mock.call_count)
+        self.assertEqual(1, self.client.stats()["rejections"])
+
+    def test_malformed_tokens_are_rejected_without_verifying_again(self):
+        def raise_error(_): raise ValueError("malformed")
+
+        with patch.object(self.client.firebase_client, "get_firebase_user", side_effect=raise_error) as get_firebase_user_mock:
+            self.assertRaises(ValueError, lambda: self.client.get_firebase_user("a.bad.token"))
+            with self.assertRaises(DomainException) as first:
+                self.client.get_firebase_user("a.bad.token")
+            with self.assertRaises(DomainException) as second:
+                self.client.get_firebase_user("a.bad.token")
+        get_firebase_user_mock.assert_called_once()
+        # Each rejection is a new exception, rather than the same one being raised (and its traceback growing) over and over
+        self.assertIsNot(first.exception, second.exception)
+        self.assertEqual("malformed", second.exception.error_message)
+
+    def test_other_failures_are_not_cached(self):
+        def raise_error(_): raise auth.CertificateFetchError("no network", None)
+
+        with patch.object(self.client.firebase_client, "get_firebase_user", side_effect=raise_error) as get_firebase_user_mock:
+            self.assertRaises(auth.CertificateFetchError, lambda: self.client.get_firebase_user("token"))
+            self.assertRaises(auth.CertificateFetchError, lambda: self.client.get_firebase_user("token"))
+        self.assertEqual(2, get_firebase_user_mock.call_count)
+
+
+class LocalFirebaseClientTest(unittest.TestCase):
+    PROJECT_ID = "tennis-ladder-test"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.certificate = generate_key_and_certificate()
+        cls.other_private_key, cls.other_certificate = generate_key_and_certificate()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.clock.now = 1000
+        self.fetches = 0
+        self.certificates = {"key1": self.certificate}
+        self.store = self.create_store()
+        self.client = LocalFirebaseClient(LocalFirebaseClientTest.PROJECT_ID, self.store)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_store(self):
+        def fetch():
+            self.fetches += 1
+            return dict(self.certificates), 3600
+
+        return CertificateStore(os.path.join(self.temp_dir.name, "certificates.json"), fetch, self.clock)
+
+    def test_valid_token(self):
+        claims = self.client.get_firebase_user(self.create_token())
+        self.assertEqual("TEST1", claims["user_id"])
+        self.assertEqual("TEST1", claims["uid"])
+        self.assertEqual("test1@mail.com", claims["email"])
+
+    def test_certificates_are_only_fetched_once(self):
+        self.client.get_firebase_user(self.create_token())
+        self.client.get_firebase_user(self.create_token())
+        self.assertEqual(1, self.fetches)
+
+    def test_certificates_are_reused_from_disk_by_a_new_container(self):
+        self.client.get_firebase_user(self.create_token())
+        new_client = LocalFirebaseClient(LocalFirebaseClientTest.PROJECT_ID, self.create_store())
+        new_client.get_firebase_user(self.create_token())
+        self.assertEqual(1, self.fetches)
+
+    def test_certificates_are_fetched_again_once_they_expire(self):
+        self.client.get_firebase_user(self.create_token())
+        self.clock.now += 3600
+        self.client.get_firebase_user(self.create_token())
+        self.assertEqual(2, self.fetches)
+
+    def test_expired_certificates_are_still_used_when_they_cant_be_fetched(self):
+        self.client.get_firebase_user(self.create_token())
+        self.clock.now += 3600
+
+        def fail(): raise CertificateFetchError("no network")
+
+        self.store.fetch = fail
+        self.assertEqual("TEST1", self.client.get_firebase_user(self.create_token())["uid"])
+
+    def test_unknown_key_ids_fetch_the_new_certificates(self):
+        self.client.get_firebase_user(self.create_token())
+        # Google rotates to a new key
+        self.certificates["key2"] = self.other_certificate
+        self.clock.now += CertificateStore.MIN_SECONDS_BETWEEN_FETCHES
+        self.assertEqual("TEST1", self.client.get_firebase_user(self.create_token(private_key=self.other_private_key, key_id="key2"))["uid"])
+        self.assertEqual(2, self.fetches)
+
+    def test_unknown_key_ids_dont_fetch_more_than_once_a_minute(self):
+        self.client.get_firebase_user(self.create_token())
+        self.assertRaises(ValueError, lambda: self.client.get_firebase_user(self.create_token(key_id="made_up")))
+        self.assertRaises(ValueError, lambda: self.client.get_firebase_user(self.create_token(key_id="made_up")))
+        self.assertEqual(1, self.fetches)
+
+    def test_certificate_fetch_errors_are_not_token_errors(self):
+        def fail(): raise CertificateFetchError("no network")
+
+        self.store.fetch = fail
+        with self.assertRaises(CertificateFetchError) as e:
+            self.client.get_firebase_user(self.create_token())
+        self.assertFalse(CachingFirebaseClient.is_invalid_token_error(e.exception))
+
+    def test_invalid_tokens(self):
+        now = int(time.time())
+        invalid_tokens = {
+            "malformed": "a.bad.token",
+            "wrong signature": self.create_token(private_key=self.other_private_key),
+            "expired": self.create_token(iat=now - 7200, exp=now - 3600),
+            "issued in the future": self.create_token(iat=now + 3600, exp=now + 7200),
+            "wrong audience": self.create_token(aud="another-project"),
+            "wrong issuer": self.create_token(iss="https://securetoken.google.com/another-project"),
+            "no subject": self.create_token(sub=""),
+        }
+        for name, token in invalid_tokens.items():
+            with self.subTest(name):
+                with self.assertRaises(Exception) as e:
+                    self.client.get_firebase_user(token)
+                self.assertTrue(CachingFirebaseClient.is_invalid_token_error(e.exception))
+
+    def test_unsigned_tokens_are_rejected(self):
+        header = base64.urlsafe_b64encode(json.dumps({"alg": "none", "kid": "key1"}).encode()).decode().rstrip("=")
+        payload = base64.urlsafe_b64encode(json.dumps({"sub": "TEST1"}).encode()).decode().rstrip("=")
+        self.assertRaises(ValueError, lambda: self.client.get_firebase_user(f"{header}.{payload}."))
+
+    def test_find_project_id(self):
+        credentials_path = os.path.join(self.temp_dir.name, "firebase_creds.json")
+        with open(credentials_path, "w") as f:
+            json.dump({"project_id": "from-credentials"}, f)
+
+        with patch.dict(os.environ, {"FIREBASE_PROJECT_ID": "from-env", "GOOGLE_APPLICATION_CREDENTIALS": credentials_path}):
+            self.assertEqual("from-env", LocalFirebaseClient.find_project_id())
+        # Falls back to the service account's credentials, wherever they are
+        with patch.dict(os.environ, {"FIREBASE_PROJECT_ID": "", "GOOGLE_CLOUD_PROJECT": "", "GOOGLE_APPLICATION_CREDENTIALS": credentials_path}):
+            self.assertEqual("from-credentials", LocalFirebaseClient.find_project_id())
+        with patch.dict(os.environ, {"FIREBASE_PROJECT_ID": "", "GOOGLE_CLOUD_PROJECT": "", "GOOGLE_APPLICATION_CREDENTIALS": ""}), \
+                patch.object(LocalFirebaseClient, "BUNDLED_CREDENTIALS_PATH", credentials_path):
+            self.assertEqual("from-credentials", LocalFirebaseClient.find_project_id())
+
+            # Without any of them, it fails rather than rejecting every token
+            LocalFirebaseClient.BUNDLED_CREDENTIALS_PATH = os.path.join(self.temp_dir.name, "missing.json")
+            self.assertRaisesRegex(ValueError, "FIREBASE_PROJECT_ID", LocalFirebaseClient.find_project_id)
+
+    def create_token(self, private_key=None, key_id="key1", **claims):
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{LocalFirebaseClientTest.PROJECT_ID}",
+            "aud": LocalFirebaseClientTest.PROJECT_ID,
+            "auth_time": now,
+            "user_id": "TEST1",
+            "sub": "TEST1",
+            "iat": now,
+            "exp": now + 3600,
+            "email": "test1@mail.com",
+            **claims
+        }
+        signer = crypt.RSASigner.from_string(private_key or self.private_key, key_id=key_id)
+        return jwt.encode(signer, payload).decode()
+
+
+def generate_key_and_certificate():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+    certificate = x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(datetime.now(timezone.utc) - timedelta(days=1)) \
+        .not_valid_after(datetime.now(timezone.utc) + timedelta(days=1)) \
+        .sign(key, hashes.SHA256())
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()).decode()
+    return private_pem, certificate.public_bytes(serialization.Encoding.PEM).decode()
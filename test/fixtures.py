@@ -1,6 +1,6 @@
 from datetime import datetime, date
 
-from domain import User, Match, Player, Ladder
+from domain import User, Match, Player, Ladder, Session
 
 
 def ladder(ladder_id=0, name="", start_date=date.today(), end_date=date.today(), distance_penalty_on=False, weeks_for_borrowed_points=0, weeks_for_borrowed_points_left=0, logged_in_user_has_joined=False, logged_in_user_is_admin=False) -> Ladder:
@@ -21,3 +21,7 @@ def user(user_id="", name="", email="", phone_number=None, photo_url=None, avail
 
 def player(user_: User = user(), ladder_id=0, score=0, earned_points=0, borrowed_points=0, ranking=0, wins=0, losses=0) -> Player:
     return Player(user_.user_id, user_.name, user_.email, user_.phone_number, user_.photo_url, user_.availability_text, user_.admin, ladder_id, score, earned_points, borrowed_points, ranking, wins, losses)
+
+
+def session(user_: User = user(), ladder_ids=None, admin_ladder_ids=None) -> Session:
+    return Session(user_, ladder_ids or [], admin_ladder_ids or [])
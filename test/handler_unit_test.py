@@ -1,9 +1,12 @@
+import json
+import os
 import unittest
 from typing import Dict
 from unittest.mock import patch
 
 import fixtures
 from bl import Manager
+from firebase_client import LocalFirebaseClient
 from src import handler
 from src.domain import *
 from datetime import datetime, date
@@ -12,19 +15,32 @@ from datetime import datetime, date
 class Test(unittest.TestCase):
     def setUp(self):
         self.handler = handler.Handler(Manager())
+        self.handler.manager.user = fixtures.user()
 
     def test_decrement_borrowed_points(self):
         with patch.object(self.handler.manager, "decrement_borrowed_points") as decrement_borrowed_points_mock:
             self.handler.handle({"decrement-borrowed-points": True})
         decrement_borrowed_points_mock.assert_called_once()
 
-    def test_token_can_handle_any_casing(self):
+    def test_reconcile_ladders(self):
+        with patch.object(self.handler.manager, "reconcile_all_ladders") as reconcile_all_ladders_mock:
+            self.assertEqual({}, self.handler.handle({"reconcile-ladders": True}))
+            self.handler.handle({"reconcile-ladders": True, "dry-run": True})
+        self.assertEqual([False, True], [c.args[0] for c in reconcile_all_ladders_mock.mock_calls])
+
+    def test_reconcile_ladder(self):
+        with patch.object(self.handler.manager, "reconcile_ladder", return_value=[]) as reconcile_ladder_mock:
+            self.handler.handle(create_event("/ladders/{ladder_id}/reconcile", {"ladder_id": "1"}, "POST", query_params={"dry_run": "true"}))
+        reconcile_ladder_mock.assert_called_once_with(1, True)
+
+    @patch.object(Manager, "get_ladders", return_value=[])
+    def test_token_can_handle_any_casing(self, _):
         with patch.object(self.handler.manager, "validate_token") as validate_token_mock:
-            self.handler.handle(create_event("/bad", headers={"x-firebase-token": "token"}))
+            self.handler.handle(create_event("/ladders", headers={"x-firebase-token": "token"}))
         validate_token_mock.assert_called_once_with("token")
 
         with patch.object(self.handler.manager, "validate_token") as validate_token_mock:
-            self.handler.handle(create_event("/bad", headers={"X-Firebase-Token": "token"}))
+            self.handler.handle(create_event("/ladders", headers={"X-Firebase-Token": "token"}))
         validate_token_mock.assert_called_once_with("token")
 
     def test_success_response_with_complex_body_is_serialized_correctly(self):
@@ -41,24 +57,24 @@ class Test(unittest.TestCase):
         with patch.object(self.handler.manager, "get_ladders", return_value=[TestObject()]):
             response = self.handler.handle(create_event("/ladders"))
         self.assertEqual(200, response["statusCode"])
-        self.assertEqual("""[{"datetime": "2020-01-01T01:00:00-07:00", "date": "2021-12-25", "nested_object": {"key": "value"}}]""", response["body"])
+        self.assertEqual("""[{"datetime": "2020-01-01T01:00:00-07:00", "date": "2021-12-25", "nested_object": {"key": "value"}}]""", body_of(response))
 
     def test_user_serialization_contract(self):
         with patch.object(self.handler.manager, "get_ladders", return_value=[User("user_id", "name", "email", "phone_number", "photo_url", "availability_text", True)]):
             response = self.handler.handle(create_event("/ladders"))
-        self.assertEqual("""[{"user_id": "user_id", "name": "name", "email": "email", "phone_number": "phone_number", "photo_url": "photo_url", "availability_text": "availability_text", "admin": true}]""", response["body"])
+        self.assertEqual("""[{"user_id": "user_id", "name": "name", "email": "email", "phone_number": "phone_number", "photo_url": "photo_url", "availability_text": "availability_text", "admin": true}]""", body_of(response))
 
     def test_ladder_serialization_contract(self):
         with patch.object(self.handler.manager, "get_ladders", return_value=[fixtures.ladder(1, "name", date(2020, 1, 1), date(2021, 2, 3), False, 5, 3, True, True)]):
             response = self.handler.handle(create_event("/ladders"))
-        self.assertEqual("""[{"ladder_id": 1, "name": "name", "start_date": "2020-01-01", "end_date": "2021-02-03", "distance_penalty_on": false, "weeks_for_borrowed_points": 5, "weeks_for_borrowed_points_left": 3, "logged_in_user_has_joined": true, "logged_in_user_is_admin": true}]""", response["body"])
+        self.assertEqual("""[{"ladder_id": 1, "name": "name", "start_date": "2020-01-01", "end_date": "2021-02-03", "distance_penalty_on": false, "weeks_for_borrowed_points": 5, "weeks_for_borrowed_points_left": 3, "logged_in_user_has_joined": true, "logged_in_user_is_admin": true}]""", body_of(response))
 
     def test_player_serialization_contract(self):
         with patch.object(self.handler.manager, "get_ladders", return_value=[Player("user_id", "name", "email", "phone_number", "photo_url", "availability_text", True, 1, 23, 12, 11, 3, 6, 2)]):
             response = self.handler.handle(create_event("/ladders"))
         self.assertEqual(
             """[{"user": {"user_id": "user_id", "name": "name", "email": "email", "phone_number": "phone_number", "photo_url": "photo_url", "availability_text": "availability_text", "admin": true}, "ladder_id": 1, "score": 23, "earned_points": 12, "borrowed_points": 11, "ranking": 3, "wins": 6, "losses": 2}]""",
-            response["body"]
+            body_of(response)
         )
 
     def test_match_serialization_contract(self):
@@ -68,7 +84,7 @@ class Test(unittest.TestCase):
             response = self.handler.handle(create_event("/ladders"))
         self.assertEqual(
             """[{"match_id": 1, "ladder_id": 2, "match_date": "2020-01-02T03:04:05-07:00", "winner_id": "winner_id", "loser_id": "loser_id", "winner_set1_score": 6, "loser_set1_score": 0, "winner_set2_score": 5, "loser_set2_score": 7, "winner_set3_score": 10, "loser_set3_score": 8, "winner_points": 24, "loser_points": 12, "winner": {"user": {"user_id": "winner_id", "name": "", "email": "", "phone_number": null, "photo_url": null, "availability_text": null, "admin": false}, "ladder_id": 2, "score": 0, "earned_points": 0, "borrowed_points": 0, "ranking": 0, "wins": 0, "losses": 0}, "loser": {"user": {"user_id": "loser_id", "name": "", "email": "", "phone_number": null, "photo_url": null, "availability_text": null, "admin": false}, "ladder_id": 2, "score": 0, "earned_points": 0, "borrowed_points": 0, "ranking": 0, "wins": 0, "losses": 0}}]""",
-            response["body"]
+            body_of(response)
         )
 
     def test_success_response_with_no_body_has_no_body(self):
@@ -79,8 +95,82 @@ class Test(unittest.TestCase):
 
     def test_error_response_serialized_correctly(self):
         response = self.handler.handle(create_event("/bad"))
-        self.assertEqual(500, response["statusCode"])
-        self.assertEqual("""{"error": "Invalid path: '/bad GET'"}""", response["body"])
+        self.assertEqual(404, response["statusCode"])
+        self.assertEqual("""{"error": "Invalid path: '/bad GET'"}""", body_of(response))
+
+    def test_unsupported_method_on_a_known_resource(self):
+        response = self.handler.handle(create_event("/users/{user_id}", {"user_id": "abc"}, "DELETE"))
+        self.assertEqual(405, response["statusCode"])
+        self.assertEqual("""{"error": "Invalid method: '/users/{user_id} DELETE'"}""", body_of(response))
+        self.assertEqual("GET, PUT", response["headers"]["Allow"])
+
+    def test_invalid_path_param(self):
+        with patch.object(self.handler.manager, "get_players") as get_players_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "abc"}))
+        self.assertEqual(400, response["statusCode"])
+        self.assertEqual("""{"error": "Invalid ladder_id: 'abc'"}""", body_of(response))
+        get_players_mock.assert_not_called()
+
+    def test_routes_that_require_auth_reject_requests_without_a_user(self):
+        self.handler.manager.user = None
+        with patch.object(self.handler.manager, "report_match") as report_match_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/matches", {"ladder_id": "1"}, "POST", "{}"))
+        self.assertEqual(401, response["statusCode"])
+        self.assertEqual("""{"error": "Unable to authenticate"}""", body_of(response))
+        report_match_mock.assert_not_called()
+
+    def test_routes_with_optional_auth_allow_requests_without_a_user(self):
+        self.handler.manager.user = None
+        with patch.object(self.handler.manager, "get_ladders", return_value=[]):
+            response = self.handler.handle(create_event("/ladders"))
+        self.assertEqual(200, response["statusCode"])
+
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_routes_without_auth_dont_verify_the_token(self, _):
+        with patch.object(self.handler.manager, "validate_token") as validate_token_mock:
+            with patch.object(self.handler.manager, "get_players", return_value=[]):
+                self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "1"}, headers={"X-Firebase-Token": "token"}))
+        validate_token_mock.assert_called_once_with(None)
+
+    @patch.object(Manager, "get_ladder_version", return_value=3)
+    def test_ladder_responses_are_tagged_with_the_ladders_version(self, get_ladder_version_mock):
+        with patch.object(self.handler.manager, "get_players", return_value=[]):
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "1"}))
+        self.assertEqual(200, response["statusCode"])
+        self.assertEqual({"Cache-Control": "public, max-age=5", "ETag": 'W/"1-3"'}, response["headers"])
+        get_ladder_version_mock.assert_called_once_with(1)
+
+    @patch.object(Manager, "get_ladder_version", return_value=3)
+    def test_matching_etag_returns_not_modified(self, _):
+        for if_none_match in ['W/"1-3"', '"1-3"', 'W/"1-2", W/"1-3"', "*"]:
+            with self.subTest(if_none_match=if_none_match):
+                with patch.object(self.handler.manager, "get_matches") as get_matches_mock:
+                    response = self.handler.handle(create_event("/ladders/{ladder_id}/players/{user_id}/matches", {"ladder_id": "1", "user_id": "TEST1"}, headers={"If-None-Match": if_none_match}))
+                self.assertEqual(304, response["statusCode"])
+                self.assertIsNone(response["body"])
+                self.assertEqual('W/"1-3"', response["headers"]["ETag"])
+                get_matches_mock.assert_not_called()
+
+    @patch.object(Manager, "get_ladder_version", return_value=3)
+    def test_stale_etag_returns_the_response(self, _):
+        with patch.object(self.handler.manager, "get_players", return_value=[]) as get_players_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "1"}, headers={"if-none-match": 'W/"1-2"'}))
+        self.assertEqual(200, response["statusCode"])
+        self.assertEqual('W/"1-3"', response["headers"]["ETag"])
+        get_players_mock.assert_called_once_with(1)
+
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_missing_ladder_has_no_etag(self, _):
+        with patch.object(self.handler.manager, "get_players", return_value=[]):
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "1"}, headers={"If-None-Match": "*"}))
+        self.assertEqual(200, response["statusCode"])
+        self.assertNotIn("ETag", response["headers"])
+
+    def test_cache_control(self):
+        with patch.object(self.handler.manager, "get_ladders", return_value=[]):
+            self.assertEqual("private, max-age=60", self.handler.handle(create_event("/ladders"))["headers"]["Cache-Control"])
+        with patch.object(self.handler.manager, "report_match", return_value={}):
+            self.assertEqual("no-store", self.handler.handle(create_event("/ladders/{ladder_id}/matches", {"ladder_id": "1"}, "POST", "{}"))["headers"]["Cache-Control"])
 
     def test_get_user(self):
         with patch.object(self.handler.manager, "get_user", return_value={}) as get_user_mock:
@@ -97,7 +187,8 @@ class Test(unittest.TestCase):
             self.handler.handle(create_event("/ladders"))
         get_ladders_mock.assert_called_once_with()
 
-    def test_get_players(self):
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_get_players(self, _):
         with patch.object(self.handler.manager, "get_players", return_value={}) as get_players_mock:
             self.handler.handle(create_event("/ladders/{ladder_id}/players", {"ladder_id": "1"}))
         get_players_mock.assert_called_once_with(1)
@@ -149,10 +240,33 @@ class Test(unittest.TestCase):
             self.handler.handle(create_event("/ladders/{ladder_id}/players/{user_id}", {"ladder_id": "1", "user_id": "abc"}, "PUT", "{}"))
         update_player_mock.assert_called_once_with(1, "abc", {})
 
-    def test_get_matches(self):
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_get_matches(self, _):
         with patch.object(self.handler.manager, "get_matches", return_value={}) as get_matches_mock:
             self.handler.handle(create_event("/ladders/{ladder_id}/players/{user_id}/matches", {"ladder_id": "1", "user_id": "TEST1"}))
-        get_matches_mock.assert_called_once_with(1, "TEST1")
+        get_matches_mock.assert_called_once_with(1, "TEST1", None, None)
+
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_get_ladder_matches(self, _):
+        with patch.object(self.handler.manager, "get_ladder_matches", return_value=handler.Page([], "next")) as get_ladder_matches_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/matches", {"ladder_id": "1"}, query_params={"cursor": "abc"}))
+        get_ladder_matches_mock.assert_called_once_with(1, 50, "abc")
+        self.assertEqual("[]", response["body"])
+        self.assertEqual("next", response["headers"]["X-Next-Cursor"])
+
+    @patch.object(Manager, "get_ladder_version", return_value=None)
+    def test_last_page_has_no_next_cursor(self, _):
+        with patch.object(self.handler.manager, "get_matches", return_value=handler.Page([])) as get_matches_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/players/{user_id}/matches", {"ladder_id": "1", "user_id": "TEST1"}, query_params={"limit": "10"}))
+        get_matches_mock.assert_called_once_with(1, "TEST1", 10, None)
+        self.assertEqual("[]", response["body"])
+        self.assertNotIn("X-Next-Cursor", response["headers"])
+
+    def test_page_limit_is_bounded(self):
+        for limit in ["0", "101"]:
+            with self.subTest(limit=limit):
+                response = self.handler.handle(create_event("/ladders/{ladder_id}/matches", {"ladder_id": "1"}, query_params={"limit": limit}))
+                self.assertEqual(400, response["statusCode"])
 
     def test_report_match(self):
         with patch.object(self.handler.manager, "report_match", return_value={}) as report_match_mock:
@@ -165,9 +279,117 @@ class Test(unittest.TestCase):
         update_match_scores_mock.assert_called_once_with(1, 2, {})
 
     def test_delete_match(self):
-        with patch.object(self.handler.manager, "delete_match", return_value={}) as delete_match_mock:
-            self.handler.handle(create_event("/ladders/{ladder_id}/matches/{match_id}", {"ladder_id": "1", "match_id": "2"}, "DELETE"))
+        # Like ManagerImpl.delete_match, which doesn't return anything
+        with patch.object(self.handler.manager, "delete_match", return_value=None) as delete_match_mock:
+            response = self.handler.handle(create_event("/ladders/{ladder_id}/matches/{match_id}", {"ladder_id": "1", "match_id": "2"}, "DELETE"))
         delete_match_mock.assert_called_once_with(1, 2)
+        self.assertEqual(200, response["statusCode"])
+        self.assertEqual("{}", response["body"])
+
+    @patch.object(Manager, "get_ladder_version", return_value=3)
+    def test_batch(self, _):
+        requests = [
+            {"method": "GET", "resource": "/ladders/{ladder_id}/players", "pathParameters": {"ladder_id": "1"}},
+            {"method": "GET", "resource": "/ladders/{ladder_id}/matches", "pathParameters": {"ladder_id": "1"}, "queryStringParameters": {"limit": "10"}},
+            {"method": "PUT", "resource": "/ladders/{ladder_id}/matches/{match_id}", "pathParameters": {"ladder_id": "1", "match_id": "2"}, "body": {"winner_set1_score": 6}},
+            {"method": "POST", "resource": "/ladders/{ladder_id}/matches", "pathParameters": {"ladder_id": "1"}, "body": '{"winner_set1_score": 7}'},
+            {"method": "GET", "resource": "/bad"},
+            {"method": "GET", "resource": "/ladders/{ladder_id}/players", "pathParameters": {"ladder_id": "1"}, "headers": {"If-None-Match": 'W/"1-3"'}},
+        ]
+        with patch.object(self.handler.manager, "validate_token") as validate_token_mock:
+            with patch.object(self.handler.manager, "get_players", return_value=[fixtures.player(user_=fixtures.user(user_id="TEST1"))]) as get_players_mock:
+                with patch.object(self.handler.manager, "get_ladder_matches", return_value=handler.Page([], "next")) as get_ladder_matches_mock:
+                    with patch.object(self.handler.manager, "update_match_scores", return_value=None) as update_match_scores_mock:
+                        with patch.object(self.handler.manager, "report_match", side_effect=handler.ServiceException("Players have already played 5 times.", 400)):
+                            response = self.handler.handle(create_event("/batch", method="POST", body=json.dumps(requests), headers={"X-Firebase-Token": "token"}))
+        # The token is only verified once, for the whole batch
+        validate_token_mock.assert_called_once_with("token")
+        get_players_mock.assert_called_once_with(1)
+        get_ladder_matches_mock.assert_called_once_with(1, 10, None)
+        update_match_scores_mock.assert_called_once_with(1, 2, {"winner_set1_score": 6})
+
+        self.assertEqual(200, response["statusCode"])
+        self.assertEqual("no-store", response["headers"]["Cache-Control"])
+        responses = json.loads(response["body"])
+        self.assertEqual([200, 200, 200, 400, 404, 304], [r["statusCode"] for r in responses])
+        self.assertEqual("TEST1", responses[0]["body"][0]["user"]["user_id"])
+        self.assertEqual('W/"1-3"', responses[0]["headers"]["ETag"])
+        self.assertEqual("next", responses[1]["headers"]["X-Next-Cursor"])
+        self.assertEqual({"error": "Players have already played 5 times."}, responses[3]["body"])
+        self.assertEqual({"error": "Invalid path: '/bad GET'"}, responses[4]["body"])
+        self.assertIsNone(responses[5]["body"])
+
+    def test_batch_parameters_can_be_json_values(self):
+        requests = [
+            {"method": "POST", "resource": "/ladders/{ladder_id}/reconcile", "pathParameters": {"ladder_id": 1}, "queryStringParameters": {"dry_run": True}},
+            {"method": "GET", "resource": "/ladders/{ladder_id}/matches", "pathParameters": {"ladder_id": 1}, "queryStringParameters": {"limit": [10]}},
+        ]
+        with patch.object(self.handler.manager, "reconcile_ladder", return_value=[]) as reconcile_ladder_mock:
+            response = self.handler.handle(create_event("/batch", method="POST", body=json.dumps(requests)))
+        reconcile_ladder_mock.assert_called_once_with(1, True)
+        self.assertEqual([200, 400], [r["statusCode"] for r in json.loads(response["body"])])
+
+    def test_batch_applies_each_requests_own_auth(self):
+        self.handler.manager.user = None
+        requests = [{"method": "POST", "resource": "/ladders/{ladder_id}/matches", "pathParameters": {"ladder_id": "1"}, "body": {}}, {"method": "GET", "resource": "/ladders"}]
+        with patch.object(self.handler.manager, "report_match") as report_match_mock:
+            with patch.object(self.handler.manager, "get_ladders", return_value=[]):
+                response = self.handler.handle(create_event("/batch", method="POST", body=json.dumps(requests)))
+        self.assertEqual([(401, {"error": "Unable to authenticate"}), (200, [])], [(r["statusCode"], r["body"]) for r in json.loads(response["body"])])
+        report_match_mock.assert_not_called()
+
+    def test_invalid_batches(self):
+        for body, error in [
+            (None, "No requests passed in"),
+            ("[]", "No requests passed in"),
+            ("{}", "No requests passed in"),
+            (json.dumps([{"method": "GET", "resource": "/ladders"}] * (handler.Handler.MAX_BATCH_REQUESTS + 1)), f"Only {handler.Handler.MAX_BATCH_REQUESTS} requests can be batched together"),
+        ]:
+            with self.subTest(body=body):
+                response = self.handler.handle(create_event("/batch", method="POST", body=body))
+                self.assertEqual(400, response["statusCode"])
+                self.assertEqual({"error": error}, json.loads(response["body"]))
+
+        response = self.handler.handle(create_event("/batch", method="POST", body=json.dumps([{"method": "POST", "resource": "/batch", "body": []}, {"resource": "/ladders"}])))
+        self.assertEqual(
+            [(400, {"error": "Batches can't be nested"}), (400, {"error": "Invalid request. No 'resource', or 'method' found in the request"})],
+            [(r["statusCode"], r["body"]) for r in json.loads(response["body"])]
+        )
+
+    def test_batch_reads_are_memoized(self):
+        with patch.object(self.handler.manager, "memoize_reads", wraps=self.handler.manager.memoize_reads) as memoize_reads_mock:
+            with patch.object(self.handler.manager, "get_ladders", return_value=[]):
+                self.handler.handle(create_event("/batch", method="POST", body=json.dumps([{"method": "GET", "resource": "/ladders"}])))
+        memoize_reads_mock.assert_called_once_with()
+
+    def test_dependencies_are_only_created_when_first_used(self):
+        with patch.object(handler.Handler, "instance", None), patch.dict(os.environ, {"FIREBASE_PROJECT_ID": "tennis-ladder-test"}):
+            with patch.object(handler.Handler, "create_firebase_client") as create_firebase_client_mock:
+                with patch.object(handler.Handler, "create_dao") as create_dao_mock:
+                    instance = handler.Handler.get_instance()
+                    # Requests without a token never need to verify one
+                    instance.handle(create_event("/users/{user_id}", {"user_id": "TEST1"}, headers={}))
+                    create_firebase_client_mock.assert_not_called()
+                    create_dao_mock.assert_not_called()
+
+                    instance.manager.dao.get_ladders()
+                    instance.manager.dao.get_ladder(1)
+                    create_dao_mock.assert_called_once_with()
+                    create_dao_mock.return_value.get_ladder.assert_called_once_with(1)
+
+                    instance.manager.firebase_client.get_firebase_user("token")
+                    create_firebase_client_mock.assert_called_once_with()
+
+    def test_only_requests_with_a_token_need_a_firebase_project_id(self):
+        with patch.object(handler.Handler, "instance", None), patch.object(LocalFirebaseClient, "find_project_id", side_effect=ValueError("No project ID")):
+            with patch.object(handler.Handler, "create_dao") as create_dao_mock:
+                instance = handler.Handler.get_instance()
+                create_dao_mock.return_value.get_ladders.return_value = []
+                self.assertEqual({}, instance.handle({"decrement-borrowed-points": True}))
+
+                response = instance.handle(create_event("/users/{user_id}", {"user_id": "TEST1"}, method="PUT", body="{}", headers={"X-Firebase-Token": "token"}))
+                self.assertEqual(401, response["statusCode"])
+                self.assertEqual({"error": "Unable to authenticate"}, json.loads(response["body"]))
 
 
 # noinspection PyDefaultArgument
@@ -184,3 +406,8 @@ def create_event(resource, path_params=None, method="GET", body=None, query_para
     if query_params is not None:
         event["queryStringParameters"] = query_params
     return event
+
+
+def body_of(response):
+    # orjson (when it's installed) leaves out the whitespace that json adds, so bodies are compared in json's format (with their keys still in order)
+    return json.dumps(json.loads(response["body"]))
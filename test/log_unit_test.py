@@ -0,0 +1,107 @@
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import fixtures
+from bl import Manager
+from handler import Handler
+from log import DEBUG, INFO, LOG, Logger
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.output = []
+        self.log = Logger(level=INFO, sample_rates={}, out=self.output.append)
+
+    def lines(self):
+        return [json.loads(line) for line in self.output]
+
+    def test_lines_are_json_with_the_request(self):
+        self.log.start_request("REQUEST1")
+        self.log.set_operation("get_players")
+        self.log.info("Hello", ladder_id=1, user=fixtures.user(user_id="USER1"))
+        line = self.lines()[0]
+        self.assertEqual({"level": "INFO", "message": "Hello", "request_id": "REQUEST1", "operation": "get_players", "ladder_id": 1}, {
+            field: value for field, value in line.items() if field != "user"
+        })
+        # Objects are logged as their fields
+        self.assertEqual("USER1", line["user"]["user_id"])
+
+        self.log.start_request("REQUEST2")
+        self.log.info("Hello")
+        self.assertEqual(("REQUEST2", None), (self.lines()[1]["request_id"], self.lines()[1]["operation"]))
+
+    def test_lines_below_the_level_cost_nothing(self):
+        expensive = MagicMock(return_value="details")
+        self.log.debug("Details", details=expensive)
+        self.assertEqual([], self.output)
+        expensive.assert_not_called()
+
+        self.log.level = DEBUG
+        self.log.debug("Details", details=expensive)
+        self.assertEqual("details", self.lines()[0]["details"])
+
+    def test_sampling(self):
+        self.log.sample_rates = {"get_ladders": 0, "get_players": 0.5}
+        self.log.random = lambda: 0.7
+        self.log.start_request("REQUEST1")
+        self.log.set_operation("get_ladders")
+        self.log.info("Skipped")
+        # Warnings and errors are logged from every request
+        self.log.warning("Kept")
+        self.log.error("Kept")
+
+        self.log.set_operation("get_players")
+        self.log.info("Skipped")
+        self.log.random = lambda: 0.2
+        self.log.set_operation("get_players")
+        self.log.info("Kept")
+
+        # Operations without a rate are always logged, unless there's a default
+        self.log.set_operation("get_user")
+        self.log.info("Kept")
+        self.log.sample_rates["*"] = 0
+        self.log.set_operation("get_user")
+        self.log.info("Skipped")
+        self.assertEqual(["Kept"] * 4, [line["message"] for line in self.lines()])
+
+    def test_parse_sample_rates(self):
+        self.assertEqual({}, Logger.parse_sample_rates(""))
+        self.assertEqual({"get_players": 0.1, "*": 1}, Logger.parse_sample_rates("get_players=0.1, *=1"))
+
+    def test_invalid_configuration_falls_back_to_the_defaults(self):
+        with patch.dict(os.environ, {"LOG_LEVEL": "VERBOSE", "LOG_SAMPLE_RATES": "get_players=often,get_ladders"}):
+            log = Logger(out=self.output.append)
+        self.assertEqual((INFO, {}), (log.level, log.sample_rates))
+        # With one warning that says what was wrong
+        self.assertEqual([{"level": "WARNING", "message": "Invalid logging configuration, so the defaults are being used", "request_id": None,
+                           "operation": None, "LOG_LEVEL": "VERBOSE", "LOG_SAMPLE_RATES": "get_players=often,get_ladders"}], self.lines())
+
+        with patch.dict(os.environ, {"LOG_LEVEL": "debug", "LOG_SAMPLE_RATES": "get_players=0.5"}):
+            log = Logger(out=self.output.append)
+        self.assertEqual((DEBUG, {"get_players": 0.5}), (log.level, log.sample_rates))
+        self.assertEqual(1, len(self.output))
+
+    def test_handler_logs_each_request_with_its_id(self):
+        handler = Handler(Manager())
+        handler.manager.user = fixtures.user(user_id="USER1", name="Joe Bloggs")
+        with patch.object(LOG, "out", self.output.append), patch.object(LOG, "level", INFO), patch.object(LOG, "sample_rates", {}), \
+                patch.object(Manager, "update_user", return_value=fixtures.user()), \
+                patch.object(Manager, "decrement_borrowed_points", side_effect=lambda: LOG.info("Decrementing borrowed points")):
+            handler.handle({"resource": "/users/{user_id}", "httpMethod": "PUT", "pathParameters": {"user_id": "USER1"}, "body": '{"name": "Joe Bloggs"}',
+                            "requestContext": {"requestId": "REQUEST1"}})
+            handler.handle({"decrement-borrowed-points": True}, SimpleNamespace(aws_request_id="REQUEST2"))
+
+        request, decrement = self.lines()
+        self.assertEqual(("REQUEST1", "update_user", "PUT", "USER1"), (request["request_id"], request["operation"], request["method"], request["user_id"]))
+        # Bodies (and names) are only logged when debugging
+        self.assertFalse(any("Joe Bloggs" in line for line in self.output))
+        # Lines logged by the manager are tagged with the request too
+        self.assertEqual(("REQUEST2", "decrement_borrowed_points"), (decrement["request_id"], decrement["operation"]))
+
+    def test_request_ids(self):
+        self.assertEqual("REQUEST1", Handler.get_request_id({"requestContext": {"requestId": "REQUEST1"}}, SimpleNamespace(aws_request_id="REQUEST2")))
+        self.assertEqual("REQUEST2", Handler.get_request_id({}, SimpleNamespace(aws_request_id="REQUEST2")))
+        self.assertEqual(16, len(Handler.get_request_id({}, None)))
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+
+from migrate import Migration, MigrationError, MigrationRunner, load_migrations, split_statements
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def __enter__(self): return self
+
+    def __exit__(self, *_): pass
+
+    def execute(self, sql, args=None):
+        if sql in self.db.failing_statements:
+            raise Exception("You have an error in your SQL syntax")
+        if sql.startswith("select VERSION"):
+            self.rows = [(version,) for version in self.db.applied]
+        elif sql.startswith("insert into schema_migrations"):
+            self.db.applied.append(args[0])
+        elif not sql.strip().startswith("create table if not exists schema_migrations"):
+            self.db.statements.append(sql)
+
+    def fetchall(self): return self.rows
+
+
+class FakeDb:
+    def __init__(self, applied=None):
+        self.applied = applied or []
+        self.statements = []
+        self.failing_statements = []
+
+    def run(self, operation, retry=False):
+        return operation(self)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class Test(unittest.TestCase):
+    def test_split_statements(self):
+        sql = """
+            # A comment
+            create table a (
+              ID int
+            );
+            -- Another comment
+            insert into a values (1);
+
+            delimiter //
+            create trigger t after insert on a for each row
+            begin
+              insert into b values (new.ID);
+              insert into c values (new.ID);
+            end//
+            delimiter ;
+            drop table b;
+        """
+        statements = split_statements(sql)
+        self.assertEqual(4, len(statements))
+        self.assertTrue(statements[0].startswith("create table a ("))
+        self.assertTrue(statements[0].endswith(")"))
+        self.assertEqual("insert into a values (1)", statements[1])
+        self.assertTrue(statements[2].startswith("create trigger t"))
+        self.assertTrue(statements[2].endswith("end"))
+        self.assertIn("insert into c values (new.ID);", statements[2])
+        self.assertEqual("drop table b", statements[3])
+
+    def test_split_statements_with_a_missing_delimiter(self):
+        self.assertRaises(MigrationError, lambda: split_statements("create table a (ID int);\ndrop table a"))
+
+    def test_checked_in_migrations(self):
+        migrations = load_migrations()
+        # Numbered from 1, with no gaps, and nothing empty
+        self.assertEqual(list(range(1, len(migrations) + 1)), [migration.version for migration in migrations])
+        for migration in migrations:
+            self.assertGreater(len(migration.statements), 0, str(migration))
+
+    def test_load_migrations_validates_file_names(self):
+        with tempfile.TemporaryDirectory() as path:
+            for file_name in ["0001_first.sql", "0002_second.sql", "README.md"]:
+                with open(os.path.join(path, file_name), "w") as f:
+                    f.write("select 1;")
+            self.assertEqual(["0001_first", "0002_second"], [str(migration) for migration in load_migrations(path)])
+
+            with open(os.path.join(path, "0002_duplicate.sql"), "w") as f:
+                f.write("select 1;")
+            self.assertRaises(MigrationError, lambda: load_migrations(path))
+
+            os.remove(os.path.join(path, "0002_duplicate.sql"))
+            with open(os.path.join(path, "3_bad_name.sql"), "w") as f:
+                f.write("select 1;")
+            self.assertRaises(MigrationError, lambda: load_migrations(path))
+
+    def test_migrate_applies_pending_migrations_in_order(self):
+        db = FakeDb(applied=[1])
+        runner = MigrationRunner(db, [Migration(3, "third", ["c"]), Migration(1, "first", ["a"]), Migration(2, "second", ["b1", "b2"])])
+        self.assertEqual([2, 3], [migration.version for migration in runner.migrate()])
+        self.assertEqual(["b1", "b2", "c"], db.statements)
+        self.assertEqual([1, 2, 3], db.applied)
+
+        # Running it again does nothing
+        self.assertEqual([], runner.migrate())
+        self.assertEqual(["b1", "b2", "c"], db.statements)
+
+    def test_migrate_dry_run(self):
+        db = FakeDb()
+        runner = MigrationRunner(db, [Migration(1, "first", ["a"])])
+        self.assertEqual([1], [migration.version for migration in runner.migrate(dry_run=True)])
+        self.assertEqual([], db.statements)
+        self.assertEqual([], db.applied)
+
+    def test_migrate_stops_at_a_failure(self):
+        db = FakeDb()
+        db.failing_statements = ["b2"]
+        runner = MigrationRunner(db, [Migration(1, "first", ["a"]), Migration(2, "second", ["b1", "b2"]), Migration(3, "third", ["c"])])
+        with self.assertRaises(MigrationError) as e:
+            runner.migrate()
+        self.assertEqual("0002_second failed on statement 2 of 2: You have an error in your SQL syntax", str(e.exception))
+        self.assertEqual(["a", "b1"], db.statements)
+        # The failed migration isn't recorded, so it's run again next time
+        self.assertEqual([1], db.applied)
+
+    def test_baseline(self):
+        db = FakeDb()
+        runner = MigrationRunner(db, [Migration(1, "first", ["a"]), Migration(2, "second", ["b"]), Migration(3, "third", ["c"])])
+        runner.baseline(2)
+        self.assertEqual([], db.statements)
+        self.assertEqual([3], [migration.version for migration in runner.pending()])
@@ -0,0 +1,109 @@
+import unittest
+
+from bl import Manager
+from domain import ServiceException
+from router import MethodNotAllowedException, ROUTER, Router
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.router = Router({"paths": {
+            "/ladders/{ladder_id}/things": {
+                "get": {
+                    "operationId": "get_things",
+                    "x-tennis-ladder": {"auth": "none", "etag": True, "cacheControl": "public, max-age=5"},
+                    "parameters": [
+                        {"name": "ladder_id", "in": "path", "required": True, "schema": {"type": "integer"}},
+                        {"name": "include_old", "in": "query", "schema": {"type": "boolean", "default": False}},
+                        {"name": "name", "in": "query", "schema": {"type": "string"}},
+                        {"name": "limit", "in": "query", "schema": {"type": "integer", "minimum": 1, "maximum": 10}},
+                    ],
+                    "responses": {"200": {"content": {"application/json": {}}}},
+                },
+                "delete": {
+                    "operationId": "delete_things",
+                    "responses": {"200": {"description": "200 response"}},
+                },
+                "post": {
+                    "operationId": "create_thing",
+                    "requestBody": {},
+                    "responses": {"200": {"content": {}}},
+                },
+            }
+        }})
+
+    def test_match(self):
+        route = self.router.match("/ladders/{ladder_id}/things", "GET")
+        self.assertEqual("get_things", route.operation_id)
+        self.assertEqual("none", route.auth)
+        self.assertTrue(route.etag)
+        self.assertEqual("public, max-age=5", route.cache_control)
+        self.assertFalse(route.takes_body)
+        self.assertTrue(route.has_response_body)
+
+    def test_flags_default_to_requiring_auth(self):
+        route = self.router.match("/ladders/{ladder_id}/things", "DELETE")
+        self.assertEqual("required", route.auth)
+        self.assertFalse(route.etag)
+        self.assertFalse(route.batch)
+        self.assertEqual("no-store", route.cache_control)
+        self.assertFalse(route.has_response_body)
+        self.assertTrue(self.router.match("/ladders/{ladder_id}/things", "POST").takes_body)
+        self.assertFalse(self.router.match("/ladders/{ladder_id}/things", "POST").has_response_body)
+
+    def test_unknown_resource(self):
+        with self.assertRaises(ServiceException) as e:
+            self.router.match("/bad", "GET")
+        self.assertEqual(404, e.exception.status_code)
+
+    def test_unknown_method(self):
+        with self.assertRaises(MethodNotAllowedException) as e:
+            self.router.match("/ladders/{ladder_id}/things", "PUT")
+        self.assertEqual(405, e.exception.status_code)
+        self.assertEqual(["GET", "DELETE", "POST"], e.exception.allowed_methods)
+
+    def test_parse_arguments(self):
+        route = self.router.match("/ladders/{ladder_id}/things", "GET")
+        self.assertEqual([1, False, None, None], route.parse_arguments({"ladder_id": "1"}, {}))
+        self.assertEqual([1, True, "abc", 10], route.parse_arguments({"ladder_id": "1"}, {"include_old": "true", "name": "abc", "limit": "10"}))
+        self.assertEqual([1, False, None, None], route.parse_arguments({"ladder_id": "1"}, {"include_old": "false"}))
+        self.assertEqual([1, True, None, None], route.parse_arguments({"ladder_id": "1"}, {"include_old": "1"}))
+
+    def test_parse_arguments_from_json(self):
+        # A batch's sub-requests can pass their parameters as JSON values, instead of strings
+        route = self.router.match("/ladders/{ladder_id}/things", "GET")
+        self.assertEqual([1, True, None, 10], route.parse_arguments({"ladder_id": 1}, {"include_old": True, "limit": 10}))
+        self.assertEqual([1, False, None, None], route.parse_arguments({"ladder_id": 1}, {"include_old": False}))
+
+    def test_get_argument(self):
+        route = self.router.match("/ladders/{ladder_id}/things", "GET")
+        self.assertEqual("abc", route.get_argument([1, True, "abc", None], "name"))
+
+    def test_parse_arguments_with_invalid_values(self):
+        route = self.router.match("/ladders/{ladder_id}/things", "GET")
+        with self.assertRaises(ServiceException) as e:
+            route.parse_arguments({"ladder_id": "abc"}, {})
+        self.assertEqual((400, "Invalid ladder_id: 'abc'"), (e.exception.status_code, e.exception.error_message))
+        with self.assertRaises(ServiceException) as e:
+            route.parse_arguments({}, {})
+        self.assertEqual((400, "No ladder_id passed in"), (e.exception.status_code, e.exception.error_message))
+        for ladder_id in [[1], {"id": 1}, True, 1.5]:
+            with self.assertRaises(ServiceException) as e:
+                route.parse_arguments({"ladder_id": ladder_id}, {})
+            self.assertEqual((400, f"Invalid ladder_id: '{ladder_id}'"), (e.exception.status_code, e.exception.error_message))
+        for limit in ["0", "11"]:
+            with self.assertRaises(ServiceException) as e:
+                route.parse_arguments({"ladder_id": "1"}, {"limit": limit})
+            self.assertEqual((400, f"Invalid limit: '{limit}'"), (e.exception.status_code, e.exception.error_message))
+
+    def test_every_route_in_the_api_is_handled_by_the_manager(self):
+        for route in ROUTER.routes.values():
+            if not route.batch:
+                with self.subTest(f"{route.method} {route.resource}"):
+                    self.assertTrue(hasattr(Manager, route.operation_id))
+
+    def test_etag_routes_have_a_ladder_id(self):
+        for route in ROUTER.routes.values():
+            if route.etag:
+                with self.subTest(f"{route.method} {route.resource}"):
+                    self.assertIn("ladder_id", [p.name for p in route.parameters])
@@ -0,0 +1,88 @@
+import datetime
+import json
+import unittest
+from unittest.mock import Mock, patch
+
+import fixtures
+import serializers
+from domain import Dashboard, Match, Page, Player
+
+
+def legacy_serialize(x):
+    # What format_response used to pass as json.dumps' default
+    if isinstance(x, (datetime.datetime, datetime.date)):
+        return x.isoformat()
+    return x.__dict__
+
+
+class Test(unittest.TestCase):
+    def test_output_matches_the_dict_walk_it_replaced(self):
+        winner = fixtures.player(user_=fixtures.user(user_id="TEST1", name="One", phone_number="555"), ladder_id=1, score=20, ranking=1, wins=2)
+        loser = fixtures.player(user_=fixtures.user(user_id="TEST2", name="Two", admin=True), ladder_id=1, score=10, ranking=2, losses=2)
+        matches = [
+            Match(i, 1, datetime.datetime(2020, 1, i + 1, 3, 4, 5), "TEST1", "TEST2", 6, 0, 6, 4, None, None, 35, 4, winner, loser)
+            for i in range(3)
+        ]
+        bodies = [
+            matches,
+            [winner, loser],
+            [fixtures.ladder(1, "Ladder", datetime.date(2020, 1, 1), datetime.date(2020, 2, 1), True, 4, 2, True, False)],
+            fixtures.user(user_id="TEST1"),
+            {"error": "message"},
+            {},
+        ]
+        for body in bodies:
+            with self.subTest(type(body)):
+                self.assertEqual(json.dumps(body, default=legacy_serialize), serializers.json_dumps(body))
+                if serializers.orjson is not None:
+                    self.assertEqual(json.loads(json.dumps(body, default=legacy_serialize)), json.loads(serializers.orjson_dumps(body)))
+
+    def test_ladder_flags_are_only_included_once_set(self):
+        ladder = fixtures.ladder(ladder_id=1)
+        del ladder.logged_in_user_has_joined
+        del ladder.logged_in_user_is_admin
+        self.assertNotIn("logged_in_user_has_joined", json.loads(serializers.dumps(ladder)))
+        self.assertEqual(json.dumps(ladder, default=legacy_serialize), serializers.json_dumps(ladder))
+
+    def test_objects_that_repeat_are_only_encoded_once(self):
+        player = fixtures.player()
+        encode_player = Mock(wraps=serializers.encode_player)
+        with patch.dict(serializers.ENCODERS, {Player: encode_player}):
+            encoder = serializers.Encoder()
+            encoded = [encoder.default(player) for _ in range(3)]
+        self.assertEqual(1, encode_player.call_count)
+        self.assertIs(encoded[0], encoded[2])
+
+    def test_other_objects_fall_back_to_their_attributes(self):
+        class Other:
+            def __init__(self):
+                self.date = datetime.date(2020, 1, 2)
+                self.user = fixtures.user(user_id="TEST1")
+
+        self.assertEqual(json.dumps(Other(), default=legacy_serialize), serializers.json_dumps(Other()))
+        self.assertEqual(json.loads(json.dumps(Other(), default=legacy_serialize)), json.loads(serializers.dumps(Other())))
+
+    def test_dashboard(self):
+        winner, loser = fixtures.player(user_=fixtures.user(user_id="TEST1")), fixtures.player(user_=fixtures.user(user_id="TEST2"))
+        match = Match(1, 1, datetime.datetime(2020, 1, 2, 3, 4, 5), "TEST1", "TEST2", 6, 0, 6, 4, None, None, 35, 4, winner, loser)
+        ladder = fixtures.ladder(ladder_id=1)
+        for dumps in self.all_dumps():
+            with self.subTest(dumps.__name__):
+                encoded = json.loads(dumps(Dashboard(ladder, [winner, loser], Page([match], "next"), [match])))
+                self.assertEqual(json.loads(json.dumps(ladder, default=legacy_serialize)), encoded["ladder"])
+                self.assertEqual(json.loads(json.dumps([winner, loser], default=legacy_serialize)), encoded["players"])
+                self.assertEqual(json.loads(json.dumps([match], default=legacy_serialize)), encoded["recent_matches"])
+                self.assertEqual("next", encoded["recent_matches_next_cursor"])
+                self.assertEqual(encoded["recent_matches"], encoded["my_matches"])
+
+                # Not a player in the ladder
+                self.assertIsNone(json.loads(dumps(Dashboard(ladder, [], Page([]))))["my_matches"])
+
+    def test_falls_back_to_json_without_orjson(self):
+        body = [fixtures.player(user_=fixtures.user(user_id="TEST1")), fixtures.match(winner_id="TEST1", match_date=datetime.datetime(2020, 1, 2, 3, 4, 5, 6))]
+        with patch.object(serializers, "orjson", None):
+            self.assertEqual(json.dumps(body, default=legacy_serialize), serializers.dumps(body))
+
+    @staticmethod
+    def all_dumps():
+        return [serializers.json_dumps] + ([serializers.orjson_dumps] if serializers.orjson is not None else [])
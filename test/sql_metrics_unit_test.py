@@ -0,0 +1,113 @@
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import fixtures
+from bl import ManagerImpl
+from domain import ServiceException
+from handler import Handler
+from log import Logger
+from sql_metrics import SqlMetrics, fingerprint, redact
+from sqlite_da import SqliteDao
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.output = []
+        self.time = 0
+        self.metrics = SqlMetrics(slow_query_ms=100, clock=lambda: self.time, out=self.output.append, log=Logger(out=self.output.append))
+
+    def run_statement(self, sql, args, ms, rows=0):
+        with self.metrics.timed(sql, args) as statement:
+            self.time += ms / 1000
+            statement.rows = rows
+
+    def test_fingerprint(self):
+        self.assertEqual("select * from users where ID = ? and NAME = ? limit ?", fingerprint("select *\n  from users where ID = %s and NAME = 'Joe' limit 10"))
+        # Column names with numbers in them are kept
+        self.assertEqual("select WINNER_SET1_SCORE from matches", fingerprint("select WINNER_SET1_SCORE from matches"))
+        # Lists that grow with the values passed in have the same fingerprint at any length
+        self.assertEqual(fingerprint("select * from players where USER_ID in (%s)"), fingerprint("select * from players where USER_ID in (%s, %s, %s)"))
+        self.assertEqual(fingerprint("insert into matches (A, B) values (%s, %s)"), fingerprint("insert into matches (A, B) values (%s, %s), (%s, %s), (%s, %s)"))
+        self.assertEqual("update players set `ORDER` = CASE USER_ID WHEN ? THEN ? ... ELSE ? END where LADDER_ID = ?",
+                         fingerprint("update players set `ORDER` = CASE USER_ID WHEN %s THEN %s WHEN %s THEN %s ELSE 0 END where LADDER_ID = %s"))
+
+    def test_redact(self):
+        self.assertEqual(["str", "int", "datetime", "NoneType"], redact(("joe@example.com", 1, datetime.now(), None)))
+        self.assertEqual(["int"] * 10 + ["... (25 in total)"], redact(tuple(range(25))))
+
+    def test_emit(self):
+        self.run_statement("select * from users where ID = %s", ("USER1",), 2, 1)
+        self.run_statement("select * from users where ID = %s", ("USER2",), 4, 1)
+        self.run_statement("update players set EARNED_POINTS = %s", (5,), 10, 3)
+        metrics = self.metrics.emit("report_match", "REQUEST1")
+
+        self.assertEqual(json.loads(self.output[-1]), metrics)
+        self.assertEqual("REQUEST1", metrics["request_id"])
+        self.assertEqual(["SqlStatements", "SqlTime", "SqlRows", "SqlErrors"], [metric["Name"] for metric in metrics["_aws"]["CloudWatchMetrics"][0]["Metrics"]])
+        self.assertEqual([["Operation"]], metrics["_aws"]["CloudWatchMetrics"][0]["Dimensions"])
+        self.assertEqual("report_match", metrics["Operation"])
+        self.assertEqual(3, metrics["SqlStatements"])
+        self.assertAlmostEqual(16, metrics["SqlTime"])
+        self.assertEqual(5, metrics["SqlRows"])
+        self.assertEqual(0, metrics["SqlErrors"])
+        # Grouped by fingerprint, slowest first
+        self.assertEqual([("update players set EARNED_POINTS = ?", 1, 3), ("select * from users where ID = ?", 2, 2)],
+                         [(statement["fingerprint"], statement["count"], statement["rows"]) for statement in metrics["Statements"]])
+
+        # Each invocation starts over, and one without any SQL doesn't print anything
+        self.assertIsNone(self.metrics.emit("get_ladders"))
+        self.assertEqual(1, len(self.output))
+
+    def test_slow_queries_are_logged_without_their_values(self):
+        self.run_statement("select * from users where EMAIL = %s", ("joe@example.com",), 50)
+        self.assertEqual([], self.output)
+
+        self.run_statement("select * from users where EMAIL = %s", ("joe@example.com",), 150, 1)
+        self.assertEqual(1, len(self.output))
+        self.assertNotIn("joe@example.com", self.output[0])
+        slow_query = json.loads(self.output[0])
+        self.assertEqual({"level": "WARNING", "message": "SLOW_QUERY", "request_id": None, "operation": None, "fingerprint": "select * from users where EMAIL = ?",
+                          "caller": None, "ms": 150, "rows": 1, "args": ["str"]}, slow_query)
+
+    def test_failed_statements_are_counted_but_not_logged(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timed("insert into users (EMAIL) values (%s)", ("joe@example.com",)):
+                raise ValueError("Duplicate entry 'joe@example.com'")
+        # DaoImpl logs the error
+        self.assertEqual([], self.output)
+        self.assertEqual(1, self.metrics.emit("update_user")["SqlErrors"])
+
+    def test_failed_dao_statements_are_logged_once(self):
+        dao = SqliteDao()
+        dao.metrics = self.metrics
+        dao.create_user(fixtures.user(user_id="USER1"))
+        with patch("da.LOG", Logger(out=self.output.append)):
+            self.assertRaises(ServiceException, lambda: dao.create_user(fixtures.user(user_id="USER1")))
+        self.assertEqual(["ERROR"], [json.loads(line)["level"] for line in self.output])
+        self.assertEqual(1, self.metrics.emit("create_user")["SqlErrors"])
+
+    def test_statements_are_recorded_with_the_manager_method_that_ran_them(self):
+        dao = SqliteDao()
+        dao.metrics = self.metrics
+        dao.create_user(fixtures.user(user_id="USER1"))
+        firebase_client = MagicMock()
+        firebase_client.get_firebase_user.return_value = {"user_id": "USER1"}
+        manager = ManagerImpl(firebase_client, dao)
+        manager.validate_token("token")
+        manager.get_ladders()
+
+        callers = {statement["caller"] for statement in self.metrics.emit("get_ladders")["Statements"]}
+        self.assertEqual({None, "validate_token", "get_ladders"}, callers)
+
+    def test_handler_emits_the_metrics_for_each_invocation(self):
+        manager = ManagerImpl(MagicMock(), SqliteDao())
+        manager.dao.metrics = self.metrics
+        handler = Handler(manager, self.metrics)
+        self.output.clear()
+
+        handler.handle({"resource": "/ladders", "httpMethod": "GET", "requestContext": {"requestId": "REQUEST1"}})
+        self.assertEqual(("get_ladders", "REQUEST1"), tuple(json.loads(self.output[-1])[field] for field in ["Operation", "request_id"]))
+        handler.handle({"decrement-borrowed-points": True})
+        self.assertEqual("decrement_borrowed_points", json.loads(self.output[-1])["Operation"])
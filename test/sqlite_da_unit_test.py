@@ -0,0 +1,32 @@
+import os
+import re
+import tempfile
+import unittest
+
+from dao_contract import DaoContract
+from domain import User
+from migrate import load_migrations
+from sqlite_da import SqliteDao
+
+
+class Test(DaoContract, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dao = SqliteDao()
+
+    def test_file_database_keeps_its_data(self):
+        with tempfile.TemporaryDirectory() as path:
+            dao = SqliteDao(os.path.join(path, "ladder.db"))
+            dao.create_user(User("FILE1", "File Tester", "file1@mail.com", None, None, None, False))
+            dao.db.close()
+
+            # The schema is only created the first time
+            dao = SqliteDao(os.path.join(path, "ladder.db"))
+            self.assertEqual("File Tester", dao.get_user("FILE1").name)
+            dao.db.close()
+
+    def test_schema_has_every_table_from_the_migrations(self):
+        tables = {match.lower() for migration in load_migrations() for statement in migration.statements
+                  for match in re.findall(r"create (?:table|(?:or replace )?view) (?:if not exists )?`?(\w+)`?", statement, re.IGNORECASE)}
+        sqlite_tables = set(self.dao.get_list(str, "select name from sqlite_master where type in ('table', 'view') and name not like 'sqlite_%'"))
+        self.assertEqual(sorted(tables), sorted(sqlite_tables))
@@ -13,6 +13,18 @@ import bl_integration_test
 import da_integration_test
 import domain_unit_test
 import misc_test
+import cache_unit_test
+import caching_dao_unit_test
+import firebase_client_unit_test
+import db_unit_test
+import router_unit_test
+import serializers_unit_test
+import migrate_unit_test
+import dataset_unit_test
+import sqlite_da_unit_test
+import sql_metrics_unit_test
+import log_unit_test
+import explain_integration_test
 
 loader = unittest.TestLoader()
 suite = unittest.TestSuite()
@@ -23,6 +35,19 @@ suite.addTests(loader.loadTestsFromTestCase(bl_integration_test.Test))
 suite.addTests(loader.loadTestsFromTestCase(da_integration_test.Test))
 suite.addTests(loader.loadTestsFromTestCase(domain_unit_test.Test))
 suite.addTests(loader.loadTestsFromTestCase(misc_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(cache_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(caching_dao_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(firebase_client_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(firebase_client_unit_test.LocalFirebaseClientTest))
+suite.addTests(loader.loadTestsFromTestCase(db_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(router_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(serializers_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(migrate_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(dataset_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(sqlite_da_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(sql_metrics_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(log_unit_test.Test))
+suite.addTests(loader.loadTestsFromTestCase(explain_integration_test.Test))
 
 result = unittest.TextTestRunner(verbosity=3).run(suite)
 exit(0 if result.wasSuccessful() else 1)